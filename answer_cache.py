@@ -0,0 +1,240 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import hashlib
+import importlib
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Text, Tuple
+
+from .config import Config
+from .metrics import REGISTRY
+from .serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+hits_counter = REGISTRY.counter(
+    "answer_cache_hits_total", "Messages answered from the answer cache."
+)
+misses_counter = REGISTRY.counter(
+    "answer_cache_misses_total",
+    "Cacheable messages that had to be sent to the answer backend.",
+)
+
+ALL_INTENTS = "*"
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: Text) -> Text:
+    """
+    Case- and spacing-insensitive form of a message text or button payload.
+    """
+    return WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def get_intent(normalized_text: Text) -> Text:
+    """
+    Returns the intent a message asks for: the intent name of a Rasa
+    payload such as /select_option{"id": 2}, or else the text itself.
+    """
+    if normalized_text.startswith("/"):
+        return normalized_text[1:].split("{", 1)[0]
+    return normalized_text
+
+
+def parse_intents(value: Text) -> FrozenSet[Text]:
+    return frozenset(
+        normalize_text(intent) for intent in value.split(",") if intent.strip()
+    )
+
+
+def load_state_key(path: Text) -> Callable | None:
+    """
+    Imports the package.module:function named by ANSWER_CACHE_STATE_KEY.
+    """
+    if not path:
+        return None
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+@dataclass
+class CachedAnswerBackend:
+    """
+    Answer backend wrapper that reuses the answers to deterministic turns.
+
+    The cache key is the normalized message text (or button payload) plus,
+    when state_key is given, state_key(message, sender_id), e.g. the step of
+    the survey the contact is in. Only intents in intents are cached ("*"
+    for all), minus those in excluded_intents; the intent of "/name{...}"
+    payloads is their name and of any other message its normalized text.
+
+    Answers are kept in a TTL LRU in the process and, with a Redis client,
+    in Redis with the same TTL, so every worker benefits from a single
+    backend call. Redis errors fall back to the backend. Cached answers are
+    shared between contacts, so they must be treated as read-only.
+    """
+
+    backend: Any
+    intents: FrozenSet[Text] = field(
+        default_factory=lambda: parse_intents(Config.ANSWER_CACHE_INTENTS)
+    )
+    excluded_intents: FrozenSet[Text] = field(
+        default_factory=lambda: parse_intents(Config.ANSWER_CACHE_EXCLUDED_INTENTS)
+    )
+    state_key: Callable[[Any, Text], Text | None] | None = field(
+        default_factory=lambda: load_state_key(Config.ANSWER_CACHE_STATE_KEY)
+    )
+    ttl: float = Config.ANSWER_CACHE_TTL
+    maxsize: int = Config.ANSWER_CACHE_SIZE
+    redis_client: Any = None
+    key_prefix: Text = "answer_cache:"
+
+    def __post_init__(self):
+        self._answers: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_cacheable(self, intent: Text) -> bool:
+        if intent in self.excluded_intents:
+            return False
+        return ALL_INTENTS in self.intents or intent in self.intents
+
+    def cache_key(self, message: Any, sender_id: Text) -> Tuple | None:
+        """
+        Returns the cache key of message, or None when it must not be cached.
+        """
+        if not message.text or getattr(message, "media_id", ""):
+            # Captions of media messages depend on the media.
+            return None
+        text = normalize_text(message.text)
+        if not self.is_cacheable(get_intent(text)):
+            return None
+        state = self.state_key(message, sender_id) if self.state_key else None
+        return (text, state)
+
+    def _redis_key(self, key: Tuple) -> Text:
+        return self.key_prefix + hashlib.sha1(dumps(key)).hexdigest()
+
+    def _get_local(self, key: Tuple) -> List[Dict] | None:
+        with self._lock:
+            cached = self._answers.get(key)
+            if cached is None:
+                return None
+            expires_at, answers = cached
+            if expires_at <= time.monotonic():
+                del self._answers[key]
+                return None
+            self._answers.move_to_end(key)
+            return answers
+
+    def _set_local(self, key: Tuple, answers: List[Dict], ttl: float):
+        with self._lock:
+            self._answers[key] = (time.monotonic() + ttl, answers)
+            self._answers.move_to_end(key)
+            if len(self._answers) > self.maxsize:
+                self._answers.popitem(last=False)
+
+    def _shareable(self, answers: List[Dict]) -> List[Dict]:
+        # recipient_id names the contact who got the answers first.
+        return [
+            {name: value for name, value in answer.items() if name != "recipient_id"}
+            for answer in answers
+        ]
+
+    def _get_remote(self, key: Tuple) -> Tuple[List[Dict] | None, float]:
+        """
+        Returns the answers stored in Redis and their remaining TTL.
+        """
+        try:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            pipeline.get(self._redis_key(key))
+            pipeline.pttl(self._redis_key(key))
+            encoded, ttl = pipeline.execute()
+        except Exception:
+            logger.exception("Could not read the answer cache on Redis")
+            return None, 0
+        if encoded is None:
+            return None, 0
+        return loads(encoded), max(ttl, 0) / 1000
+
+    def _set_remote(self, key: Tuple, answers: List[Dict]):
+        try:
+            self.redis_client.set(
+                self._redis_key(key), dumps(answers), px=int(self.ttl * 1000)
+            )
+        except Exception:
+            logger.exception("Could not write the answer cache on Redis")
+
+    def get_answers_to_message(self, message: Any, sender_id: Text = "") -> List[Dict]:
+        key = self.cache_key(message, sender_id)
+        if key is None:
+            return self.backend.get_answers_to_message(message, sender_id)
+        answers = self._get_local(key)
+        if answers is None and self.redis_client is not None:
+            answers, ttl = self._get_remote(key)
+            if answers is not None:
+                self._set_local(key, answers, ttl)
+        if answers is not None:
+            hits_counter.inc()
+            return answers
+        misses_counter.inc()
+        answers = self.backend.get_answers_to_message(message, sender_id)
+        if answers:
+            answers = self._shareable(answers)
+            self._set_local(key, answers, self.ttl)
+            if self.redis_client is not None:
+                self._set_remote(key, answers)
+        return answers
+
+
+@dataclass
+class AsyncCachedAnswerBackend(CachedAnswerBackend):
+    """
+    asyncio version of CachedAnswerBackend, wrapping an async backend and
+    an async Redis client.
+    """
+
+    async def _get_remote(self, key: Tuple) -> Tuple[List[Dict] | None, float]:
+        try:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            pipeline.get(self._redis_key(key))
+            pipeline.pttl(self._redis_key(key))
+            encoded, ttl = await pipeline.execute()
+        except Exception:
+            logger.exception("Could not read the answer cache on Redis")
+            return None, 0
+        if encoded is None:
+            return None, 0
+        return loads(encoded), max(ttl, 0) / 1000
+
+    async def _set_remote(self, key: Tuple, answers: List[Dict]):
+        try:
+            await self.redis_client.set(
+                self._redis_key(key), dumps(answers), px=int(self.ttl * 1000)
+            )
+        except Exception:
+            logger.exception("Could not write the answer cache on Redis")
+
+    async def get_answers_to_message(
+        self, message: Any, sender_id: Text = ""
+    ) -> List[Dict]:
+        key = self.cache_key(message, sender_id)
+        if key is None:
+            return await self.backend.get_answers_to_message(message, sender_id)
+        answers = self._get_local(key)
+        if answers is None and self.redis_client is not None:
+            answers, ttl = await self._get_remote(key)
+            if answers is not None:
+                self._set_local(key, answers, ttl)
+        if answers is not None:
+            hits_counter.inc()
+            return answers
+        misses_counter.inc()
+        answers = await self.backend.get_answers_to_message(message, sender_id)
+        if answers:
+            answers = self._shareable(answers)
+            self._set_local(key, answers, self.ttl)
+            if self.redis_client is not None:
+                await self._set_remote(key, answers)
+        return answers
@@ -0,0 +1,283 @@
+"""
+ASGI entry point exposing the same /webhooks/whatsapp/webhook contract as
+server.py, using asyncio clients. Run it with any ASGI server, for example:
+
+    uvicorn whatsapp_api_integration.asgi:app --port 5006
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict, List, Set
+from urllib.parse import parse_qs
+
+from .backends import get_async_answer_backend
+from .classifier import MESSAGE, classify_webhook
+from .clients.async_http import get_async_http_pool
+from .clients.circuit_breaker import CircuitOpenError
+from .clients.registry import get_client_registry
+from .coalescing import AsyncMessageCoalescer
+from .config import Config
+from .deadline import DeadlineExceeded, deadline_scope
+from .idempotency import get_async_idempotency_guard
+from .lifecycle import init_async_worker
+from .message import MediaMessage
+from .metrics import (
+    PROMETHEUS_CONTENT_TYPE,
+    REGISTRY,
+    exposition,
+    get_multiprocess_metrics,
+)
+from .outbound.streams import get_async_outbound_queue
+from .serialization import loads
+from .wpp_event import (
+    WhatsAppEvent,
+    WhatsAppEventBatch,
+    coalesce_events,
+    iter_message_ids,
+)
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/webhooks/whatsapp/webhook"
+METRICS_PATH = "/metrics"
+
+# Keeps a reference to the events being answered after the response was sent.
+background_tasks: Set[asyncio.Task] = set()
+message_coalescer: AsyncMessageCoalescer | None = None
+skipped_sends_counter = REGISTRY.counter(
+    "whatsapp_send_skipped_total",
+    "Answers not sent because the event deadline was spent or the provider circuit was open.",
+)
+decode_histogram = REGISTRY.histogram(
+    "webhook_decode_seconds", "Time to classify and decode a webhook body."
+)
+event_build_histogram = REGISTRY.histogram(
+    "whatsapp_event_build_seconds",
+    "Time to split a webhook delivery into WhatsApp events.",
+)
+backend_histogram = REGISTRY.histogram(
+    "answer_backend_seconds", "Time the answer backend took to answer a message."
+)
+parser_histogram = REGISTRY.histogram(
+    "answer_parser_seconds", "Time to convert the answers to provider payloads."
+)
+
+
+async def answer_whatsapp_event(whatsapp_event: WhatsAppEvent):
+    """
+    Sends the WhatsApp event message to the answer backend and
+    delivers the answers back to the contact.
+    """
+    with deadline_scope():
+        message = whatsapp_event.get_event_message()
+        if Config.MEDIA_DOWNLOAD_DIR and isinstance(message, MediaMessage):
+            # Media transfers use the sync clients, off the event loop.
+            message.path = await asyncio.to_thread(
+                whatsapp_event.wpp_client.download_media,
+                message.media_id,
+                Config.MEDIA_DOWNLOAD_DIR,
+                message.sha256,
+            )
+        with backend_histogram.time():
+            answers = await get_async_answer_backend().get_answers_to_message(
+                message, whatsapp_event.contact.phone
+            )
+        with parser_histogram.time():
+            # Parsing may upload local media files with the sync clients.
+            wpp_messages = await asyncio.to_thread(
+                whatsapp_event.parser_class(
+                    answers, whatsapp_event.contact.phone
+                ).parse_messages
+            )
+        if Config.OUTBOUND_QUEUE_ENABLED:
+            await get_async_outbound_queue().enqueue(
+                whatsapp_event.provider, wpp_messages
+            )
+            return
+        dispatcher = get_client_registry().async_outbound_dispatcher(
+            whatsapp_event.provider
+        )
+        for result in (await dispatcher.dispatch(wpp_messages)).values():
+            if logger.isEnabledFor(logging.INFO):
+                for response in result.responses:
+                    logger.info("NEW REQUEST TO WHATSAPP: \n %s", response.text)
+            if isinstance(result.error, (DeadlineExceeded, CircuitOpenError)):
+                skipped_sends_counter.inc(result.total - result.sent)
+                logger.warning(
+                    "Skipping %s answers to WhatsApp: %s",
+                    result.total - result.sent,
+                    result.error,
+                )
+            if result.error:
+                # The event fails and its message id is released, so a
+                # redelivery is answered again.
+                raise result.error
+
+
+async def answer_contact_events(whatsapp_events: List[WhatsAppEvent]) -> bool:
+    answered = True
+    for whatsapp_event in whatsapp_events:
+        try:
+            await answer_whatsapp_event(whatsapp_event)
+        except Exception:
+            logger.exception("Could not answer WhatsApp message")
+            answered = False
+            idempotency_guard = get_async_idempotency_guard()
+            if idempotency_guard:
+                await idempotency_guard.forget(whatsapp_event.get_event_message_id())
+    return answered
+
+
+async def answer_coalesced_events(whatsapp_events: List[WhatsAppEvent]):
+    """
+    Answers the messages a contact sent within Config.COALESCE_WINDOW,
+    merging consecutive texts into one backend call. If any answer fails,
+    every message id is released so redeliveries are answered again.
+    """
+    try:
+        for whatsapp_event in coalesce_events(whatsapp_events):
+            await answer_whatsapp_event(whatsapp_event)
+    except Exception:
+        logger.exception("Could not answer WhatsApp message")
+        idempotency_guard = get_async_idempotency_guard()
+        if idempotency_guard:
+            for whatsapp_event in whatsapp_events:
+                await idempotency_guard.forget(whatsapp_event.get_event_message_id())
+
+
+def get_message_coalescer() -> AsyncMessageCoalescer:
+    global message_coalescer
+    if message_coalescer is None:
+        message_coalescer = AsyncMessageCoalescer(handler=answer_coalesced_events)
+    return message_coalescer
+
+
+async def process_whatsapp_event(event: Dict, body: bytes = b"") -> bool:
+    """
+    Answers every message of a webhook delivery. Messages of different
+    contacts are answered concurrently, messages of the same contact in order.
+    Returns False when an answer failed.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("NEW WHATSAPP EVENT: \n %s", body.decode(errors="replace"))
+    idempotency_guard = get_async_idempotency_guard()
+    accept_message = None
+    if idempotency_guard:
+        new_message_ids = {
+            message_id
+            for message_id in iter_message_ids(event)
+            if await idempotency_guard.first_seen(message_id)
+        }
+        accept_message = new_message_ids.__contains__
+    with event_build_histogram.time():
+        batch = WhatsAppEventBatch(event, accept_message=accept_message)
+    if Config.COALESCE_WINDOW > 0:
+        coalescer = get_message_coalescer()
+        for whatsapp_event in batch.events:
+            coalescer.submit(whatsapp_event.contact.phone, whatsapp_event)
+        return True
+    events_by_contact: Dict[str, List[WhatsAppEvent]] = {}
+    for whatsapp_event in batch.events:
+        events_by_contact.setdefault(whatsapp_event.contact.phone, []).append(
+            whatsapp_event
+        )
+    answered = await asyncio.gather(
+        *(answer_contact_events(events) for events in events_by_contact.values())
+    )
+    return all(answered)
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_response(
+    send,
+    status: int,
+    body: str | bytes,
+    content_type: str = "text/plain; charset=utf-8",
+):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode())],
+        }
+    )
+    if isinstance(body, str):
+        body = body.encode()
+    await send({"type": "http.response.body", "body": body})
+
+
+async def verify_webhook(scope, send):
+    query = parse_qs(scope.get("query_string", b"").decode())
+    if query.get("hub.verify_token", [None])[0] != os.getenv("WPP_VERIFY_TOKEN", ""):
+        return await send_response(send, 500, "Invalid verify token")
+    return await send_response(send, 200, query.get("hub.challenge", [""])[0])
+
+
+async def respond_to_whatsapp_event(receive, send):
+    body = await read_body(receive)
+    with decode_histogram.time():
+        event_class = classify_webhook(body)
+        event = None
+        if event_class == MESSAGE:
+            try:
+                event = loads(body)
+            except ValueError:
+                pass
+    if event_class != MESSAGE:
+        logger.debug("Ignoring %s WhatsApp event", event_class)
+        return await send_response(send, 200, "ok")
+    if not isinstance(event, dict):
+        return await send_response(send, 400, "Invalid WhatsApp event")
+    if Config.WEBHOOK_ASYNC_MODE:
+        if len(background_tasks) >= Config.WEBHOOK_QUEUE_SIZE:
+            return await send_response(send, 503, "Webhook queue is full")
+        task = asyncio.create_task(process_whatsapp_event(event, body))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    elif not await process_whatsapp_event(event, body):
+        return await send_response(send, 500, "Could not answer WhatsApp message")
+    return await send_response(send, 200, "ok")
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await init_async_worker()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if background_tasks:
+                await asyncio.gather(*background_tasks, return_exceptions=True)
+            if message_coalescer is not None:
+                await message_coalescer.flush()
+            await get_async_http_pool().aclose()
+            multiprocess_metrics = get_multiprocess_metrics()
+            if multiprocess_metrics:
+                multiprocess_metrics.write(running=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    if scope["path"] == METRICS_PATH and scope["method"] == "GET":
+        return await send_response(send, 200, exposition(), PROMETHEUS_CONTENT_TYPE)
+    if scope["path"] != WEBHOOK_PATH:
+        return await send_response(send, 404, "Not found")
+    if scope["method"] == "GET":
+        return await verify_webhook(scope, send)
+    if scope["method"] == "POST":
+        return await respond_to_whatsapp_event(receive, send)
+    return await send_response(send, 405, "Method not allowed")
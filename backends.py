@@ -0,0 +1,230 @@
+"""
+Answer backends: services that decide what to reply to a WhatsApp message.
+
+A backend has a get_answers_to_message(message, sender_id) method returning
+a list of Rasa-style messages ({"text": ..., "buttons": [...]}), awaitable in
+the async variants. Config.ANSWER_BACKEND picks the backend of the process:
+
+    fake              parsers.cloud_api.RasaBackend, fixed answers for tests
+    rasa              RasaRestBackend, Rasa REST channel at RASA_REST_URL
+    package.module:Class  any other backend, built without arguments
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import importlib
+import threading
+from typing import Any, Dict, List, Text, Tuple
+from weakref import WeakKeyDictionary
+
+from .answer_cache import AsyncCachedAnswerBackend, CachedAnswerBackend
+from .clients.async_http import get_async_http_pool
+from .clients.circuit_breaker import CircuitBreaker, get_circuit_breaker
+from .clients.http import get_http_pool, get_timeout
+from .clients.registry import get_client_registry
+from .config import Config
+from .deadline import DeadlineExceeded, clip_timeout, remaining_time
+from .message import (
+    InteractiveMessage,
+    MediaMessage,
+    NotSupportedMessage,
+    TextMessage,
+)
+from .parsers.cloud_api import AsyncRasaBackend, RasaBackend
+from .serialization import dumps, loads
+
+
+class AnswerBackendError(Exception):
+    pass
+
+
+@dataclass
+class RasaRestBackend:
+    """
+    Asks a Rasa server for the answers through its REST channel.
+
+    Requests go through the process HTTP pool with the "rasa" endpoint
+    timeouts, clipped by the event deadline. At most max_concurrency calls
+    are in flight per process, so a burst of webhooks queues here instead of
+    piling up on the Rasa cluster; a call that cannot start before the
+    deadline raises DeadlineExceeded. Calls are not retried, since Rasa
+    would process the message twice.
+    """
+
+    url: Text = Config.RASA_REST_URL
+    max_concurrency: int = Config.ANSWER_BACKEND_CONCURRENCY
+    timeout: Tuple[float, float] = field(default_factory=lambda: get_timeout("rasa"))
+    circuit_breaker: CircuitBreaker = field(
+        default_factory=lambda: get_circuit_breaker("rasa")
+    )
+    headers: Dict[Text, Text] = field(
+        default_factory=lambda: {"Content-Type": "application/json"}
+    )
+
+    def __post_init__(self):
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def _build_request(
+        self,
+        message: InteractiveMessage | TextMessage | MediaMessage | NotSupportedMessage,
+        sender_id: Text,
+    ) -> bytes:
+        request = {"sender": sender_id, "message": message.text}
+        if isinstance(message, MediaMessage):
+            # Rasa reads metadata from the REST channel into the user message.
+            request["metadata"] = {
+                "media": {
+                    "type": message.media_type,
+                    "id": message.media_id,
+                    "mime_type": message.mime_type,
+                    "path": message.path,
+                }
+            }
+        return dumps(request)
+
+    def _parse_response(self, status_code: int, content: bytes) -> List[Dict]:
+        if status_code >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+        if status_code != 200:
+            raise AnswerBackendError(f"Rasa returned {status_code}")
+        answers = loads(content)
+        if not isinstance(answers, list):
+            raise AnswerBackendError("Rasa returned an invalid answer")
+        return answers
+
+    def get_answers_to_message(
+        self,
+        message: InteractiveMessage | TextMessage | MediaMessage | NotSupportedMessage,
+        sender_id: Text = "",
+    ) -> List[Dict]:
+        """Returns a list of Rasa messages to send back to WhatsApp."""
+        if not message.text and not isinstance(message, MediaMessage):
+            return []
+        if not self._slots.acquire(timeout=remaining_time()):
+            raise DeadlineExceeded("No time left to call the answer backend")
+        try:
+            # Clipped before the circuit breaker, so a deadline spent here
+            # does not count as a failure of Rasa.
+            timeout = clip_timeout(self.timeout)
+            self.circuit_breaker.before_call()
+            try:
+                response = get_http_pool().post(
+                    self.url,
+                    data=self._build_request(message, sender_id),
+                    headers=self.headers,
+                    timeout=timeout,
+                )
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+        finally:
+            self._slots.release()
+        return self._parse_response(response.status_code, response.content)
+
+
+@dataclass
+class AsyncRasaRestBackend(RasaRestBackend):
+    """
+    asyncio version of RasaRestBackend. The concurrency cap applies to each
+    event loop of the process.
+    """
+
+    def __post_init__(self):
+        self._loop_slots: WeakKeyDictionary = WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._loop_slots.get(loop)
+        if semaphore is None:
+            semaphore = self._loop_slots[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def get_answers_to_message(
+        self,
+        message: InteractiveMessage | TextMessage | MediaMessage | NotSupportedMessage,
+        sender_id: Text = "",
+    ) -> List[Dict]:
+        if not message.text and not isinstance(message, MediaMessage):
+            return []
+        semaphore = self._semaphore()
+        if semaphore.locked():
+            try:
+                await asyncio.wait_for(semaphore.acquire(), remaining_time())
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("No time left to call the answer backend")
+        else:
+            await semaphore.acquire()
+        try:
+            # Clipped before the circuit breaker, so a deadline spent here
+            # does not count as a failure of Rasa.
+            timeout = clip_timeout(self.timeout)
+            self.circuit_breaker.before_call()
+            try:
+                response = await get_async_http_pool().post(
+                    self.url,
+                    data=self._build_request(message, sender_id),
+                    headers=self.headers,
+                    timeout=timeout,
+                )
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+        finally:
+            semaphore.release()
+        return self._parse_response(response.status_code, response.content)
+
+
+BACKENDS = {
+    "fake": (RasaBackend, AsyncRasaBackend),
+    "rasa": (RasaRestBackend, AsyncRasaRestBackend),
+}
+
+
+def load_backend_class(name: Text, asynchronous: bool = False):
+    """
+    Returns the backend class named by Config.ANSWER_BACKEND.
+    """
+    if name in BACKENDS:
+        return BACKENDS[name][asynchronous]
+    module_name, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError(f"Unknown answer backend: {name}")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+_answer_backend: Any = None
+_async_answer_backend: Any = None
+
+
+def get_answer_backend():
+    """
+    Returns the answer backend shared by the process, wrapped by the answer
+    cache when ANSWER_CACHE_INTENTS is set.
+    """
+    global _answer_backend
+    if _answer_backend is None:
+        backend = load_backend_class(Config.ANSWER_BACKEND)()
+        if Config.ANSWER_CACHE_INTENTS:
+            redis_client = None
+            if Config.ANSWER_CACHE_BACKEND == "redis":
+                redis_client = get_client_registry().redis_client()
+            backend = CachedAnswerBackend(backend, redis_client=redis_client)
+        _answer_backend = backend
+    return _answer_backend
+
+
+def get_async_answer_backend():
+    global _async_answer_backend
+    if _async_answer_backend is None:
+        backend = load_backend_class(
+            Config.ASYNC_ANSWER_BACKEND or Config.ANSWER_BACKEND, asynchronous=True
+        )()
+        if Config.ANSWER_CACHE_INTENTS:
+            redis_client = None
+            if Config.ANSWER_CACHE_BACKEND == "redis":
+                redis_client = get_client_registry().async_redis_client()
+            backend = AsyncCachedAnswerBackend(backend, redis_client=redis_client)
+        _async_answer_backend = backend
+    return _async_answer_backend
@@ -0,0 +1,88 @@
+"""
+Runs the benchmark suites and optionally compares them with a previous run:
+
+    python -m whatsapp_api_integration.benchmarks --output results.json
+    python -m whatsapp_api_integration.benchmarks --compare results.json
+
+The process exits with status 1 when a metric regressed by more than
+--threshold, so it can gate a CI job.
+"""
+
+import argparse
+import sys
+from typing import Dict, Text
+
+from . import events, parsers, results, webhook
+
+SUITES = {
+    "events": events.run,
+    "parsers": parsers.run,
+    "webhook": webhook.run,
+}
+
+
+def print_results(document: Dict):
+    for benchmark, metrics in document["results"].items():
+        formatted = "  ".join(
+            f"{metric}={value:.2f}" for metric, value in metrics.items()
+        )
+        print(f"{benchmark:32} {formatted}")
+
+
+def print_comparison(comparisons, threshold: float) -> bool:
+    regressed = False
+    for comparison in comparisons:
+        marker = ""
+        if comparison.is_regression(threshold):
+            marker = "  REGRESSION"
+            regressed = True
+        print(
+            f"{comparison.benchmark:32} {comparison.metric:18} "
+            f"{comparison.baseline:10.2f} -> {comparison.current:10.2f} "
+            f"({comparison.change:+.1%} worse){marker}"
+        )
+    return regressed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m whatsapp_api_integration.benchmarks"
+    )
+    parser.add_argument(
+        "suites",
+        nargs="*",
+        metavar="suite",
+        help=f"suites to run, all by default: {', '.join(SUITES)}",
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="results JSON file of a previous run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="relative change counted as a regression (default 0.10)",
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    measured: Dict[Text, Dict] = {}
+    for suite in args.suites or SUITES:
+        measured.update(SUITES[suite]())
+    document = results.build_document(measured)
+    print_results(document)
+    if args.output:
+        results.save(document, args.output)
+    if args.compare:
+        baseline = results.load(args.compare)
+        print(
+            f"\nCompared with {args.compare} (commit {baseline.get('commit') or '?'}):"
+        )
+        if print_comparison(results.compare(baseline, document), args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
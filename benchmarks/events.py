@@ -0,0 +1,118 @@
+"""
+Micro-benchmark of WhatsApp event decoding.
+
+Measures CPU time and memory allocated to build a WhatsAppEvent and read its
+message and contact, for Cloud API and Serpro payloads. Run it alone with:
+
+    python -m whatsapp_api_integration.benchmarks.events
+"""
+
+from typing import Dict
+
+from ..wpp_event import WhatsAppEvent, WhatsAppEventBatch
+from .measure import measure
+
+CLOUD_API_EVENT: Dict = {
+    "object": "whatsapp_business_account",
+    "entry": [
+        {
+            "id": "110115228401530",
+            "changes": [
+                {
+                    "field": "messages",
+                    "value": {
+                        "messaging_product": "whatsapp",
+                        "metadata": {
+                            "display_phone_number": "15550000000",
+                            "phone_number_id": "138808512639290",
+                        },
+                        "contacts": [
+                            {"profile": {"name": "Maria"}, "wa_id": "556199999999"}
+                        ],
+                        "messages": [
+                            {
+                                "from": "556199999999",
+                                "id": "wamid.HBgMNTU2MTk5OTk5OTk5FQIAEhggQTg",
+                                "timestamp": "1718000000",
+                                "type": "interactive",
+                                "interactive": {
+                                    "type": "button_reply",
+                                    "button_reply": {
+                                        "id": "Concordar",
+                                        "title": "Concordar",
+                                    },
+                                },
+                            }
+                        ],
+                    },
+                }
+            ],
+        }
+    ],
+}
+
+SERPRO_EVENT: Dict = {
+    "contacts": [{"profile": {"name": "Maria"}, "wa_id": "556199999999"}],
+    "messages": [
+        {
+            "from": "556199999999",
+            "id": "wamid.HBgMNTU2MTk5OTk5OTk5FQIAEhggQTk",
+            "timestamp": "1718000000",
+            "type": "text",
+            "text": {"body": "Olá"},
+        }
+    ],
+}
+
+
+def batch_event(count: int) -> Dict:
+    """
+    Returns CLOUD_API_EVENT carrying count messages of different contacts.
+    """
+    value = CLOUD_API_EVENT["entry"][0]["changes"][0]["value"]
+    contacts, messages = [], []
+    for index in range(count):
+        wa_id = f"5561999{index:05d}"
+        contacts.append({"profile": {"name": f"Contato {index}"}, "wa_id": wa_id})
+        messages.append({**value["messages"][0], "from": wa_id, "id": f"wamid.{index}"})
+    change = {
+        "field": "messages",
+        "value": {**value, "contacts": contacts, "messages": messages},
+    }
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "110115228401530", "changes": [change]}],
+    }
+
+
+def decode_single(event: Dict):
+    whatsapp_event = WhatsAppEvent(event=event)
+    whatsapp_event.get_event_message()
+    whatsapp_event.get_event_message_id()
+    whatsapp_event.contact.phone
+    return whatsapp_event
+
+
+def decode_batch(event: Dict):
+    batch = WhatsAppEventBatch(event)
+    for whatsapp_event in batch.events:
+        whatsapp_event.get_event_message()
+        whatsapp_event.contact.phone
+    return batch
+
+
+def run() -> Dict[str, Dict]:
+    return {
+        "cloud_api_event": measure(decode_single, CLOUD_API_EVENT),
+        "cloud_api_batch": measure(decode_batch, CLOUD_API_EVENT),
+        "cloud_api_batch_10": measure(decode_batch, batch_event(10), number=2000),
+        "serpro_event": measure(decode_single, SERPRO_EVENT),
+    }
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(
+            f"{name:20} {result['us_per_call']:8.2f} us/event "
+            f"{result['bytes_per_call']:8.0f} B/event"
+        )
@@ -0,0 +1,58 @@
+"""
+Timing helpers shared by the benchmarks.
+"""
+
+import gc
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Text
+
+
+def measure(
+    function: Callable, argument: Any, number: int = 20000
+) -> Dict[Text, float]:
+    """
+    Returns the best CPU time of function(argument) over five rounds and the
+    memory held by the objects it returns, with argument excluded.
+    """
+    function(argument)
+    timer = timeit.Timer(lambda: function(argument))
+    seconds = min(timer.repeat(repeat=5, number=number)) / number
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    kept = [function(argument) for _ in range(1000)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {
+        "us_per_call": seconds * 1e6,
+        "bytes_per_call": (after - before) / 1000,
+    }
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(
+        len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1)
+    )
+    return sorted_values[index]
+
+
+def latency_summary(latencies: List[float], elapsed: float) -> Dict[Text, float]:
+    """
+    Summarizes request latencies, in seconds, measured during elapsed seconds.
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "events_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark of the messages parsers.
+
+Measures parse_messages for a text answer, a 3-button answer and a list
+answer, for both providers. Each case runs with a warm payload cache, the
+steady state of a survey bot, and with caching disabled, the cost of a new
+answer. Run it alone with:
+
+    python -m whatsapp_api_integration.benchmarks.parsers
+"""
+
+from typing import Dict, List, Text
+
+from ..parsers.cache import PayloadCache
+from ..parsers.cloud_api import CloudApiMessagesParser
+from ..parsers.serpro import SerproApiMessagesParser
+from .measure import measure
+
+RECIPIENT_PHONE = "+5561999999999"
+
+TEXT_ANSWER: List[Dict] = [
+    {
+        "recipient_id": RECIPIENT_PHONE,
+        "text": "Eu perguntei para algumas pessoas o que elas acham sobre "
+        "o seguinte assunto:\nO que pode ser feito para superar os desafios da "
+        "transformação digital do governo?",
+    }
+]
+
+BUTTONS_ANSWER: List[Dict] = [
+    {
+        "recipient_id": RECIPIENT_PHONE,
+        "text": "Simplicidade, simplicidade e sim+pli+ci+da+de. Ser digital "
+        "não significa ser complexo.\n O que você acha disso (0/97)?",
+        "buttons": [
+            {"title": "Concordar", "payload": "Concordar"},
+            {"title": "Discordar", "payload": "Discordar"},
+            {"title": "Pular", "payload": "Pular"},
+        ],
+    }
+]
+
+LIST_ANSWER: List[Dict] = [
+    {
+        "recipient_id": RECIPIENT_PHONE,
+        "text": "Escolha uma conversa para participar:",
+        "buttons": [
+            {"title": f"Conversa {index}", "payload": f"/select_conversation{index}"}
+            for index in range(8)
+        ],
+    }
+]
+
+ANSWERS: Dict[Text, List[Dict]] = {
+    "text": TEXT_ANSWER,
+    "buttons": BUTTONS_ANSWER,
+    "list": LIST_ANSWER,
+}
+
+PARSERS = {
+    "cloud_api": CloudApiMessagesParser,
+    "serpro": SerproApiMessagesParser,
+}
+
+
+def run() -> Dict[str, Dict]:
+    results = {}
+    for parser_name, parser_class in PARSERS.items():
+        for cache_name, cache_size in (("cached", 1024), ("uncached", 0)):
+            payload_cache = PayloadCache(maxsize=cache_size)
+            for answer_name, answer in ANSWERS.items():
+                results[f"{parser_name}_{answer_name}_{cache_name}"] = measure(
+                    lambda rasa_messages: parser_class(
+                        rasa_messages, RECIPIENT_PHONE, payload_cache
+                    ).parse_messages(),
+                    answer,
+                )
+    return results
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(
+            f"{name:30} {result['us_per_call']:8.2f} us/answer "
+            f"{result['bytes_per_call']:8.0f} B/answer"
+        )
@@ -0,0 +1,105 @@
+"""
+Benchmark results format.
+
+A results file is a JSON document with the commit and environment the
+benchmarks ran on and one entry per benchmark, mapping metric names to
+numbers:
+
+    {
+        "commit": "31be98d",
+        "python": "3.11.9",
+        "created_at": "2024-06-10T12:00:00+00:00",
+        "results": {"cloud_api_event": {"us_per_call": 5.1, ...}, ...}
+    }
+
+Two files are compared metric by metric; a metric that got worse by more
+than the threshold is a regression.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import subprocess
+from typing import Dict, List, Text
+
+# Metrics where a bigger number is better; for every other metric, smaller is.
+HIGHER_IS_BETTER = {"events_per_second"}
+# Counts describing the run, not its performance.
+IGNORED_METRICS = {"requests"}
+
+
+def current_commit() -> Text:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def build_document(results: Dict[Text, Dict]) -> Dict:
+    return {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }
+
+
+def save(document: Dict, path: Text):
+    with open(path, "w") as results_file:
+        json.dump(document, results_file, indent=2, sort_keys=True)
+
+
+def load(path: Text) -> Dict:
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+@dataclass
+class Comparison:
+    benchmark: Text
+    metric: Text
+    baseline: float
+    current: float
+
+    @property
+    def change(self) -> float:
+        """
+        Relative change, positive when the metric got worse.
+        """
+        if not self.baseline:
+            return 0.0
+        change = (self.current - self.baseline) / self.baseline
+        if self.metric in HIGHER_IS_BETTER:
+            return -change
+        return change
+
+    def is_regression(self, threshold: float) -> bool:
+        return self.change > threshold
+
+
+def compare(baseline: Dict, current: Dict) -> List[Comparison]:
+    """
+    Pairs the metrics present in both results documents.
+    """
+    comparisons = []
+    baseline_results = baseline.get("results", {})
+    for benchmark, metrics in current.get("results", {}).items():
+        baseline_metrics = baseline_results.get(benchmark)
+        if not baseline_metrics:
+            continue
+        for metric, value in metrics.items():
+            if metric in IGNORED_METRICS or metric not in baseline_metrics:
+                continue
+            comparisons.append(
+                Comparison(benchmark, metric, baseline_metrics[metric], value)
+            )
+    return comparisons
@@ -0,0 +1,146 @@
+"""
+End-to-end benchmark of the Flask webhook.
+
+Serves the app on a local port and posts Cloud API events to it from several
+threads, while the Cloud API client sends the answers to a stub server
+running in another process.
+Reports events per second and latency percentiles of the webhook responses.
+Run it alone with:
+
+    python -m whatsapp_api_integration.benchmarks.webhook
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import multiprocessing
+import threading
+import time
+from typing import Dict, List, Text
+
+import requests
+from werkzeug.serving import make_server
+
+from ..clients.registry import get_client_registry
+from ..serialization import dumps
+from ..server import app
+from .events import batch_event
+from .measure import latency_summary
+
+
+class StubCloudApiHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request like a successful Cloud API send, after latency
+    seconds.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, delayed ACKs
+    # add about 40 ms to every send.
+    disable_nagle_algorithm = True
+    latency: float = 0.0
+    response_body = b'{"messaging_product":"whatsapp","messages":[{"id":"wamid.stub"}]}'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.response_body)))
+        self.end_headers()
+        self.wfile.write(self.response_body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_stub(latency: float, ports):
+    StubCloudApiHandler.latency = latency
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), StubCloudApiHandler)
+    stub.daemon_threads = True
+    ports.put(stub.server_port)
+    stub.serve_forever()
+
+
+def start_stub(latency: float):
+    """
+    Starts the stub in its own process, so it does not compete with the
+    webhook for the GIL. Returns the process and the stub port.
+    """
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve_stub, args=(latency, ports), daemon=True
+    )
+    process.start()
+    return process, ports.get(timeout=10)
+
+
+def start_in_thread(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def event_bodies(requests_count: int) -> List[bytes]:
+    """
+    Returns one encoded single-message event per request, each with a new
+    message id so none is dropped as a redelivery.
+    """
+    template = batch_event(1)
+    value = template["entry"][0]["changes"][0]["value"]
+    bodies = []
+    for index in range(requests_count):
+        value["messages"][0]["id"] = f"wamid.benchmark.{time.time_ns()}.{index}"
+        bodies.append(dumps(template))
+    return bodies
+
+
+def run(
+    requests_count: int = 1000, concurrency: int = 8, stub_latency: float = 0.0
+) -> Dict[Text, Dict]:
+    stub, stub_port = start_stub(stub_latency)
+    cloud_api_client = get_client_registry().cloud_api_client()
+    cloud_api_client.messages_endpoint = f"http://127.0.0.1:{stub_port}/messages"
+
+    # Per-event INFO logs would measure the terminal, not the webhook.
+    app.logger.setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    start_in_thread(server)
+    url = f"http://127.0.0.1:{server.server_port}/webhooks/whatsapp/webhook"
+
+    local = threading.local()
+
+    def post(body: bytes) -> float:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        response = session.post(
+            url, data=body, headers={"Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    try:
+        for body in event_bodies(50):
+            post(body)
+        bodies = event_bodies(requests_count)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = time.perf_counter()
+            latencies = list(executor.map(post, bodies))
+            elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+        stub.terminate()
+    return {"webhook_cloud_api": latency_summary(latencies, elapsed)}
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(
+            f"{name:20} {result['events_per_second']:8.1f} events/s "
+            f"p50 {result['p50_ms']:.2f} ms p95 {result['p95_ms']:.2f} ms "
+            f"p99 {result['p99_ms']:.2f} ms"
+        )
@@ -0,0 +1,306 @@
+"""
+Sends one answer set to many recipients, for participation campaigns.
+
+The payloads are built and encoded once; each recipient only costs the
+substitution of to (Cloud API) or destinatario (Serpro) in the cached JSON.
+"""
+
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field
+import inspect
+import itertools
+import os
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Text,
+)
+
+from .clients.media import resolve_media
+from .config import Config
+from .dispatch import AsyncOutboundDispatcher, OutboundDispatcher, RecipientResult
+from .metrics import REGISTRY
+from .parsers.cache import PayloadTemplate
+from .parsers.cloud_api import CloudApiMessagesParser
+from .serialization import dumps, loads
+
+broadcast_counter = REGISTRY.counter(
+    "broadcast_recipients_total",
+    "Broadcast recipients by outcome: sent when every payload was sent.",
+    label_names=("status",),
+)
+
+
+def build_templates(parser_class: Any, answers: List[Dict]) -> List[PayloadTemplate]:
+    """
+    Returns the recipient-independent payload of each answer, taken from
+    the parser payload cache. Local media files are uploaded once here.
+    """
+    parser = parser_class(answers, "")
+    return [
+        parser.payload_cache.get_or_build(answer, parser.build_payload)
+        for answer in resolve_media(answers, parser.provider)
+    ]
+
+
+@dataclass
+class FileCheckpoint:
+    """
+    Keeps the broadcast progress in a JSON file, replaced atomically.
+    """
+
+    path: Text
+
+    def load(self) -> Dict | None:
+        try:
+            with open(self.path, "rb") as checkpoint_file:
+                return loads(checkpoint_file.read())
+        except FileNotFoundError:
+            return None
+
+    def save(self, state: Dict):
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "wb") as checkpoint_file:
+            checkpoint_file.write(dumps(state))
+        os.replace(temporary_path, self.path)
+
+
+@dataclass
+class RedisCheckpoint:
+    """
+    Keeps the broadcast progress in a Redis key. Works with both redis and
+    redis.asyncio clients; with the latter, load and save return awaitables.
+    """
+
+    redis_client: Any
+    key: Text
+
+    def load(self):
+        state = self.redis_client.get(self.key)
+        if inspect.isawaitable(state):
+            return self._load_async(state)
+        return loads(state) if state else None
+
+    async def _load_async(self, state) -> Dict | None:
+        state = await state
+        return loads(state) if state else None
+
+    def save(self, state: Dict):
+        return self.redis_client.set(self.key, dumps(state))
+
+
+@dataclass
+class BroadcastProgress:
+    """
+    Tracks the recipients already sent to. Sends finish out of order, so
+    position only advances over a contiguous run of finished recipients:
+    every recipient before position is done, whatever happens to the rest.
+    """
+
+    position: int = 0
+    recipient: Text | None = None
+    saved_position: int = 0
+    _finished: Dict[int, Text] = field(default_factory=dict)
+
+    def finish(self, position: int, recipient: Text):
+        self._finished[position] = recipient
+        while self.position in self._finished:
+            self.recipient = self._finished.pop(self.position)
+            self.position += 1
+
+    def state(self) -> Dict:
+        return {"position": self.position, "recipient": self.recipient}
+
+
+def skip_sent_recipients(
+    recipients: Iterator[Text], state: Dict | None
+) -> BroadcastProgress:
+    """
+    Consumes the recipients before the checkpoint position. Raises
+    ValueError when the last of them is not the checkpoint recipient, since
+    resuming a different recipient list would skip the wrong contacts.
+    """
+    progress = BroadcastProgress()
+    if not state or not state.get("position"):
+        return progress
+    skipped = None
+    for skipped in itertools.islice(recipients, state["position"]):
+        progress.position += 1
+    progress.recipient = skipped
+    progress.saved_position = progress.position
+    if progress.position != state["position"] or skipped != state.get("recipient"):
+        raise ValueError("The recipients do not match the broadcast checkpoint")
+    return progress
+
+
+@dataclass
+class Broadcast:
+    """
+    Sends the same answers to every recipient of an iterable, which may be a
+    generator reading a file or a database cursor.
+
+    Up to max_concurrency recipients are sent to at the same time by an
+    OutboundDispatcher, each one receiving the answers in order; the client
+    rate limiter keeps the sends within the provider limit. send() yields a
+    RecipientResult as soon as a recipient is done, so only the recipients
+    in flight are held in memory. A recipient fails, and its result is not
+    ok, when a send raises or is answered with a non-2xx status.
+
+    With a checkpoint, the progress is saved every checkpoint_interval
+    recipients and when the broadcast stops. Running the broadcast again
+    with the same recipients resumes after the last recipient saved; failed
+    recipients count as done, so retry them from their results.
+    """
+
+    client: Any
+    answers: List[Dict]
+    parser_class: Any = CloudApiMessagesParser
+    max_concurrency: int = Config.DISPATCH_CONCURRENCY
+    checkpoint: FileCheckpoint | RedisCheckpoint | None = None
+    checkpoint_interval: int = Config.BROADCAST_CHECKPOINT_INTERVAL
+
+    def __post_init__(self):
+        self.templates = build_templates(self.parser_class, self.answers)
+
+    def _render(self, recipient: Text) -> List[Dict]:
+        return [template.render(recipient) for template in self.templates]
+
+    def _count_result(self, result: RecipientResult):
+        broadcast_counter.labels("sent" if result.ok else "failed").inc()
+
+    def _load_checkpoint(self):
+        return self.checkpoint.load() if self.checkpoint else None
+
+    def _checkpoint_is_due(self, progress: BroadcastProgress) -> bool:
+        return progress.position - progress.saved_position >= self.checkpoint_interval
+
+    def _save_checkpoint(self, progress: BroadcastProgress):
+        progress.saved_position = progress.position
+        if self.checkpoint:
+            return self.checkpoint.save(progress.state())
+
+    def _collect(
+        self,
+        in_flight: Dict[Future, int],
+        progress: BroadcastProgress,
+    ) -> Iterator[RecipientResult]:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            position = in_flight.pop(future)
+            progress.finish(position, result.recipient)
+            if self._checkpoint_is_due(progress):
+                self._save_checkpoint(progress)
+            yield result
+
+    def send(self, recipients: Iterable[Text]) -> Iterator[RecipientResult]:
+        recipients = iter(recipients)
+        progress = skip_sent_recipients(recipients, self._load_checkpoint())
+        in_flight: Dict[Future, int] = {}
+        dispatcher = OutboundDispatcher(self.client, self.max_concurrency)
+        try:
+            for position, recipient in enumerate(recipients, progress.position):
+                if len(in_flight) >= self.max_concurrency:
+                    yield from self._collect(in_flight, progress)
+                future = dispatcher.submit_recipient(
+                    recipient, self._render(recipient), self._count_result
+                )
+                in_flight[future] = position
+            while in_flight:
+                yield from self._collect(in_flight, progress)
+        finally:
+            # Recipients still in flight when the caller stops early are
+            # finished, but not yielded, before the progress is saved.
+            dispatcher.shutdown(wait=True)
+            for future, position in in_flight.items():
+                progress.finish(position, future.result().recipient)
+            self._save_checkpoint(progress)
+
+
+@dataclass
+class AsyncBroadcast(Broadcast):
+    """
+    asyncio version of Broadcast, to be used with the async clients. The
+    recipients may also be an async iterable.
+    """
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.dispatcher = AsyncOutboundDispatcher(self.client, self.max_concurrency)
+
+    async def _send_recipient(self, recipient: Text) -> RecipientResult:
+        result = await self.dispatcher.send_recipient(
+            recipient, self._render(recipient)
+        )
+        self._count_result(result)
+        return result
+
+    async def _save_checkpoint(self, progress: BroadcastProgress):
+        saved = super()._save_checkpoint(progress)
+        if inspect.isawaitable(saved):
+            await saved
+
+    async def _skip_sent_recipients(
+        self, recipients: AsyncIterator[Text]
+    ) -> BroadcastProgress:
+        state = self._load_checkpoint()
+        if inspect.isawaitable(state):
+            state = await state
+        skipped = []
+        if state and state.get("position"):
+            async for recipient in recipients:
+                skipped.append(recipient)
+                if len(skipped) == state["position"]:
+                    break
+        return skip_sent_recipients(iter(skipped), state)
+
+    async def _aiter(self, recipients: Iterable[Text] | AsyncIterable[Text]):
+        if isinstance(recipients, AsyncIterable):
+            async for recipient in recipients:
+                yield recipient
+        else:
+            for recipient in recipients:
+                yield recipient
+
+    async def send(
+        self, recipients: Iterable[Text] | AsyncIterable[Text]
+    ) -> AsyncIterator[RecipientResult]:
+        recipients = self._aiter(recipients)
+        progress = await self._skip_sent_recipients(recipients)
+        in_flight: Dict[asyncio.Task, int] = {}
+        position = progress.position
+
+        async def collect():
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                finished_position = in_flight.pop(task)
+                progress.finish(finished_position, result.recipient)
+                if self._checkpoint_is_due(progress):
+                    await self._save_checkpoint(progress)
+                yield result
+
+        try:
+            async for recipient in recipients:
+                if len(in_flight) >= self.max_concurrency:
+                    async for result in collect():
+                        yield result
+                in_flight[asyncio.create_task(self._send_recipient(recipient))] = (
+                    position
+                )
+                position += 1
+            while in_flight:
+                async for result in collect():
+                    yield result
+        finally:
+            if in_flight:
+                await asyncio.gather(*in_flight)
+                for task, finished_position in in_flight.items():
+                    progress.finish(finished_position, task.result().recipient)
+            await self._save_checkpoint(progress)
@@ -0,0 +1,56 @@
+"""
+Cheap classification of raw webhook bodies.
+
+Most Cloud API deliveries only carry statuses updates (sent, delivered, read)
+and some carry message types the backend does not understand. Classifying the
+raw bytes lets the webhook drop those deliveries before decoding the JSON or
+building any event object.
+"""
+
+import re
+from typing import Text
+
+from .metrics import REGISTRY
+
+MESSAGE = "message"
+STATUS = "status"
+UNSUPPORTED = "unsupported"
+EMPTY = "empty"
+
+EVENT_CLASSES = (MESSAGE, STATUS, UNSUPPORTED, EMPTY)
+
+# A key inside a string value would be escaped (\"messages\"), so these
+# patterns only match real keys of the JSON document.
+MESSAGES_KEY = re.compile(rb'"messages"\s*:\s*\[\s*\{')
+STATUSES_KEY = re.compile(rb'"statuses"\s*:\s*\[\s*\{')
+SUPPORTED_MESSAGE_TYPE = re.compile(
+    rb'"type"\s*:\s*"(?:text|interactive|image|video|audio|document|sticker)"'
+)
+
+event_class_counters = {
+    event_class: REGISTRY.counter(
+        f"webhook_events_{event_class}_total",
+        f"Webhook deliveries classified as {event_class}.",
+    )
+    for event_class in EVENT_CLASSES
+}
+
+
+def classify_webhook(body: bytes) -> Text:
+    """
+    Returns MESSAGE when the delivery has at least one message the backend
+    can answer, UNSUPPORTED when it only has other message types (location,
+    contacts, reactions...), STATUS when it only has statuses updates and EMPTY
+    otherwise.
+    """
+    if MESSAGES_KEY.search(body):
+        if SUPPORTED_MESSAGE_TYPE.search(body):
+            event_class = MESSAGE
+        else:
+            event_class = UNSUPPORTED
+    elif STATUSES_KEY.search(body):
+        event_class = STATUS
+    else:
+        event_class = EMPTY
+    event_class_counters[event_class].inc()
+    return event_class
@@ -0,0 +1,33 @@
+from dataclasses import dataclass
+from typing import Any
+
+from ..serialization import dumps
+from .async_http import get_async_http_pool
+from .cloud_api_client import CloudApiClient
+from .throttling import send_with_retry_async
+
+
+@dataclass
+class AsyncCloudApiClient(CloudApiClient):
+    """
+    asyncio version of CloudApiClient.
+    """
+
+    async def send_message(self, message: Any):
+        """
+        Send a Rasa dialogue response to WhatsApp Cloud API.
+        """
+        data = getattr(message, "json_bytes", None) or dumps(message)
+        response = await send_with_retry_async(
+            lambda timeout: get_async_http_pool().post(
+                self.messages_endpoint,
+                data=data,
+                headers=self.headers,
+                timeout=timeout,
+            ),
+            self.rate_limiter,
+            self.retry_policy,
+            self.circuit_breaker,
+            timeout=self.timeout,
+        )
+        return response
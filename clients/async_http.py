@@ -0,0 +1,69 @@
+import asyncio
+from dataclasses import dataclass
+import os
+from typing import Any, Text
+from weakref import WeakKeyDictionary
+
+from ..config import Config
+from .http import httpx_kwargs
+
+
+@dataclass
+class AsyncHttpClientPool:
+    """
+    Keep-alive httpx.AsyncClient shared by the async WhatsApp API clients.
+
+    An AsyncClient is bound to the event loop that uses it, so one client is
+    kept for each running loop of the process.
+    """
+
+    pool_size: int = Config.HTTP_POOL_SIZE
+    http2: bool = Config.HTTP2_ENABLED
+
+    def __post_init__(self):
+        self._clients: WeakKeyDictionary = WeakKeyDictionary()
+        self._pid = os.getpid()
+
+    def client(self):
+        if self._pid != os.getpid():
+            self._clients = WeakKeyDictionary()
+            self._pid = os.getpid()
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            import httpx
+
+            limits = httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+            )
+            client = httpx.AsyncClient(http2=self.http2, limits=limits)
+            self._clients[loop] = client
+        return client
+
+    async def request(self, method: Text, url: Text, **kwargs: Any):
+        return await self.client().request(method, url, **httpx_kwargs(kwargs))
+
+    async def post(self, url: Text, **kwargs: Any):
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url: Text, **kwargs: Any):
+        return await self.request("GET", url, **kwargs)
+
+    async def aclose(self):
+        """
+        Closes the client of the running event loop.
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+_async_http_pool: AsyncHttpClientPool | None = None
+
+
+def get_async_http_pool() -> AsyncHttpClientPool:
+    global _async_http_pool
+    if _async_http_pool is None:
+        _async_http_pool = AsyncHttpClientPool()
+    return _async_http_pool
@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+from typing import Dict, Text
+
+from ..config import Config
+from ..serialization import dumps
+from .async_http import get_async_http_pool
+from .http import get_timeout
+from .serpro_api_client import SerproApiClient, reauthentication_counter
+from .serpro_token import AsyncSerproTokenManager, SerproAuthenticationError
+from .throttling import send_with_retry_async
+
+
+@dataclass
+class AsyncSerproApiClient(SerproApiClient):
+    """
+    asyncio version of SerproApiClient, using redis.asyncio and httpx.
+    """
+
+    def _create_redis_client(self):
+        import redis.asyncio
+
+        return redis.asyncio.Redis(
+            host=Config.REDIS_HOST, port=Config.REDIS_PORT, decode_responses=True
+        )
+
+    def _create_token_manager(self) -> AsyncSerproTokenManager:
+        return AsyncSerproTokenManager(
+            redis_client=self.redis_client,
+            oauth2_endpoint=self.oauth2_endpoint,
+            oauth2_credentials=self.oauth2_credentials,
+            access_token_headers=self.access_token_headers,
+        )
+
+    async def authenticate(self, force_authentication=False):
+        """
+        Requests Serpro API access_token.
+        """
+        if force_authentication:
+            self.access_token = await self.token_manager.invalidate(self.access_token)
+        else:
+            self.access_token = await self.token_manager.get_token()
+        self.authenticated_headers = self._set_access_token_header(
+            self.authenticated_headers
+        )
+
+    async def register_webhook(self):
+        """
+        Register on Serpro API the Rasa endpoint to Receive WhatsApp events.
+        """
+        if not self.access_token:
+            await self.authenticate()
+        self._set_access_token_header(self.webhook_registration_headers)
+        return await get_async_http_pool().post(
+            Config.SERPRO_WEBHOOK_REGISTRATION_URL,
+            data=Config.RASA_WEBHOOK_URL,
+            headers=self.webhook_registration_headers,
+            timeout=get_timeout("serpro_webhook_registration"),
+        )
+
+    async def _request_on_message_endpoint(self, message_endpoint: Text, message: Dict):
+        data = getattr(message, "json_bytes", None) or dumps(message)
+        return await send_with_retry_async(
+            lambda timeout: get_async_http_pool().post(
+                message_endpoint,
+                data=data,
+                headers=self.authenticated_headers,
+                timeout=timeout,
+            ),
+            self.rate_limiter,
+            self.retry_policy,
+            self.circuit_breaker,
+            timeout=self.timeout,
+        )
+
+    async def send_message(self, message: Dict):
+        """
+        Send a Rasa dialogue response to Sepro API.
+        """
+        await self.authenticate()
+        message_endpoint = self._get_endpoint(message)
+        response = await self._request_on_message_endpoint(message_endpoint, message)
+        if response.status_code == 401:
+            reauthentication_counter.inc()
+            await self.authenticate(force_authentication=True)
+            response = await self._request_on_message_endpoint(
+                message_endpoint, message
+            )
+            if response.status_code == 401:
+                raise SerproAuthenticationError(
+                    "Serpro API refused a freshly issued access token"
+                )
+        return response
@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+import threading
+import time
+from typing import Dict, Text
+
+from ..config import Config
+from ..metrics import REGISTRY
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+@dataclass
+class CircuitBreaker:
+    """
+    Stops calling an endpoint after failure_threshold consecutive failures.
+
+    While open, calls fail right away with CircuitOpenError. After
+    recovery_timeout seconds a single probe call is let through: if it
+    succeeds the circuit closes, otherwise it opens again.
+    """
+
+    name: Text
+    failure_threshold: int = Config.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+    recovery_timeout: float = Config.CIRCUIT_BREAKER_RECOVERY_TIMEOUT
+
+    def __post_init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.open_counter = REGISTRY.counter(
+            f"circuit_breaker_{self.name}_opened_total",
+            f"Times the {self.name} circuit breaker opened.",
+        )
+        self.rejected_counter = REGISTRY.counter(
+            f"circuit_breaker_{self.name}_rejected_total",
+            f"Calls to {self.name} refused while the circuit was open.",
+        )
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError when the call must not be made.
+        """
+        if self.state == CLOSED:
+            return
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    self.rejected_counter.inc()
+                    raise CircuitOpenError(f"Circuit {self.name} is open")
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.rejected_counter.inc()
+                    raise CircuitOpenError(f"Circuit {self.name} is being probed")
+                self._probing = True
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.open_counter.inc()
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+_circuit_breakers: Dict[Text, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: Text) -> CircuitBreaker:
+    """
+    Returns the circuit breaker of an endpoint, shared by the process.
+    """
+    circuit_breaker = _circuit_breakers.get(name)
+    if circuit_breaker is None:
+        with _circuit_breakers_lock:
+            circuit_breaker = _circuit_breakers.setdefault(name, CircuitBreaker(name))
+    return circuit_breaker
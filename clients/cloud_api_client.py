@@ -1,13 +1,13 @@
 from dataclasses import dataclass, field
-import json
-from typing import Any, Dict, Text
+from typing import Any, Dict, Text, Tuple
 import os
 
-import requests
-
-from dotenv import load_dotenv
-
-load_dotenv()
+from ..config import Config
+from ..serialization import dumps
+from .circuit_breaker import CircuitBreaker, get_circuit_breaker
+from .http import get_http_pool, get_timeout
+from .media import MediaError, MultipartFile, download_to_file
+from .throttling import RetryPolicy, send_with_retry
 
 
 @dataclass
@@ -15,6 +15,14 @@ class CloudApiClient:
     authorization_token: Text = ""
     phone_number_identifier: Text = ""
     messages_endpoint: Text = ""
+    rate_limiter: Any = None
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+    timeout: Tuple[float, float] = field(
+        default_factory=lambda: get_timeout("cloud_api_messages")
+    )
+    circuit_breaker: CircuitBreaker = field(
+        default_factory=lambda: get_circuit_breaker("cloud_api_messages")
+    )
     headers: Dict[Text, Text] = field(
         default_factory=lambda: (
             {
@@ -28,9 +36,10 @@ class CloudApiClient:
         self.authorization_token = os.getenv("WPP_AUTHORIZATION_TOKEN", "")
         self.phone_number_identifier = os.getenv("WPP_PHONE_NUMBER_IDENTIFIER", "")
         self.headers["Authorization"] = f"Bearer {self.authorization_token}"
-        self.messages_endpoint = (
-            f"https://graph.facebook.com/v19.0/{self.phone_number_identifier}/messages"
-        )
+        if not self.messages_endpoint:
+            self.messages_endpoint = (
+                f"{Config.CLOUD_API_BASE_URL}/{self.phone_number_identifier}/messages"
+            )
 
     def authenticate(self):
         pass
@@ -38,8 +47,70 @@ class CloudApiClient:
     def send_message(self, message: Any):
         """
         Send a Rasa dialogue response to WhatsApp Cloud API.
+        Throttled and failed requests are retried according to retry_policy.
         """
-        response = requests.post(
-            self.messages_endpoint, data=json.dumps(message), headers=self.headers
+        data = getattr(message, "json_bytes", None) or dumps(message)
+        response = send_with_retry(
+            lambda timeout: get_http_pool().post(
+                self.messages_endpoint,
+                data=data,
+                headers=self.headers,
+                timeout=timeout,
+            ),
+            self.rate_limiter,
+            self.retry_policy,
+            self.circuit_breaker,
+            timeout=self.timeout,
         )
         return response
+
+    def upload_media(self, path: Text, mime_type: Text) -> Text:
+        """
+        Uploads a local file, read from disk while it is sent, and returns
+        its media id.
+        """
+
+        def post(timeout):
+            body = MultipartFile(
+                path, mime_type, {"messaging_product": "whatsapp", "type": mime_type}
+            )
+            return get_http_pool().post(
+                f"{Config.CLOUD_API_BASE_URL}/{self.phone_number_identifier}/media",
+                data=body,
+                headers={
+                    "Authorization": self.headers["Authorization"],
+                    "Content-Type": body.content_type,
+                    "Content-Length": str(len(body)),
+                },
+                timeout=timeout,
+            )
+
+        response = send_with_retry(
+            post,
+            None,
+            self.retry_policy,
+            get_circuit_breaker("cloud_api_media"),
+            timeout=get_timeout("cloud_api_media"),
+        )
+        if response.status_code != 200:
+            raise MediaError(f"Media upload returned {response.status_code}")
+        return response.json()["id"]
+
+    def download_media(
+        self, media_id: Text, directory: Text, sha256: Text = ""
+    ) -> Text:
+        """
+        Downloads a media sent by a contact to directory, in chunks, and
+        returns the file path.
+        """
+        headers = {"Authorization": self.headers["Authorization"]}
+        timeout = get_timeout("cloud_api_media")
+        response = get_http_pool().get(
+            f"{Config.CLOUD_API_BASE_URL}/{media_id}", headers=headers, timeout=timeout
+        )
+        if response.status_code != 200:
+            raise MediaError(f"Media lookup returned {response.status_code}")
+        media = response.json()
+        return download_to_file(
+            media["url"], headers, directory, timeout, sha256 or media.get("sha256", "")
+        )
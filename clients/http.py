@@ -0,0 +1,199 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+import os
+import threading
+from typing import Any, Dict, Iterator, Text, Tuple
+from urllib.parse import urlsplit
+
+from ..config import Config
+
+
+@dataclass
+class HttpSessionPool:
+    """
+    Process-wide keep-alive HTTP session shared by the WhatsApp API clients.
+
+    Reusing the session avoids a new TCP and TLS handshake for every message.
+    The session is created lazily and recreated after a fork, so connections
+    opened by a parent process are never shared with its children.
+    """
+
+    pool_size: int = Config.HTTP_POOL_SIZE
+    pool_block: bool = Config.HTTP_POOL_BLOCK
+    http2: bool = Config.HTTP2_ENABLED
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._host_stats: Dict[Text, Dict[Text, int]] = {}
+
+    def session(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Sockets inherited from the parent are dropped, not closed,
+                    # so the parent connections keep working.
+                    self._session = self._create_session()
+                    self._host_stats = {}
+                    self._pid = os.getpid()
+        return self._session
+
+    def _create_session(self):
+        if self.http2:
+            import httpx
+
+            limits = httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+            )
+            return httpx.Client(http2=True, limits=limits)
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            pool_block=self.pool_block,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _httpx_kwargs(self, kwargs: Dict[Text, Any]) -> Dict[Text, Any]:
+        return httpx_kwargs(kwargs)
+
+    def _host_stats_for(self, url: Text) -> Dict[Text, int]:
+        host = urlsplit(url).netloc
+        stats = self._host_stats.get(host)
+        if stats is None:
+            with self._lock:
+                stats = self._host_stats.setdefault(host, {"requests": 0, "errors": 0})
+        return stats
+
+    def request(self, method: Text, url: Text, **kwargs):
+        session = self.session()
+        if self.http2:
+            kwargs = self._httpx_kwargs(kwargs)
+        stats = self._host_stats_for(url)
+        stats["requests"] += 1
+        try:
+            return session.request(method, url, **kwargs)
+        except Exception:
+            stats["errors"] += 1
+            raise
+
+    def post(self, url: Text, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    @contextmanager
+    def stream(
+        self,
+        method: Text,
+        url: Text,
+        chunk_size: int = Config.MEDIA_CHUNK_SIZE,
+        **kwargs,
+    ) -> Iterator[Tuple[Any, Iterator[bytes]]]:
+        """
+        Sends a request and yields the response with an iterator over its
+        body in chunks of chunk_size bytes, so large bodies are never held
+        in memory. The connection goes back to the pool on exit.
+        """
+        session = self.session()
+        stats = self._host_stats_for(url)
+        stats["requests"] += 1
+        try:
+            if self.http2:
+                kwargs = self._httpx_kwargs(kwargs)
+                with session.stream(method, url, **kwargs) as response:
+                    yield response, response.iter_bytes(chunk_size)
+            else:
+                with session.request(method, url, stream=True, **kwargs) as response:
+                    yield response, response.iter_content(chunk_size)
+        except Exception:
+            stats["errors"] += 1
+            raise
+
+    def get(self, url: Text, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def stats(self) -> Dict[Text, Dict[Text, int]]:
+        """
+        Returns, for each host, the requests sent and failed by this process
+        and, when available, the connections opened to serve them. A number
+        of opened connections close to the number of requests means the pool
+        is too small for the send rate.
+        """
+        stats = {host: dict(values) for host, values in self._host_stats.items()}
+        if self._session is None or self.http2:
+            return stats
+        for adapter in self._session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = (
+                    pool.host
+                    if pool.port in (None, 80, 443)
+                    else f"{pool.host}:{pool.port}"
+                )
+                host_stats = stats.setdefault(host, {"requests": 0, "errors": 0})
+                host_stats["connections_opened"] = (
+                    host_stats.get("connections_opened", 0) + pool.num_connections
+                )
+                host_stats["pool_size"] = self.pool_size
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+
+def httpx_kwargs(kwargs: Dict[Text, Any]) -> Dict[Text, Any]:
+    """
+    Translates requests keyword arguments to their httpx equivalents.
+    """
+    import httpx
+
+    data = kwargs.get("data")
+    if data is not None and not isinstance(data, dict):
+        # Raw bodies, including streamed ones, are content for httpx.
+        kwargs["content"] = kwargs.pop("data")
+    timeout = kwargs.get("timeout")
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        kwargs["timeout"] = httpx.Timeout(read, connect=connect)
+    return kwargs
+
+
+@lru_cache(maxsize=None)
+def get_timeout(endpoint: Text) -> Tuple[float, float]:
+    """
+    Returns the (connect, read) timeouts of an endpoint name, such as
+    cloud_api_messages. Each one can be overridden with the
+    <ENDPOINT>_CONNECT_TIMEOUT and <ENDPOINT>_READ_TIMEOUT variables.
+    """
+    prefix = endpoint.upper()
+    return (
+        float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", Config.HTTP_CONNECT_TIMEOUT)),
+        float(os.getenv(f"{prefix}_READ_TIMEOUT", Config.HTTP_READ_TIMEOUT)),
+    )
+
+
+_http_pool: HttpSessionPool | None = None
+
+
+def get_http_pool() -> HttpSessionPool:
+    """
+    Returns the HTTP session pool shared by every client of this process.
+    """
+    global _http_pool
+    if _http_pool is None:
+        _http_pool = HttpSessionPool()
+    return _http_pool
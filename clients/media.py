@@ -0,0 +1,264 @@
+"""
+Media files: streamed downloads of the media sent by the contacts and
+uploads of the media sent to them, each file uploaded once per provider.
+"""
+
+import base64
+from dataclasses import dataclass, field
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Text, Tuple
+import uuid
+
+from ..config import Config
+from ..metrics import REGISTRY
+from ..parsers.cache import get_media
+from .http import get_http_pool
+
+logger = logging.getLogger(__name__)
+
+uploads_counter = REGISTRY.counter(
+    "media_uploads_total",
+    "Media files uploaded to a provider.",
+    label_names=("provider",),
+)
+reused_counter = REGISTRY.counter(
+    "media_ids_reused_total",
+    "Media sends that reused the id of a file already uploaded.",
+    label_names=("provider",),
+)
+
+
+class MediaError(Exception):
+    pass
+
+
+def file_sha256(path: Text, chunk_size: int = Config.MEDIA_CHUNK_SIZE) -> Text:
+    digest = hashlib.sha256()
+    with open(path, "rb") as media_file:
+        for chunk in iter(lambda: media_file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sha256_matches(digest: Any, expected: Text) -> bool:
+    """
+    Compares a hashlib digest to a hex or base64 encoded sha256, the two
+    encodings used by the providers.
+    """
+    return expected in (digest.hexdigest(), base64.b64encode(digest.digest()).decode())
+
+
+@dataclass
+class MultipartFile:
+    """
+    multipart/form-data body made of fields and one file, read from disk
+    chunk by chunk while it is sent. Its length is known up front, so the
+    request has a Content-Length instead of a chunked body.
+    """
+
+    path: Text
+    mime_type: Text
+    fields: Dict[Text, Text] = field(default_factory=dict)
+    file_field: Text = "file"
+    chunk_size: int = Config.MEDIA_CHUNK_SIZE
+
+    def __post_init__(self):
+        self.boundary = uuid.uuid4().hex
+        parts = [
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"'
+            f"\r\n\r\n{value}\r\n"
+            for name, value in self.fields.items()
+        ]
+        filename = os.path.basename(self.path)
+        parts.append(
+            f"--{self.boundary}\r\nContent-Disposition: form-data; "
+            f'name="{self.file_field}"; filename="{filename}"\r\n'
+            f"Content-Type: {self.mime_type}\r\n\r\n"
+        )
+        self.head = "".join(parts).encode()
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self.size = len(self.head) + os.path.getsize(self.path) + len(self.tail)
+
+    @property
+    def content_type(self) -> Text:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self.head
+        with open(self.path, "rb") as media_file:
+            yield from iter(lambda: media_file.read(self.chunk_size), b"")
+        yield self.tail
+
+
+def guess_mime_type(path: Text) -> Text:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def download_to_file(
+    url: Text,
+    headers: Dict[Text, Text],
+    directory: Text,
+    timeout: Tuple[float, float],
+    sha256: Text = "",
+) -> Text:
+    """
+    Streams url to directory in chunks and returns the file path. The file
+    is named after its sha256, so a media received twice is stored once.
+    Raises MediaError on an error status or when sha256 does not match.
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    stream = get_http_pool().stream("GET", url, headers=headers, timeout=timeout)
+    with stream as (response, chunks):
+        if response.status_code != 200:
+            raise MediaError(f"Media download returned {response.status_code}")
+        extension = mimetypes.guess_extension(
+            (response.headers.get("Content-Type") or "").split(";")[0].strip()
+        )
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as media_file:
+            try:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    media_file.write(chunk)
+            except BaseException:
+                os.unlink(media_file.name)
+                raise
+    if sha256 and not sha256_matches(digest, sha256):
+        os.unlink(media_file.name)
+        raise MediaError("Downloaded media does not match its sha256")
+    path = os.path.join(directory, digest.hexdigest() + (extension or ""))
+    os.replace(media_file.name, path)
+    return path
+
+
+@dataclass
+class MediaIdCache:
+    """
+    Media ids by file sha256, kept for ttl seconds in the process and, with
+    a Redis client, in Redis so every worker reuses the same upload.
+    """
+
+    provider: Text
+    ttl: float = Config.MEDIA_ID_TTL
+    redis_client: Any = None
+    key_prefix: Text = "whatsapp_media_id:"
+
+    def __post_init__(self):
+        self._media_ids: Dict[Text, Tuple[float, Text]] = {}
+        self._lock = threading.Lock()
+
+    def _redis_key(self, sha256: Text) -> Text:
+        return f"{self.key_prefix}{self.provider}:{sha256}"
+
+    def get(self, sha256: Text) -> Text | None:
+        cached = self._media_ids.get(sha256)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        if self.redis_client is None:
+            return None
+        try:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            pipeline.get(self._redis_key(sha256))
+            pipeline.pttl(self._redis_key(sha256))
+            media_id, ttl = pipeline.execute()
+        except Exception:
+            logger.exception("Could not read the media id cache on Redis")
+            return None
+        if media_id is not None:
+            self._set_local(sha256, media_id, max(ttl, 0) / 1000)
+        return media_id
+
+    def _set_local(self, sha256: Text, media_id: Text, ttl: float):
+        with self._lock:
+            self._media_ids[sha256] = (time.monotonic() + ttl, media_id)
+
+    def set(self, sha256: Text, media_id: Text):
+        self._set_local(sha256, media_id, self.ttl)
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.set(
+                self._redis_key(sha256), media_id, px=int(self.ttl * 1000)
+            )
+        except Exception:
+            logger.exception("Could not write the media id cache on Redis")
+
+
+@dataclass
+class MediaUploader:
+    """
+    Returns the provider media id of local files, uploading each content
+    only once. Files are hashed once per size and modification time, and
+    concurrent sends of a new file wait for a single upload.
+    """
+
+    client: Any
+    cache: MediaIdCache
+
+    def __post_init__(self):
+        self._digests: Dict[Tuple[Text, int, int], Text] = {}
+        self._upload_locks: Dict[Text, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _sha256(self, path: Text) -> Text:
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = self._digests[key] = file_sha256(path)
+        return digest
+
+    def media_id(self, path: Text, mime_type: Text = "") -> Text:
+        sha256 = self._sha256(path)
+        media_id = self.cache.get(sha256)
+        if media_id is not None:
+            reused_counter.labels(self.cache.provider).inc()
+            return media_id
+        with self._lock:
+            upload_lock = self._upload_locks.setdefault(sha256, threading.Lock())
+        with upload_lock:
+            media_id = self.cache.get(sha256)
+            if media_id is None:
+                media_id = self.client.upload_media(
+                    path, mime_type or guess_mime_type(path)
+                )
+                uploads_counter.labels(self.cache.provider).inc()
+                self.cache.set(sha256, media_id)
+        with self._lock:
+            self._upload_locks.pop(sha256, None)
+        return media_id
+
+
+# Media types that accept a caption.
+CAPTIONED_MEDIA_TYPES = ("image", "video", "document")
+
+
+def is_local_file(reference: Text) -> bool:
+    return not reference.startswith(("http://", "https://"))
+
+
+def resolve_media(rasa_messages: List[Dict], provider: Text) -> List[Dict]:
+    """
+    Adds the media_id of the local files referenced by rasa_messages
+    (see parsers.cache.get_media), uploading them when needed. Links are
+    left for the provider to fetch.
+    """
+    from .registry import get_client_registry
+
+    resolved = []
+    for rasa_message in rasa_messages:
+        media = get_media(rasa_message)
+        if media and is_local_file(media[1]) and not rasa_message.get("media_id"):
+            uploader = get_client_registry().media_uploader(provider)
+            rasa_message = {**rasa_message, "media_id": uploader.media_id(media[1])}
+        resolved.append(rasa_message)
+    return resolved
@@ -0,0 +1,208 @@
+from dataclasses import dataclass
+import os
+import threading
+from typing import Any, Callable, Dict, Text
+
+from ..config import Config
+from ..dispatch import AsyncOutboundDispatcher, OutboundDispatcher
+from ..metrics import REGISTRY
+from .cloud_api_client import CloudApiClient
+from .media import MediaIdCache, MediaUploader
+from .serpro_api_client import SerproApiClient
+from .throttling import create_rate_limiter
+
+redis_round_trips_counter = REGISTRY.counter(
+    "redis_round_trips_total",
+    "Commands or pipelines sent to Redis by this process.",
+)
+
+
+@dataclass
+class ClientRegistry:
+    """
+    Creates the WhatsApp API clients and the Redis connection pool once per
+    process, on first use.
+
+    Clients are shared by every event handled by the process. After a fork
+    the registry starts empty, so each worker builds its own connections.
+    """
+
+    def __post_init__(self):
+        self._lock = threading.RLock()
+        self._instances: Dict[Text, Any] = {}
+        self._pid = os.getpid()
+
+    def _get_or_create(self, name: Text, factory: Callable[[], Any]):
+        if self._pid != os.getpid():
+            self.reset()
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = factory()
+                    self._instances[name] = instance
+        return instance
+
+    def _create_redis_client(self):
+        import redis
+
+        class InstrumentedRedisConnection(redis.Connection):
+            """
+            Counts every write to Redis. A pipeline is written at once, so it
+            counts as a single round trip.
+            """
+
+            def send_packed_command(self, command, check_health=True):
+                redis_round_trips_counter.inc()
+                return super().send_packed_command(command, check_health)
+
+        return redis.Redis(
+            connection_pool=redis.ConnectionPool(
+                host=Config.REDIS_HOST,
+                port=Config.REDIS_PORT,
+                decode_responses=True,
+                connection_class=InstrumentedRedisConnection,
+            )
+        )
+
+    def redis_client(self):
+        return self._get_or_create("redis", self._create_redis_client)
+
+    def rate_limiter(self, key: Text):
+        """
+        Returns the send rate limiter of a phone number id or WABA.
+        """
+        return self._get_or_create(
+            f"rate_limiter:{key}",
+            lambda: create_rate_limiter(key, self.redis_client()),
+        )
+
+    def async_rate_limiter(self, key: Text):
+        if Config.SEND_RATE_LIMIT_BACKEND != "redis":
+            return self.rate_limiter(key)
+        return self._get_or_create(
+            f"async_rate_limiter:{key}",
+            lambda: create_rate_limiter(key, self.async_redis_client()),
+        )
+
+    def _create_cloud_api_client(self) -> CloudApiClient:
+        client = CloudApiClient()
+        client.rate_limiter = self.rate_limiter(client.phone_number_identifier)
+        return client
+
+    def _create_serpro_api_client(self) -> SerproApiClient:
+        return SerproApiClient(
+            redis_client=self.redis_client(),
+            rate_limiter=self.rate_limiter(Config.SERPRO_WABA_ID),
+        )
+
+    def cloud_api_client(self) -> CloudApiClient:
+        return self._get_or_create("cloud_api", self._create_cloud_api_client)
+
+    def serpro_api_client(self) -> SerproApiClient:
+        return self._get_or_create("serpro_api", self._create_serpro_api_client)
+
+    def _create_media_uploader(self, provider: Text) -> MediaUploader:
+        clients = {"cloud_api": self.cloud_api_client, "serpro": self.serpro_api_client}
+        redis_client = None
+        if Config.MEDIA_CACHE_BACKEND == "redis":
+            redis_client = self.redis_client()
+        return MediaUploader(
+            client=clients[provider](),
+            cache=MediaIdCache(provider, redis_client=redis_client),
+        )
+
+    def media_uploader(self, provider: Text) -> MediaUploader:
+        """
+        Returns the uploader of cloud_api or serpro media.
+        """
+        return self._get_or_create(
+            f"media_uploader:{provider}", lambda: self._create_media_uploader(provider)
+        )
+
+    def outbound_dispatcher(self, provider: Text) -> OutboundDispatcher:
+        """
+        Returns the dispatcher sending the answers of cloud_api or serpro.
+        """
+        clients = {"cloud_api": self.cloud_api_client, "serpro": self.serpro_api_client}
+        return self._get_or_create(
+            f"outbound_dispatcher:{provider}",
+            lambda: OutboundDispatcher(clients[provider]()),
+        )
+
+    def _create_async_redis_client(self):
+        import redis.asyncio
+
+        class InstrumentedAsyncRedisConnection(redis.asyncio.Connection):
+            async def send_packed_command(self, command, check_health=True):
+                redis_round_trips_counter.inc()
+                return await super().send_packed_command(command, check_health)
+
+        return redis.asyncio.Redis(
+            connection_pool=redis.asyncio.ConnectionPool(
+                host=Config.REDIS_HOST,
+                port=Config.REDIS_PORT,
+                decode_responses=True,
+                connection_class=InstrumentedAsyncRedisConnection,
+            )
+        )
+
+    def async_redis_client(self):
+        return self._get_or_create("async_redis", self._create_async_redis_client)
+
+    def _create_async_cloud_api_client(self):
+        from .async_cloud_api_client import AsyncCloudApiClient
+
+        client = AsyncCloudApiClient()
+        client.rate_limiter = self.async_rate_limiter(client.phone_number_identifier)
+        return client
+
+    def _create_async_serpro_api_client(self):
+        from .async_serpro_api_client import AsyncSerproApiClient
+
+        return AsyncSerproApiClient(
+            redis_client=self.async_redis_client(),
+            rate_limiter=self.async_rate_limiter(Config.SERPRO_WABA_ID),
+        )
+
+    def async_cloud_api_client(self):
+        return self._get_or_create(
+            "async_cloud_api", self._create_async_cloud_api_client
+        )
+
+    def async_serpro_api_client(self):
+        return self._get_or_create(
+            "async_serpro_api", self._create_async_serpro_api_client
+        )
+
+    def async_outbound_dispatcher(self, provider: Text) -> AsyncOutboundDispatcher:
+        clients = {
+            "cloud_api": self.async_cloud_api_client,
+            "serpro": self.async_serpro_api_client,
+        }
+        return self._get_or_create(
+            f"async_outbound_dispatcher:{provider}",
+            lambda: AsyncOutboundDispatcher(clients[provider]()),
+        )
+
+    def reset(self):
+        """
+        Forgets every instance, so the next call creates new ones.
+        """
+        with self._lock:
+            self._instances = {}
+            self._pid = os.getpid()
+
+
+_client_registry: ClientRegistry | None = None
+
+
+def get_client_registry() -> ClientRegistry:
+    """
+    Returns the client registry shared by the process.
+    """
+    global _client_registry
+    if _client_registry is None:
+        _client_registry = ClientRegistry()
+    return _client_registry
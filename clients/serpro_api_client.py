@@ -1,16 +1,20 @@
 from dataclasses import dataclass, field
-import json
 import os
-from typing import Any, Dict, Text
-
-import redis
-import requests
-
-from dotenv import load_dotenv
+from typing import Any, Dict, Text, Tuple
 
 from ..config import Config
+from ..metrics import REGISTRY
+from ..serialization import dumps
+from .circuit_breaker import CircuitBreaker, get_circuit_breaker
+from .http import get_http_pool, get_timeout
+from .media import MediaError, MultipartFile, download_to_file
+from .serpro_token import SerproAuthenticationError, SerproTokenManager
+from .throttling import RetryPolicy, send_with_retry
 
-load_dotenv()
+reauthentication_counter = REGISTRY.counter(
+    "serpro_reauthentications_total",
+    "Sends refused with 401 that forced a new Serpro access token.",
+)
 
 
 @dataclass
@@ -20,6 +24,9 @@ class SerproApiClient:
 
     To receive webhooks on /webhooks/whatsapp/webhook route,
     call the method register_webhook manually.
+
+    The client authenticates on its first request, so building it does no
+    network I/O. Use clients.registry to share one instance per process.
     """
 
     client_id: Text = ""
@@ -27,8 +34,20 @@ class SerproApiClient:
     access_token: Text = ""
     phone_number_identifier: Text = ""
     messages_endpoint: Text = ""
-    oauth2_endpoint: Text = Config.SERPRO_OAUTH2_TOKEN_URL
+    oauth2_endpoint: Text = field(
+        default_factory=lambda: Config.SERPRO_OAUTH2_TOKEN_URL
+    )
     webhook_url: Text = Config.RASA_WEBHOOK_URL
+    redis_client: Any = None
+    token_manager: SerproTokenManager | None = None
+    rate_limiter: Any = None
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+    timeout: Tuple[float, float] = field(
+        default_factory=lambda: get_timeout("serpro_messages")
+    )
+    circuit_breaker: CircuitBreaker = field(
+        default_factory=lambda: get_circuit_breaker("serpro_messages")
+    )
     authenticated_headers: Dict[Text, Text] = field(
         default_factory=lambda: (
             {
@@ -55,14 +74,29 @@ class SerproApiClient:
         self.client_id = os.getenv("SERPRO_CLIENT_ID", "")
         self.client_secret = os.getenv("SERPRO_CLIENT_SECRET", "")
         self.phone_number_identifier = os.getenv("WPP_PHONE_NUMBER_IDENTIFIER", "")
-        self.redis_client = redis.Redis(
-            host=Config.REDIS_HOST, port=Config.REDIS_PORT, decode_responses=True
-        )
+        if self.redis_client is None:
+            self.redis_client = self._create_redis_client()
         self.oauth2_credentials = {
             "client_id": self.client_id,
             "client_secret": self.client_secret,
         }
-        self.authenticate()
+        if self.token_manager is None:
+            self.token_manager = self._create_token_manager()
+
+    def _create_redis_client(self):
+        import redis
+
+        return redis.Redis(
+            host=Config.REDIS_HOST, port=Config.REDIS_PORT, decode_responses=True
+        )
+
+    def _create_token_manager(self) -> SerproTokenManager:
+        return SerproTokenManager(
+            redis_client=self.redis_client,
+            oauth2_endpoint=self.oauth2_endpoint,
+            oauth2_credentials=self.oauth2_credentials,
+            access_token_headers=self.access_token_headers,
+        )
 
     def _set_access_token_header(self, headers):
         headers["Authorization"] = f"Bearer {self.access_token}"
@@ -77,24 +111,15 @@ class SerproApiClient:
     def authenticate(self, force_authentication=False):
         """
         Requests Serpro API access_token.
-        """
-        self.access_token = self.redis_client.get("serpro_access_token")
-        if not self.access_token or force_authentication:
-            response = requests.post(
-                self.oauth2_endpoint,
-                data=self.oauth2_credentials,
-                headers=self.access_token_headers,
-            )
-            if response.status_code == 200:
-                response_data = response.json()
-                self.access_token = response_data.get("access_token")
-                self.redis_client.set("serpro_access_token", self.access_token)
-                self.authenticated_headers = self._set_access_token_header(
-                    self.authenticated_headers
-                )
-            else:
-                raise Exception
 
+        The token is served from the token manager memory and is only requested
+        to the OAuth endpoint when it is missing, about to expire or, with
+        force_authentication, refused by the API.
+        """
+        if force_authentication:
+            self.access_token = self.token_manager.invalidate(self.access_token)
+        else:
+            self.access_token = self.token_manager.get_token()
         self.authenticated_headers = self._set_access_token_header(
             self.authenticated_headers
         )
@@ -109,21 +134,32 @@ class SerproApiClient:
         self.webhook_registration_header = self._set_access_token_header(
             self.webhook_registration_headers
         )
-        response = requests.post(
+        response = get_http_pool().post(
             Config.SERPRO_WEBHOOK_REGISTRATION_URL,
             data=Config.RASA_WEBHOOK_URL,
             headers=self.webhook_registration_headers,
+            timeout=get_timeout("serpro_webhook_registration"),
         )
         return response
 
     def _request_on_message_endpoint(self, message_endpoint: Text, message: Dict):
-        return requests.post(
-            message_endpoint,
-            data=json.dumps(message),
-            headers=self.authenticated_headers,
+        data = getattr(message, "json_bytes", None) or dumps(message)
+        return send_with_retry(
+            lambda timeout: get_http_pool().post(
+                message_endpoint,
+                data=data,
+                headers=self.authenticated_headers,
+                timeout=timeout,
+            ),
+            self.rate_limiter,
+            self.retry_policy,
+            self.circuit_breaker,
+            timeout=self.timeout,
         )
 
     def _get_endpoint(self, message: Dict):
+        if message.get("midia"):
+            return Config.SERPRO_MEDIA_MESSAGES_URL
         if self._message_has_buttons(message):
             return Config.SERPRO_BUTTONS_MESSAGES_URL
         if self._message_has_secoes(message):
@@ -134,11 +170,62 @@ class SerproApiClient:
         """
         Send a Rasa dialogue response to Sepro API.
         """
+        self.authenticate()
         message_endpoint = self._get_endpoint(message)
         response = self._request_on_message_endpoint(message_endpoint, message)
         if response.status_code == 401:
+            reauthentication_counter.inc()
             self.authenticate(force_authentication=True)
             response = self._request_on_message_endpoint(message_endpoint, message)
             if response.status_code == 401:
-                raise Exception
+                raise SerproAuthenticationError(
+                    "Serpro API refused a freshly issued access token"
+                )
         return response
+
+    def upload_media(self, path: Text, mime_type: Text) -> Text:
+        """
+        Uploads a local file, read from disk while it is sent, and returns
+        its media id.
+        """
+        self.authenticate()
+
+        def post(timeout):
+            body = MultipartFile(path, mime_type, {"wabaId": Config.SERPRO_WABA_ID})
+            return get_http_pool().post(
+                Config.SERPRO_MEDIA_URL,
+                data=body,
+                headers={
+                    "Authorization": self.authenticated_headers["Authorization"],
+                    "Content-Type": body.content_type,
+                    "Content-Length": str(len(body)),
+                },
+                timeout=timeout,
+            )
+
+        response = send_with_retry(
+            post,
+            None,
+            self.retry_policy,
+            get_circuit_breaker("serpro_media"),
+            timeout=get_timeout("serpro_media"),
+        )
+        if response.status_code not in (200, 201):
+            raise MediaError(f"Media upload returned {response.status_code}")
+        return response.json()["id"]
+
+    def download_media(
+        self, media_id: Text, directory: Text, sha256: Text = ""
+    ) -> Text:
+        """
+        Downloads a media sent by a contact to directory, in chunks, and
+        returns the file path.
+        """
+        self.authenticate()
+        return download_to_file(
+            f"{Config.SERPRO_MEDIA_URL}/{media_id}",
+            {"Authorization": self.authenticated_headers["Authorization"]},
+            directory,
+            get_timeout("serpro_media"),
+            sha256,
+        )
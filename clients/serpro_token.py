@@ -0,0 +1,317 @@
+import asyncio
+from dataclasses import dataclass, field
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, Text
+
+from ..config import Config
+from ..deadline import clip_timeout
+from ..metrics import REGISTRY
+from .async_http import get_async_http_pool
+from .circuit_breaker import get_circuit_breaker
+from .http import get_http_pool, get_timeout
+
+logger = logging.getLogger(__name__)
+
+token_refresh_counter = REGISTRY.counter(
+    "serpro_token_refreshes_total",
+    "Requests to the Serpro OAuth endpoint by status code.",
+    label_names=("status",),
+)
+
+# Deletes the lock only if it is still owned by the caller.
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class SerproAuthenticationError(Exception):
+    pass
+
+
+@dataclass
+class SerproTokenManager:
+    """
+    Keeps the Serpro access token in memory together with its expiry.
+
+    The token is shared with other processes through Redis, stored with a TTL
+    matching expires_in. Refreshing is single-flight: a local lock serializes
+    the threads of this process and a Redis lock makes sure only one process
+    calls the OAuth endpoint, while the others wait for the new token to show
+    up in Redis. A timer refreshes the token refresh_margin seconds before it
+    expires, so requests never have to wait for it.
+    """
+
+    redis_client: Any
+    oauth2_endpoint: Text = field(
+        default_factory=lambda: Config.SERPRO_OAUTH2_TOKEN_URL
+    )
+    oauth2_credentials: Dict[Text, Text] = field(default_factory=dict)
+    refresh_margin: float = Config.SERPRO_TOKEN_REFRESH_MARGIN
+    default_expires_in: int = Config.SERPRO_TOKEN_DEFAULT_EXPIRES_IN
+    lock_timeout: float = 10
+    lock_wait: float = 5
+    redis_key: Text = "serpro_access_token"
+    background_refresh: bool = True
+    access_token_headers: Dict[Text, Text] = field(
+        default_factory=lambda: (
+            {
+                "content-type": "application/x-www-form-urlencoded",
+            }
+        )
+    )
+
+    def __post_init__(self):
+        self.lock_key = f"{self.redis_key}:lock"
+        self.access_token: Text = ""
+        self.expires_at: float = 0
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        self._pid = os.getpid()
+        self._release_lock = self.redis_client.register_script(RELEASE_LOCK_SCRIPT)
+
+    def _token_is_fresh(self) -> bool:
+        return bool(self.access_token) and time.time() < self.expires_at
+
+    def get_token(self) -> Text:
+        """
+        Returns a valid access token, refreshing it only when needed.
+        """
+        if self._pid != os.getpid():
+            self._forget_token()
+        if self._token_is_fresh():
+            return self.access_token
+        return self.refresh()
+
+    def invalidate(self, rejected_token: Text) -> Text:
+        """
+        Replaces a token refused by the API. Threads and processes that
+        report the same token share a single refresh.
+        """
+        return self.refresh(rejected_token=rejected_token)
+
+    def refresh(self, rejected_token: Text | None = None) -> Text:
+        with self._lock:
+            if self._token_is_fresh() and self.access_token != rejected_token:
+                return self.access_token
+            if self._load_from_redis(rejected_token):
+                return self.access_token
+            lock_value = uuid.uuid4().hex
+            if self.redis_client.set(
+                self.lock_key, lock_value, nx=True, px=int(self.lock_timeout * 1000)
+            ):
+                try:
+                    self._request_token()
+                finally:
+                    self._release_lock(keys=[self.lock_key], args=[lock_value])
+                return self.access_token
+            return self._wait_for_refresh(rejected_token)
+
+    def _load_from_redis(self, rejected_token: Text | None) -> bool:
+        """
+        Adopts the token stored in Redis when it is not about to expire.
+        """
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.get(self.redis_key)
+        pipeline.ttl(self.redis_key)
+        token, ttl = pipeline.execute()
+        if not token or token == rejected_token or ttl is None or ttl <= 0:
+            return False
+        if ttl <= self.refresh_margin and rejected_token is None:
+            return False
+        self._set_token(token, ttl)
+        return True
+
+    def _wait_for_refresh(self, rejected_token: Text | None) -> Text:
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            if self._load_from_redis(rejected_token or self.access_token or None):
+                return self.access_token
+        raise SerproAuthenticationError(
+            "Timed out waiting for another worker to refresh the Serpro token"
+        )
+
+    def _request_token(self):
+        # Clipped before the circuit breaker, so a spent deadline does not
+        # count as a failure of the OAuth endpoint.
+        timeout = clip_timeout(get_timeout("serpro_oauth"))
+        circuit_breaker = get_circuit_breaker("serpro_oauth")
+        circuit_breaker.before_call()
+        try:
+            response = get_http_pool().post(
+                self.oauth2_endpoint,
+                data=self.oauth2_credentials,
+                headers=self.access_token_headers,
+                timeout=timeout,
+            )
+        except Exception:
+            circuit_breaker.record_failure()
+            raise
+        self._record_oauth_response(circuit_breaker, response)
+        if response.status_code != 200:
+            raise SerproAuthenticationError(
+                f"Serpro OAuth endpoint returned {response.status_code}"
+            )
+        response_data = response.json()
+        access_token = response_data.get("access_token")
+        expires_in = int(response_data.get("expires_in") or self.default_expires_in)
+        self.redis_client.set(self.redis_key, access_token, ex=expires_in)
+        self._set_token(access_token, expires_in)
+
+    def _record_oauth_response(self, circuit_breaker, response):
+        token_refresh_counter.labels(response.status_code).inc()
+        if response.status_code >= 500:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+
+    def _set_token(self, access_token: Text, expires_in: float):
+        self.access_token = access_token
+        self.expires_at = time.time() + expires_in
+        self._schedule_refresh(expires_in)
+
+    def _schedule_refresh(self, expires_in: float):
+        if not self.background_refresh:
+            return
+        if self._timer:
+            self._timer.cancel()
+        # Jitter spreads the refresh of many workers holding the same token;
+        # only the first one to take the Redis lock calls the OAuth endpoint.
+        delay = max(expires_in - self.refresh_margin, 0) + random.uniform(0, 1)
+        self._timer = threading.Timer(delay, self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_in_background(self):
+        try:
+            if self._pid == os.getpid():
+                self.refresh(rejected_token=self.access_token)
+        except Exception:
+            logger.exception("Could not refresh the Serpro access token")
+
+    def _forget_token(self):
+        # Timers do not survive a fork, the child process starts from Redis.
+        self.access_token = ""
+        self.expires_at = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+
+@dataclass
+class AsyncSerproTokenManager(SerproTokenManager):
+    """
+    asyncio version of SerproTokenManager, to be used with a redis.asyncio
+    client. It shares the Redis keys and lock with the sync manager, so sync
+    and async workers can serve the same Serpro account.
+    """
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._lock = asyncio.Lock()
+
+    async def get_token(self) -> Text:
+        if self._pid != os.getpid():
+            self._forget_token()
+        if self._token_is_fresh():
+            return self.access_token
+        return await self.refresh()
+
+    async def invalidate(self, rejected_token: Text) -> Text:
+        return await self.refresh(rejected_token=rejected_token)
+
+    async def refresh(self, rejected_token: Text | None = None) -> Text:
+        async with self._lock:
+            if self._token_is_fresh() and self.access_token != rejected_token:
+                return self.access_token
+            if await self._load_from_redis(rejected_token):
+                return self.access_token
+            lock_value = uuid.uuid4().hex
+            if await self.redis_client.set(
+                self.lock_key, lock_value, nx=True, px=int(self.lock_timeout * 1000)
+            ):
+                try:
+                    await self._request_token()
+                finally:
+                    await self._release_lock(keys=[self.lock_key], args=[lock_value])
+                return self.access_token
+            return await self._wait_for_refresh(rejected_token)
+
+    async def _load_from_redis(self, rejected_token: Text | None) -> bool:
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.get(self.redis_key)
+        pipeline.ttl(self.redis_key)
+        token, ttl = await pipeline.execute()
+        if not token or token == rejected_token or ttl is None or ttl <= 0:
+            return False
+        if ttl <= self.refresh_margin and rejected_token is None:
+            return False
+        self._set_token(token, ttl)
+        return True
+
+    async def _wait_for_refresh(self, rejected_token: Text | None) -> Text:
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            if await self._load_from_redis(rejected_token or self.access_token or None):
+                return self.access_token
+        raise SerproAuthenticationError(
+            "Timed out waiting for another worker to refresh the Serpro token"
+        )
+
+    async def _request_token(self):
+        # Clipped before the circuit breaker, so a spent deadline does not
+        # count as a failure of the OAuth endpoint.
+        timeout = clip_timeout(get_timeout("serpro_oauth"))
+        circuit_breaker = get_circuit_breaker("serpro_oauth")
+        circuit_breaker.before_call()
+        try:
+            response = await get_async_http_pool().post(
+                self.oauth2_endpoint,
+                data=self.oauth2_credentials,
+                headers=self.access_token_headers,
+                timeout=timeout,
+            )
+        except Exception:
+            circuit_breaker.record_failure()
+            raise
+        self._record_oauth_response(circuit_breaker, response)
+        if response.status_code != 200:
+            raise SerproAuthenticationError(
+                f"Serpro OAuth endpoint returned {response.status_code}"
+            )
+        response_data = response.json()
+        access_token = response_data.get("access_token")
+        expires_in = int(response_data.get("expires_in") or self.default_expires_in)
+        await self.redis_client.set(self.redis_key, access_token, ex=expires_in)
+        self._set_token(access_token, expires_in)
+
+    def _schedule_refresh(self, expires_in: float):
+        if not self.background_refresh:
+            return
+        if self._timer:
+            self._timer.cancel()
+        delay = max(expires_in - self.refresh_margin, 0) + random.uniform(0, 1)
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(
+            delay, lambda: loop.create_task(self._refresh_in_background())
+        )
+
+    async def _refresh_in_background(self):
+        try:
+            if self._pid == os.getpid():
+                await self.refresh(rejected_token=self.access_token)
+        except Exception:
+            logger.exception("Could not refresh the Serpro access token")
+
+    def _forget_token(self):
+        super()._forget_token()
+        self._lock = asyncio.Lock()
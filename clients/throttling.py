@@ -0,0 +1,368 @@
+import asyncio
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+import inspect
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Tuple
+
+from ..config import Config
+from ..deadline import DeadlineExceeded, check_deadline, clip_timeout, remaining_time
+from ..metrics import REGISTRY
+from .circuit_breaker import CircuitBreaker
+
+throttled_counter = REGISTRY.counter(
+    "whatsapp_send_throttled_total",
+    "Sends delayed by the rate limiter or throttled by the provider.",
+)
+retried_counter = REGISTRY.counter(
+    "whatsapp_send_retried_total", "Sends retried after a 429 or 5xx response."
+)
+dropped_counter = REGISTRY.counter(
+    "whatsapp_send_dropped_total",
+    "Sends given up after the rate limiter timeout or the last retry.",
+)
+send_histogram = REGISTRY.histogram(
+    "whatsapp_send_seconds",
+    "Duration of each send attempt to a provider endpoint.",
+    label_names=("endpoint",),
+)
+responses_counter = REGISTRY.counter(
+    "whatsapp_send_responses_total",
+    "Responses of the provider endpoints by status code; error for exceptions.",
+    label_names=("endpoint", "status"),
+)
+
+# Cloud API errors returned when a throughput limit is hit, sometimes with a
+# 400 status: https://developers.facebook.com/docs/whatsapp/cloud-api/support/error-codes
+CLOUD_API_THROTTLING_ERROR_CODES = (4, 80007, 130429, 131048, 131056)
+
+# Takes tokens from a bucket stored as a Redis hash. Returns 0 when the tokens
+# were taken, or the milliseconds to wait until they are available.
+REDIS_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated_at) * rate / 1000)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = math.ceil((requested - tokens) * 1000 / rate)
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+@dataclass
+class TokenBucket:
+    """
+    Token bucket limiter kept in the memory of the process.
+    """
+
+    rate: float
+    capacity: float = 0
+
+    def __post_init__(self):
+        self.capacity = self.capacity or self.rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Takes tokens from the bucket. Returns 0 on success or the seconds
+        to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+
+@dataclass
+class RedisTokenBucket:
+    """
+    Token bucket limiter stored in Redis and shared by every process that
+    uses the same key. Works with both redis and redis.asyncio clients; with
+    the latter, try_acquire returns an awaitable.
+    """
+
+    redis_client: Any
+    key: str
+    rate: float
+    capacity: float = 0
+
+    def __post_init__(self):
+        self.capacity = self.capacity or self.rate
+        self._script = self.redis_client.register_script(REDIS_TOKEN_BUCKET_SCRIPT)
+
+    def try_acquire(self, tokens: float = 1) -> float | Awaitable[float]:
+        wait = self._script(keys=[self.key], args=[self.rate, self.capacity, tokens])
+        if inspect.isawaitable(wait):
+            return self._to_seconds(wait)
+        return int(wait) / 1000
+
+    async def _to_seconds(self, wait: Awaitable) -> float:
+        return int(await wait) / 1000
+
+
+def create_rate_limiter(key: str, redis_client: Any = None):
+    """
+    Returns the limiter configured by SEND_RATE_LIMIT* for key, or None
+    when rate limiting is disabled.
+    """
+    if Config.SEND_RATE_LIMIT <= 0:
+        return None
+    if Config.SEND_RATE_LIMIT_BACKEND == "redis" and redis_client is not None:
+        return RedisTokenBucket(
+            redis_client=redis_client,
+            key=f"whatsapp_rate_limit:{key}",
+            rate=Config.SEND_RATE_LIMIT,
+            capacity=Config.SEND_RATE_LIMIT_BURST,
+        )
+    return TokenBucket(
+        rate=Config.SEND_RATE_LIMIT, capacity=Config.SEND_RATE_LIMIT_BURST
+    )
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Decides when a send is retried and how long to wait before it.
+
+    429, 5xx and Cloud API throughput errors are retried with full-jitter
+    exponential backoff, unless the provider tells how long to wait with a
+    Retry-After header.
+    """
+
+    max_retries: int = Config.SEND_MAX_RETRIES
+    base_delay: float = Config.SEND_RETRY_BASE_DELAY
+    max_delay: float = Config.SEND_RETRY_MAX_DELAY
+    retry_statuses: Tuple[int, ...] = field(
+        default_factory=lambda: (429, 500, 502, 503, 504)
+    )
+
+    def is_throttled(self, response: Any) -> bool:
+        if response.status_code == 429:
+            return True
+        if response.status_code != 400:
+            return False
+        try:
+            error = response.json().get("error") or {}
+        except (ValueError, AttributeError):
+            return False
+        return error.get("code") in CLOUD_API_THROTTLING_ERROR_CODES
+
+    def should_retry(self, response: Any) -> bool:
+        return response.status_code in self.retry_statuses or self.is_throttled(
+            response
+        )
+
+    def get_delay(self, attempt: int, response: Any) -> float:
+        retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def _parse_retry_after(self, retry_after: str | None) -> float | None:
+        if not retry_after:
+            return None
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+
+def acquire(limiter: Any, timeout: float = Config.SEND_RATE_LIMIT_TIMEOUT):
+    """
+    Waits for the limiter, raising RateLimitExceeded after timeout seconds.
+    """
+    if limiter is None:
+        return
+    remaining = remaining_time()
+    if remaining is not None:
+        timeout = min(timeout, remaining)
+    deadline = time.monotonic() + timeout
+    wait = limiter.try_acquire()
+    if wait:
+        throttled_counter.inc()
+    while wait:
+        if time.monotonic() + wait > deadline:
+            dropped_counter.inc()
+            raise RateLimitExceeded("Timed out waiting for the send rate limiter")
+        time.sleep(wait)
+        wait = limiter.try_acquire()
+
+
+async def acquire_async(limiter: Any, timeout: float = Config.SEND_RATE_LIMIT_TIMEOUT):
+    if limiter is None:
+        return
+    remaining = remaining_time()
+    if remaining is not None:
+        timeout = min(timeout, remaining)
+    deadline = time.monotonic() + timeout
+    wait = limiter.try_acquire()
+    if inspect.isawaitable(wait):
+        wait = await wait
+    if wait:
+        throttled_counter.inc()
+    while wait:
+        if time.monotonic() + wait > deadline:
+            dropped_counter.inc()
+            raise RateLimitExceeded("Timed out waiting for the send rate limiter")
+        await asyncio.sleep(wait)
+        wait = limiter.try_acquire()
+        if inspect.isawaitable(wait):
+            wait = await wait
+
+
+def _delay_before_retry(retry_policy: RetryPolicy, attempt: int, response: Any):
+    """
+    Returns how long to wait before the next attempt, or raises
+    DeadlineExceeded when the retry would not fit in the current deadline.
+    """
+    delay = retry_policy.get_delay(attempt, response)
+    remaining = remaining_time()
+    if remaining is not None and delay >= remaining:
+        raise DeadlineExceeded("No time left to retry the send")
+    return delay
+
+
+def _is_failure(response: Any) -> bool:
+    return response.status_code >= 500
+
+
+def _endpoint_name(circuit_breaker: CircuitBreaker | None) -> str:
+    # Circuit breakers are named after the endpoint they protect.
+    return circuit_breaker.name if circuit_breaker else "unknown"
+
+
+def _record_attempt(endpoint: str, started: float, status: Any):
+    send_histogram.labels(endpoint).observe(time.perf_counter() - started)
+    responses_counter.labels(endpoint, status).inc()
+
+
+def send_with_retry(
+    send: Callable[[Tuple[float, float]], Any],
+    limiter: Any = None,
+    retry_policy: RetryPolicy | None = None,
+    circuit_breaker: CircuitBreaker | None = None,
+    timeout: Tuple[float, float] = (
+        Config.HTTP_CONNECT_TIMEOUT,
+        Config.HTTP_READ_TIMEOUT,
+    ),
+):
+    """
+    Calls send(timeout) after taking a token from limiter, retrying throttled
+    and failed responses according to retry_policy. Returns the last response.
+
+    Every attempt respects the current deadline: timeout is clipped to it
+    before the circuit breaker is consulted, so a deadline spent waiting for
+    the limiter raises DeadlineExceeded without counting against the
+    endpoint. circuit_breaker makes the send fail fast while the endpoint is
+    unhealthy. Attempts are timed and counted by status code under the
+    circuit breaker name.
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    endpoint = _endpoint_name(circuit_breaker)
+    attempt = 0
+    while True:
+        check_deadline()
+        acquire(limiter)
+        attempt_timeout = clip_timeout(timeout)
+        if circuit_breaker:
+            circuit_breaker.before_call()
+        started = time.perf_counter()
+        try:
+            response = send(attempt_timeout)
+        except Exception:
+            _record_attempt(endpoint, started, "error")
+            if circuit_breaker:
+                circuit_breaker.record_failure()
+            raise
+        _record_attempt(endpoint, started, response.status_code)
+        if circuit_breaker:
+            if _is_failure(response):
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.record_success()
+        if not retry_policy.should_retry(response):
+            return response
+        if retry_policy.is_throttled(response):
+            throttled_counter.inc()
+        if attempt >= retry_policy.max_retries:
+            dropped_counter.inc()
+            return response
+        delay = _delay_before_retry(retry_policy, attempt, response)
+        retried_counter.inc()
+        time.sleep(delay)
+        attempt += 1
+
+
+async def send_with_retry_async(
+    send: Callable[[Tuple[float, float]], Awaitable[Any]],
+    limiter: Any = None,
+    retry_policy: RetryPolicy | None = None,
+    circuit_breaker: CircuitBreaker | None = None,
+    timeout: Tuple[float, float] = (
+        Config.HTTP_CONNECT_TIMEOUT,
+        Config.HTTP_READ_TIMEOUT,
+    ),
+):
+    retry_policy = retry_policy or RetryPolicy()
+    endpoint = _endpoint_name(circuit_breaker)
+    attempt = 0
+    while True:
+        check_deadline()
+        await acquire_async(limiter)
+        attempt_timeout = clip_timeout(timeout)
+        if circuit_breaker:
+            circuit_breaker.before_call()
+        started = time.perf_counter()
+        try:
+            response = await send(attempt_timeout)
+        except Exception:
+            _record_attempt(endpoint, started, "error")
+            if circuit_breaker:
+                circuit_breaker.record_failure()
+            raise
+        _record_attempt(endpoint, started, response.status_code)
+        if circuit_breaker:
+            if _is_failure(response):
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.record_success()
+        if not retry_policy.should_retry(response):
+            return response
+        if retry_policy.is_throttled(response):
+            throttled_counter.inc()
+        if attempt >= retry_policy.max_retries:
+            dropped_counter.inc()
+            return response
+        delay = _delay_before_retry(retry_policy, attempt, response)
+        retried_counter.inc()
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,176 @@
+import asyncio
+from dataclasses import dataclass
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Text, Tuple
+
+from .config import Config
+from .metrics import REGISTRY
+from .profiling import traced
+
+logger = logging.getLogger(__name__)
+
+coalesced_counter = REGISTRY.counter(
+    "whatsapp_messages_coalesced_total",
+    "Messages held to be answered together with an earlier message of the contact.",
+)
+
+
+@dataclass
+class PendingMessages:
+    events: List[Any]
+    first_at: float
+    due_at: float
+    handler: Callable[[List[Any]], None] | None = None
+
+
+def next_due_at(pending: PendingMessages, now: float, window: float, max_delay: float):
+    # Each message extends the window, but never past the first message cap.
+    return min(now + window, pending.first_at + max_delay)
+
+
+@dataclass
+class MessageCoalescer:
+    """
+    Holds the messages of each contact for a short window, so a burst of
+    quick messages is answered by a single backend call.
+
+    The window restarts with every message of the contact, but the pending
+    messages are always released max_delay seconds after the first one.
+    Released messages are passed, in arrival order, to handler, which runs
+    on the coalescer thread, bound to the request trace of the first
+    submit() if any, and should only hand them over to an executor.
+    """
+
+    handler: Callable[[List[Any]], None]
+    window: float = Config.COALESCE_WINDOW
+    max_delay: float = Config.COALESCE_MAX_DELAY
+
+    def __post_init__(self):
+        self._condition = threading.Condition()
+        self._pending: Dict[Text, PendingMessages] = {}
+        self._timers: List[Tuple[float, int, Text]] = []
+        self._sequence = itertools.count()
+        self._pid = None
+
+    def _start(self):
+        # Threads do not survive a fork, so the child starts its own.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending = {}
+            self._timers = []
+            threading.Thread(
+                target=self._run, name="message-coalescer", daemon=True
+            ).start()
+
+    def submit(self, key: Text, whatsapp_event: Any):
+        now = time.monotonic()
+        with self._condition:
+            self._start()
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = PendingMessages(
+                    [whatsapp_event], now, now, traced(self.handler)
+                )
+                self._pending[key] = pending
+            else:
+                pending.events.append(whatsapp_event)
+                coalesced_counter.inc()
+            pending.due_at = next_due_at(pending, now, self.window, self.max_delay)
+            heapq.heappush(self._timers, (pending.due_at, next(self._sequence), key))
+            self._condition.notify()
+
+    def _next_released(self) -> PendingMessages:
+        with self._condition:
+            while True:
+                if not self._timers:
+                    self._condition.wait()
+                    continue
+                due_at, _, key = self._timers[0]
+                pending = self._pending.get(key)
+                if pending is None or pending.due_at != due_at:
+                    # Superseded by a later message of the same contact.
+                    heapq.heappop(self._timers)
+                    continue
+                wait = due_at - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                heapq.heappop(self._timers)
+                return self._pending.pop(key)
+
+    def _hand_over(self, pending: PendingMessages):
+        try:
+            pending.handler(pending.events)
+        except Exception:
+            logger.exception("Could not hand over coalesced messages")
+
+    def _run(self):
+        while True:
+            self._hand_over(self._next_released())
+
+    def flush(self):
+        """
+        Releases every pending message now, calling handler on this thread,
+        so no message is lost when the process exits.
+        """
+        with self._condition:
+            released = list(self._pending.values())
+            self._pending = {}
+            self._timers = []
+        for pending in released:
+            self._hand_over(pending)
+
+
+@dataclass
+class AsyncMessageCoalescer:
+    """
+    asyncio version of MessageCoalescer, using one loop timer per contact.
+    handler is a coroutine function, run as a task when messages are released.
+    """
+
+    handler: Callable[[List[Any]], Awaitable[None]]
+    window: float = Config.COALESCE_WINDOW
+    max_delay: float = Config.COALESCE_MAX_DELAY
+
+    def __post_init__(self):
+        self._pending: Dict[Text, PendingMessages] = {}
+        self._timers: Dict[Text, asyncio.TimerHandle] = {}
+        self.tasks: set = set()
+
+    def submit(self, key: Text, whatsapp_event: Any):
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = PendingMessages([whatsapp_event], now, now)
+            self._pending[key] = pending
+        else:
+            pending.events.append(whatsapp_event)
+            coalesced_counter.inc()
+            self._timers.pop(key).cancel()
+        pending.due_at = next_due_at(pending, now, self.window, self.max_delay)
+        self._timers[key] = loop.call_later(
+            max(pending.due_at - now, 0), self._release, key
+        )
+
+    def _release(self, key: Text):
+        self._timers.pop(key, None)
+        events = self._pending.pop(key).events
+        task = asyncio.get_running_loop().create_task(self.handler(events))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self):
+        """
+        Releases every pending message now and waits for their handlers.
+        """
+        for key in list(self._pending):
+            self._timers.pop(key).cancel()
+            self._release(key)
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -1,24 +1,216 @@
 import os
 from dotenv import load_dotenv
 
+# The only place the .env file is read.
 load_dotenv()
 
 
+class derived_setting:
+    """
+    Config attribute computed from other settings on first access, then
+    stored on the class like any other setting.
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        value = self.function(owner)
+        setattr(owner, self.name, value)
+        return value
+
+
 class Config:
-    SERPRO_OAUTH2_TOKEN_URL = "https://api.whatsapp.serpro.gov.br/oauth2/token"
+    # Base URLs of the providers; point them to the simulator for load tests.
+    CLOUD_API_BASE_URL = os.getenv(
+        "CLOUD_API_BASE_URL", "https://graph.facebook.com/v19.0"
+    ).rstrip("/")
+    SERPRO_API_BASE_URL = os.getenv(
+        "SERPRO_API_BASE_URL", "https://api.whatsapp.serpro.gov.br"
+    ).rstrip("/")
     RASA_WEBHOOK_URL = os.getenv(
         "RASA_WEBHOOK_URL",
         "https://metawebhooks.pencillabs.tec.br/webhooks/whatsapp/webhook",
     )
-    SERPRO_CLIENT_URL = f'https://api.whatsapp.serpro.gov.br/client/{os.getenv("SERPRO_CLIENT_ID", "")}/v2'
-    SERPRO_WEBHOOK_REGISTRATION_URL = f"{SERPRO_CLIENT_URL}/webhook"
     SERPRO_WABA_ID = os.getenv("SERPRO_WABA_ID", "")
-    SERPRO_TEXT_MESSAGES_URL = f"{SERPRO_CLIENT_URL}/requisicao/mensagem/texto"
-    SERPRO_BUTTONS_MESSAGES_URL = (
-        f"{SERPRO_CLIENT_URL}/requisicao/mensagem/interativa-botoes"
-    )
-    SERPRO_LIST_MESSAGES_URL = (
-        f"{SERPRO_CLIENT_URL}/requisicao/mensagem/interativa-lista"
-    )
+
+    # Serpro endpoints are built on first use, from the base URL in effect then.
+    @derived_setting
+    def SERPRO_OAUTH2_TOKEN_URL(cls):
+        return f"{cls.SERPRO_API_BASE_URL}/oauth2/token"
+
+    @derived_setting
+    def SERPRO_CLIENT_URL(cls):
+        client_id = os.getenv("SERPRO_CLIENT_ID", "")
+        return f"{cls.SERPRO_API_BASE_URL}/client/{client_id}/v2"
+
+    @derived_setting
+    def SERPRO_WEBHOOK_REGISTRATION_URL(cls):
+        return f"{cls.SERPRO_CLIENT_URL}/webhook"
+
+    @derived_setting
+    def SERPRO_TEXT_MESSAGES_URL(cls):
+        return f"{cls.SERPRO_CLIENT_URL}/requisicao/mensagem/texto"
+
+    @derived_setting
+    def SERPRO_BUTTONS_MESSAGES_URL(cls):
+        return f"{cls.SERPRO_CLIENT_URL}/requisicao/mensagem/interativa-botoes"
+
+    @derived_setting
+    def SERPRO_LIST_MESSAGES_URL(cls):
+        return f"{cls.SERPRO_CLIENT_URL}/requisicao/mensagem/interativa-lista"
+
+    @derived_setting
+    def SERPRO_MEDIA_URL(cls):
+        return f"{cls.SERPRO_CLIENT_URL}/midia"
+
+    @derived_setting
+    def SERPRO_MEDIA_MESSAGES_URL(cls):
+        return f"{cls.SERPRO_CLIENT_URL}/requisicao/mensagem/midia"
+
     REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT = os.getenv("REDIS_PORT", "6379")
+    # When true, the webhook only enqueues events and a worker pool answers them.
+    WEBHOOK_ASYNC_MODE = os.getenv("WEBHOOK_ASYNC_MODE", "false").lower() == "true"
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+    # One of: reject, drop_oldest, drop_newest, block.
+    WEBHOOK_QUEUE_FULL_POLICY = os.getenv("WEBHOOK_QUEUE_FULL_POLICY", "reject")
+    WEBHOOK_QUEUE_BLOCK_TIMEOUT = float(
+        os.getenv("WEBHOOK_QUEUE_BLOCK_TIMEOUT", "0.05")
+    )
+    # Connections kept alive per provider host by the shared HTTP session.
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+    # When true, requests wait for a free connection instead of opening extra ones.
+    HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true"
+    # HTTP/2 requires the optional httpx[http2] dependency.
+    HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+    # Seconds before expiry when the Serpro access token is refreshed.
+    SERPRO_TOKEN_REFRESH_MARGIN = float(os.getenv("SERPRO_TOKEN_REFRESH_MARGIN", "60"))
+    # Used when the OAuth response has no expires_in.
+    SERPRO_TOKEN_DEFAULT_EXPIRES_IN = int(
+        os.getenv("SERPRO_TOKEN_DEFAULT_EXPIRES_IN", "3600")
+    )
+    # Messages of a webhook batch answered at the same time (one contact at a time).
+    EVENT_FANOUT_WORKERS = int(os.getenv("EVENT_FANOUT_WORKERS", "8"))
+    # Recipients sent to at the same time by the outbound dispatcher.
+    DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", "16"))
+    # Recipients a broadcast sends to between two saves of its checkpoint.
+    BROADCAST_CHECKPOINT_INTERVAL = int(
+        os.getenv("BROADCAST_CHECKPOINT_INTERVAL", "100")
+    )
+    # Outgoing messages per second per phone number id (Cloud API) or WABA
+    # (Serpro). 0 disables the limiter.
+    SEND_RATE_LIMIT = float(os.getenv("SEND_RATE_LIMIT", "0"))
+    SEND_RATE_LIMIT_BURST = float(os.getenv("SEND_RATE_LIMIT_BURST", "0"))
+    # local keeps the bucket in the process, redis shares it between processes.
+    SEND_RATE_LIMIT_BACKEND = os.getenv("SEND_RATE_LIMIT_BACKEND", "local")
+    # Seconds a send may wait for the limiter before being dropped.
+    SEND_RATE_LIMIT_TIMEOUT = float(os.getenv("SEND_RATE_LIMIT_TIMEOUT", "30"))
+    SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+    SEND_RETRY_BASE_DELAY = float(os.getenv("SEND_RETRY_BASE_DELAY", "0.5"))
+    SEND_RETRY_MAX_DELAY = float(os.getenv("SEND_RETRY_MAX_DELAY", "30"))
+    # Default timeouts of outbound requests, in seconds. They can be set per
+    # endpoint with <ENDPOINT>_CONNECT_TIMEOUT and <ENDPOINT>_READ_TIMEOUT, e.g.
+    # CLOUD_API_MESSAGES_READ_TIMEOUT or SERPRO_OAUTH_CONNECT_TIMEOUT.
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+    # Seconds to answer one message, shared by the backend call and the sends.
+    EVENT_DEADLINE = float(os.getenv("EVENT_DEADLINE", "25"))
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(
+        os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5")
+    )
+    CIRCUIT_BREAKER_RECOVERY_TIMEOUT = float(
+        os.getenv("CIRCUIT_BREAKER_RECOVERY_TIMEOUT", "30")
+    )
+    # none, local (in-process LRU only) or redis (LRU in front of Redis).
+    IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "local")
+    IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    IDEMPOTENCY_LOCAL_CACHE_SIZE = int(
+        os.getenv("IDEMPOTENCY_LOCAL_CACHE_SIZE", "10000")
+    )
+    # Recipient-independent payloads kept by each messages parser.
+    PAYLOAD_CACHE_SIZE = int(os.getenv("PAYLOAD_CACHE_SIZE", "1024"))
+    # auto picks orjson, then msgspec, then the standard library json module.
+    JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+    # fake (fixed answers), rasa or package.module:Class; see backends.py.
+    ANSWER_BACKEND = os.getenv("ANSWER_BACKEND", "fake")
+    # Class used by asgi.py when ANSWER_BACKEND is a custom sync class.
+    ASYNC_ANSWER_BACKEND = os.getenv("ASYNC_ANSWER_BACKEND", "")
+    RASA_REST_URL = os.getenv(
+        "RASA_REST_URL", "http://localhost:5005/webhooks/rest/webhook"
+    )
+    # Calls to the answer backend in flight per process (per event loop in asgi.py).
+    ANSWER_BACKEND_CONCURRENCY = int(os.getenv("ANSWER_BACKEND_CONCURRENCY", "32"))
+    # Intents whose answers are cached, comma separated ("*" for all). Empty
+    # disables the answer cache; see answer_cache.py.
+    ANSWER_CACHE_INTENTS = os.getenv("ANSWER_CACHE_INTENTS", "")
+    ANSWER_CACHE_EXCLUDED_INTENTS = os.getenv("ANSWER_CACHE_EXCLUDED_INTENTS", "")
+    # package.module:function(message, sender_id) returning the conversation state.
+    ANSWER_CACHE_STATE_KEY = os.getenv("ANSWER_CACHE_STATE_KEY", "")
+    ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "300"))
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+    # local keeps the answers in the process, redis shares them between processes.
+    ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "local")
+    # Seconds to wait for more messages of a contact before answering them
+    # together. 0 answers every message on its own.
+    COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0"))
+    # Most seconds a message is held, however many messages follow it.
+    COALESCE_MAX_DELAY = float(os.getenv("COALESCE_MAX_DELAY", "2"))
+    # true adds the answers to Redis Streams, sent by the outbound workers
+    # (python -m whatsapp_api_integration.outbound) instead of the webhook.
+    OUTBOUND_QUEUE_ENABLED = (
+        os.getenv("OUTBOUND_QUEUE_ENABLED", "false").lower() == "true"
+    )
+    OUTBOUND_STREAM_PREFIX = os.getenv("OUTBOUND_STREAM_PREFIX", "whatsapp_outbound")
+    # Streams the recipients are spread over; the most workers that can send.
+    OUTBOUND_PARTITIONS = int(os.getenv("OUTBOUND_PARTITIONS", "16"))
+    OUTBOUND_CONSUMER_GROUP = os.getenv("OUTBOUND_CONSUMER_GROUP", "senders")
+    # Entries read from each partition per XREADGROUP.
+    OUTBOUND_BATCH_SIZE = int(os.getenv("OUTBOUND_BATCH_SIZE", "64"))
+    # Seconds XREADGROUP waits for new entries.
+    OUTBOUND_BLOCK = float(os.getenv("OUTBOUND_BLOCK", "1"))
+    # Seconds a partition stays leased to a worker that stopped renewing it.
+    OUTBOUND_LEASE_TTL = float(os.getenv("OUTBOUND_LEASE_TTL", "30"))
+    # Seconds an entry stays pending before another worker may claim it.
+    OUTBOUND_CLAIM_IDLE = float(os.getenv("OUTBOUND_CLAIM_IDLE", "60"))
+    OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "5"))
+    # Seconds a partition waits after a failed send before retrying it.
+    OUTBOUND_RETRY_DELAY = float(os.getenv("OUTBOUND_RETRY_DELAY", "1"))
+    # Directory where the media sent by the contacts is saved before the
+    # message is answered. Empty leaves the media with the provider.
+    MEDIA_DOWNLOAD_DIR = os.getenv("MEDIA_DOWNLOAD_DIR", "")
+    # Bytes read or written at a time when downloading or uploading media.
+    MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", "65536"))
+    # Seconds an uploaded media id is reused. The Cloud API keeps uploaded
+    # media for 30 days.
+    MEDIA_ID_TTL = int(os.getenv("MEDIA_ID_TTL", str(29 * 24 * 3600)))
+    # local keeps the media ids in the process, redis shares them between processes.
+    MEDIA_CACHE_BACKEND = os.getenv("MEDIA_CACHE_BACKEND", "local")
+    # Directory shared by the workers of one server (gunicorn -w N), so that
+    # /metrics reports their sum whichever worker answers it. Empty reports
+    # the metrics of the answering process only.
+    METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+    # Seconds between two writes of the metrics of a worker to that directory.
+    METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+    # Request profiling of server.py; see profiling.py. It can also be turned
+    # on and off at runtime with PROFILING_SIGNAL or the admin endpoint.
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    # Share of the requests whose profile is kept, from 0 to 1.
+    PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+    # Requests slower than this many seconds are always kept. 0 keeps only the
+    # sampled ones.
+    PROFILING_SLOW_THRESHOLD = float(os.getenv("PROFILING_SLOW_THRESHOLD", "1"))
+    # Profiles kept by each process; the oldest ones are dropped.
+    PROFILING_BUFFER_SIZE = int(os.getenv("PROFILING_BUFFER_SIZE", "100"))
+    # Seconds between two samples of the stacks of the profiled requests.
+    PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.005"))
+    # Signal that turns profiling on and off, writing the profiles to
+    # PROFILING_DUMP_DIR when it is turned off. Empty disables it.
+    PROFILING_SIGNAL = os.getenv("PROFILING_SIGNAL", "SIGUSR2")
+    PROFILING_DUMP_DIR = os.getenv("PROFILING_DUMP_DIR", "/tmp")
+    # Bearer token of the /admin endpoints. Empty disables them.
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+import time
+from typing import Iterator, Optional, Tuple
+
+from .config import Config
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@dataclass
+class Deadline:
+    """
+    Time budget shared by every step of answering one WhatsApp message.
+    """
+
+    budget: float = Config.EVENT_DEADLINE
+
+    def __post_init__(self):
+        self.expires_at = time.monotonic() + self.budget
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline of {self.budget}s exceeded")
+
+
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+@contextmanager
+def deadline_scope(budget: float = Config.EVENT_DEADLINE) -> Iterator[Deadline]:
+    """
+    Makes a new deadline the current one for the code run inside the block.
+    """
+    deadline = Deadline(budget)
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def check_deadline():
+    deadline = current_deadline.get()
+    if deadline:
+        deadline.check()
+
+
+def clip_timeout(timeout: Tuple[float, float]) -> Tuple[float, float]:
+    """
+    Shortens a (connect, read) timeout so the request cannot outlive the
+    current deadline. Raises DeadlineExceeded when no time is left.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return timeout
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"Deadline of {deadline.budget}s exceeded")
+    return min(timeout[0], remaining), min(timeout[1], remaining)
+
+
+def remaining_time() -> float | None:
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline.remaining()
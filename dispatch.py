@@ -0,0 +1,274 @@
+import asyncio
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, List, Text
+
+from .config import Config
+from .deadline import check_deadline
+from .profiling import stage, traced
+
+
+@dataclass
+class KeyedExecutor:
+    """
+    Runs tasks in parallel across keys and in submission order within a key.
+
+    Tasks submitted with the same key (a contact phone, for example) never run
+    at the same time and start in the order they were submitted, while tasks of
+    different keys share up to max_workers threads.
+    """
+
+    max_workers: int = Config.EVENT_FANOUT_WORKERS
+    thread_name_prefix: str = "keyed-executor"
+
+    def __post_init__(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix
+        )
+        self._lock = threading.Lock()
+        self._queues: Dict[Hashable, Deque] = {}
+
+    def submit(self, key: Hashable, fn: Callable, *args, **kwargs) -> Future:
+        future: Future = Future()
+        with self._lock:
+            queue = self._queues.get(key)
+            start_drain = queue is None
+            if start_drain:
+                queue = self._queues[key] = deque()
+            queue.append((future, fn, args, kwargs))
+        if start_drain:
+            self._executor.submit(self._drain, key)
+        return future
+
+    def _drain(self, key: Hashable):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                # The key stays registered while its task runs, so tasks
+                # submitted meanwhile are queued behind it.
+                future, fn, args, kwargs = queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as exception:
+                future.set_exception(exception)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+class OutboundSendError(Exception):
+    """
+    Raised when the provider answered a send with a non-2xx status, once the
+    client retries were spent.
+    """
+
+    def __init__(self, response: Any):
+        super().__init__(f"Send returned {response.status_code}")
+        self.response = response
+
+
+def check_response(response: Any) -> Any:
+    """
+    Returns response, raising OutboundSendError when it is not a 2xx.
+    """
+    if not 200 <= response.status_code < 300:
+        raise OutboundSendError(response)
+    return response
+
+
+def get_recipient(payload: Dict) -> Text:
+    """
+    Returns the recipient of a Cloud API or Serpro API payload.
+    """
+    return payload.get("to") or payload.get("destinatario") or ""
+
+
+def group_by_recipient(payloads: Iterable[Dict]) -> Dict[Text, List[Dict]]:
+    payloads_by_recipient: Dict[Text, List[Dict]] = {}
+    for payload in payloads:
+        payloads_by_recipient.setdefault(get_recipient(payload), []).append(payload)
+    return payloads_by_recipient
+
+
+@dataclass
+class RecipientResult:
+    """
+    Outcome of sending the payloads of one recipient. responses holds the
+    2xx responses only; a non-2xx one ends the sequence as an
+    OutboundSendError in error.
+    """
+
+    recipient: Text
+    total: int = 0
+    responses: List[Any] = field(default_factory=list)
+    error: BaseException | None = None
+    elapsed: float = 0
+
+    @property
+    def sent(self) -> int:
+        return len(self.responses)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.sent == self.total
+
+
+@dataclass
+class OutboundDispatcher:
+    """
+    Sends CloudApiMessagesParser or SerproApiMessagesParser payloads of many
+    recipients at once.
+
+    Payloads of the same recipient (to or destinatario) are sent strictly in
+    order, also across concurrent dispatch() calls, while different recipients
+    are sent in parallel, up to max_concurrency at a time. When a send fails,
+    raising or answered with a non-2xx status (OutboundSendError), or the
+    deadline of the caller is spent, the remaining payloads of that recipient
+    are skipped so the conversation never arrives out of order.
+    """
+
+    client: Any
+    max_concurrency: int = Config.DISPATCH_CONCURRENCY
+
+    def __post_init__(self):
+        self._executor = KeyedExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="outbound-dispatch"
+        )
+
+    def _send_recipient_payloads(
+        self, recipient: Text, payloads: List[Dict]
+    ) -> RecipientResult:
+        result = RecipientResult(recipient=recipient, total=len(payloads))
+        started_at = time.monotonic()
+        try:
+            for payload in payloads:
+                check_deadline()
+                with stage("send"):
+                    response = self.client.send_message(payload)
+                result.responses.append(check_response(response))
+        except Exception as exception:
+            result.error = exception
+        result.elapsed = time.monotonic() - started_at
+        return result
+
+    def submit_recipient(
+        self,
+        recipient: Text,
+        payloads: List[Dict],
+        on_complete: Callable[[RecipientResult], None] | None = None,
+    ) -> Future:
+        """
+        Schedules the payloads of one recipient and returns a future of its
+        RecipientResult. The sends run in a copy of the caller context, so
+        they share its deadline and request trace.
+        """
+        future = self._executor.submit(
+            recipient,
+            traced(copy_context().run),
+            self._send_recipient_payloads,
+            recipient,
+            payloads,
+        )
+        if on_complete:
+            future.add_done_callback(lambda done: on_complete(done.result()))
+        return future
+
+    def submit(
+        self,
+        payloads: Iterable[Dict],
+        on_complete: Callable[[RecipientResult], None] | None = None,
+    ) -> Dict[Text, Future]:
+        """
+        Schedules payloads and returns a future of RecipientResult for each
+        recipient. on_complete is called from a worker thread as soon as a
+        recipient is done.
+        """
+        return {
+            recipient: self.submit_recipient(recipient, recipient_payloads, on_complete)
+            for recipient, recipient_payloads in group_by_recipient(payloads).items()
+        }
+
+    def dispatch(
+        self,
+        payloads: Iterable[Dict],
+        on_complete: Callable[[RecipientResult], None] | None = None,
+    ) -> Dict[Text, RecipientResult]:
+        """
+        Sends payloads and waits for every recipient to be done.
+        """
+        futures = self.submit(payloads, on_complete)
+        wait(futures.values())
+        return {recipient: future.result() for recipient, future in futures.items()}
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+@dataclass
+class AsyncOutboundDispatcher:
+    """
+    asyncio version of OutboundDispatcher, to be used with the async clients.
+    Payloads of the same recipient are sent in order within one dispatch()
+    call only; concurrent calls for the same recipient may interleave.
+    """
+
+    client: Any
+    max_concurrency: int = Config.DISPATCH_CONCURRENCY
+
+    async def send_recipient(
+        self, recipient: Text, payloads: List[Dict]
+    ) -> RecipientResult:
+        """
+        Sends the payloads of one recipient in order, stopping at the first
+        failure or once the deadline of the caller is spent.
+        """
+        result = RecipientResult(recipient=recipient, total=len(payloads))
+        started_at = time.monotonic()
+        try:
+            for payload in payloads:
+                check_deadline()
+                response = await self.client.send_message(payload)
+                result.responses.append(check_response(response))
+        except Exception as exception:
+            result.error = exception
+        result.elapsed = time.monotonic() - started_at
+        return result
+
+    async def _send_recipient_payloads(
+        self,
+        semaphore: asyncio.Semaphore,
+        recipient: Text,
+        payloads: List[Dict],
+        on_complete: Callable[[RecipientResult], None] | None,
+    ) -> RecipientResult:
+        async with semaphore:
+            result = await self.send_recipient(recipient, payloads)
+        if on_complete:
+            on_complete(result)
+        return result
+
+    async def dispatch(
+        self,
+        payloads: Iterable[Dict],
+        on_complete: Callable[[RecipientResult], None] | None = None,
+    ) -> Dict[Text, RecipientResult]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        payloads_by_recipient = group_by_recipient(payloads)
+        results = await asyncio.gather(
+            *(
+                self._send_recipient_payloads(
+                    semaphore, recipient, recipient_payloads, on_complete
+                )
+                for recipient, recipient_payloads in payloads_by_recipient.items()
+            )
+        )
+        return {result.recipient: result for result in results}
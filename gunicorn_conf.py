@@ -0,0 +1,43 @@
+"""
+gunicorn settings for server.py:
+
+    gunicorn -c python:whatsapp_api_integration.gunicorn_conf -b 0.0.0.0:5006
+
+The app is built once in the master and the workers are forked from it,
+sharing its memory; each worker then creates its own connections.
+"""
+
+import gc
+
+from .lifecycle import init_worker, shutdown_worker
+from .metrics import clear_multiprocess_metrics
+from .profiling import install_signal_handler
+
+wsgi_app = "whatsapp_api_integration.server:create_app()"
+preload_app = True
+
+
+def on_starting(server):
+    # Counts of a previous run would otherwise be added to the new ones.
+    clear_multiprocess_metrics()
+
+
+def pre_fork(server, worker):
+    # Objects loaded by the master are left out of garbage collection, which
+    # would otherwise write to their pages and copy them into every worker.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    init_worker()
+
+
+def post_worker_init(worker):
+    # Set after gunicorn has reset the signal handlers of the worker.
+    install_signal_handler()
+
+
+def worker_exit(server, worker):
+    # Messages held by the coalescer or queued in WEBHOOK_ASYNC_MODE were
+    # already acknowledged, so they are answered before the worker exits.
+    shutdown_worker()
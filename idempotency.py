@@ -0,0 +1,160 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import threading
+from typing import Any, Text
+
+from .config import Config
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+suppressed_counter = REGISTRY.counter(
+    "whatsapp_duplicate_messages_total",
+    "Redelivered messages ignored because their id was already handled.",
+)
+
+
+@dataclass
+class IdempotencyGuard:
+    """
+    Remembers the ids of the WhatsApp messages already handled, so provider
+    redeliveries are ignored before any backend call or send.
+
+    A bounded in-process LRU answers most lookups. With a Redis client, the
+    id is also claimed with SET NX and a TTL, so a redelivery handled by
+    another worker is recognized too. If Redis is unavailable the message
+    is handled, since answering twice is better than not answering.
+    """
+
+    redis_client: Any = None
+    ttl: int = Config.IDEMPOTENCY_TTL
+    max_local_entries: int = Config.IDEMPOTENCY_LOCAL_CACHE_SIZE
+    key_prefix: Text = "whatsapp_message_seen:"
+
+    def __post_init__(self):
+        self._seen: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _claim_locally(self, message_id: Text) -> bool:
+        with self._lock:
+            if message_id in self._seen:
+                self._seen.move_to_end(message_id)
+                return False
+            self._seen[message_id] = True
+            if len(self._seen) > self.max_local_entries:
+                self._seen.popitem(last=False)
+            return True
+
+    def first_seen(self, message_id: Text) -> bool:
+        """
+        Returns True the first time message_id is seen and False for
+        every redelivery.
+        """
+        if not message_id:
+            return True
+        if not self._claim_locally(message_id):
+            suppressed_counter.inc()
+            return False
+        if self.redis_client is None:
+            return True
+        try:
+            claimed = self.redis_client.set(
+                f"{self.key_prefix}{message_id}", 1, nx=True, ex=self.ttl
+            )
+        except Exception:
+            logger.exception("Could not check message id %s on Redis", message_id)
+            return True
+        if not claimed:
+            suppressed_counter.inc()
+        return bool(claimed)
+
+    def forget(self, message_id: Text):
+        """
+        Releases message_id, so a redelivery of a message that could not
+        be answered is handled again.
+        """
+        if not message_id:
+            return
+        with self._lock:
+            self._seen.pop(message_id, None)
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.delete(f"{self.key_prefix}{message_id}")
+        except Exception:
+            logger.exception("Could not release message id %s on Redis", message_id)
+
+
+@dataclass
+class AsyncIdempotencyGuard(IdempotencyGuard):
+    """
+    asyncio version of IdempotencyGuard, to be used with a redis.asyncio client.
+    """
+
+    async def first_seen(self, message_id: Text) -> bool:
+        if not message_id:
+            return True
+        if not self._claim_locally(message_id):
+            suppressed_counter.inc()
+            return False
+        if self.redis_client is None:
+            return True
+        try:
+            claimed = await self.redis_client.set(
+                f"{self.key_prefix}{message_id}", 1, nx=True, ex=self.ttl
+            )
+        except Exception:
+            logger.exception("Could not check message id %s on Redis", message_id)
+            return True
+        if not claimed:
+            suppressed_counter.inc()
+        return bool(claimed)
+
+    async def forget(self, message_id: Text):
+        if not message_id:
+            return
+        with self._lock:
+            self._seen.pop(message_id, None)
+        if self.redis_client is None:
+            return
+        try:
+            await self.redis_client.delete(f"{self.key_prefix}{message_id}")
+        except Exception:
+            logger.exception("Could not release message id %s on Redis", message_id)
+
+
+_idempotency_guard: IdempotencyGuard | None = None
+_async_idempotency_guard: AsyncIdempotencyGuard | None = None
+
+
+def get_idempotency_guard() -> IdempotencyGuard | None:
+    """
+    Returns the guard configured by IDEMPOTENCY_BACKEND, or None when
+    deduplication is disabled.
+    """
+    global _idempotency_guard
+    if Config.IDEMPOTENCY_BACKEND == "none":
+        return None
+    if _idempotency_guard is None:
+        redis_client = None
+        if Config.IDEMPOTENCY_BACKEND == "redis":
+            from .clients.registry import get_client_registry
+
+            redis_client = get_client_registry().redis_client()
+        _idempotency_guard = IdempotencyGuard(redis_client=redis_client)
+    return _idempotency_guard
+
+
+def get_async_idempotency_guard() -> AsyncIdempotencyGuard | None:
+    global _async_idempotency_guard
+    if Config.IDEMPOTENCY_BACKEND == "none":
+        return None
+    if _async_idempotency_guard is None:
+        redis_client = None
+        if Config.IDEMPOTENCY_BACKEND == "redis":
+            from .clients.registry import get_client_registry
+
+            redis_client = get_client_registry().async_redis_client()
+        _async_idempotency_guard = AsyncIdempotencyGuard(redis_client=redis_client)
+    return _async_idempotency_guard
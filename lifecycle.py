@@ -0,0 +1,106 @@
+"""
+Process lifecycle of pre-fork servers such as gunicorn with --preload:
+preload() runs once in the master, before the workers are forked,
+init_worker() runs in each worker right after the fork and shutdown_worker()
+when it exits. See gunicorn_conf.py; asgi.py runs init_async_worker() on
+startup.
+"""
+
+import importlib
+import logging
+import os
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def preload(asynchronous: bool = False):
+    """
+    Imports the modules the workers use and resolves the derived settings,
+    opening no connection, so the workers share them copy-on-write instead
+    of loading them again on their first request.
+    """
+    from .backends import load_backend_class
+
+    for name in dir(Config):
+        getattr(Config, name)
+    if asynchronous:
+        modules = ["redis.asyncio", "httpx"]
+    else:
+        modules = ["redis", "httpx" if Config.HTTP2_ENABLED else "requests"]
+    for module in modules:
+        importlib.import_module(module)
+    backend_name = Config.ANSWER_BACKEND
+    if asynchronous:
+        backend_name = Config.ASYNC_ANSWER_BACKEND or backend_name
+    load_backend_class(backend_name, asynchronous=asynchronous)
+
+
+def init_worker():
+    """
+    Creates the connection pools, the Redis clients and the provider clients
+    of this process before its first request, and fetches the Serpro access
+    token when Serpro credentials are set. Anything left out, or that fails
+    here, is still created on first use.
+    """
+    from .backends import get_answer_backend
+    from .clients.http import get_http_pool
+    from .clients.registry import get_client_registry
+    from .idempotency import get_idempotency_guard
+    from .metrics import get_multiprocess_metrics
+
+    get_http_pool().session()
+    registry = get_client_registry()
+    if os.getenv("WPP_AUTHORIZATION_TOKEN"):
+        registry.cloud_api_client()
+    get_idempotency_guard()
+    get_answer_backend()
+    multiprocess_metrics = get_multiprocess_metrics()
+    if multiprocess_metrics:
+        multiprocess_metrics.write()
+    if os.getenv("SERPRO_CLIENT_ID"):
+        try:
+            registry.serpro_api_client().authenticate()
+        except Exception:
+            logger.exception("Could not fetch the Serpro access token")
+
+
+def shutdown_worker():
+    """
+    Answers the messages the worker still holds in memory before it exits,
+    then writes its final metrics.
+    """
+    from .metrics import get_multiprocess_metrics
+    from .server import drain
+
+    drain()
+    multiprocess_metrics = get_multiprocess_metrics()
+    if multiprocess_metrics:
+        multiprocess_metrics.write(running=False)
+
+
+async def init_async_worker():
+    """
+    asyncio version of init_worker, run by asgi.py on startup.
+    """
+    from .backends import get_async_answer_backend
+    from .clients.async_http import get_async_http_pool
+    from .clients.registry import get_client_registry
+    from .idempotency import get_async_idempotency_guard
+    from .metrics import get_multiprocess_metrics
+
+    get_async_http_pool().client()
+    registry = get_client_registry()
+    if os.getenv("WPP_AUTHORIZATION_TOKEN"):
+        registry.async_cloud_api_client()
+    get_async_idempotency_guard()
+    get_async_answer_backend()
+    multiprocess_metrics = get_multiprocess_metrics()
+    if multiprocess_metrics:
+        multiprocess_metrics.write()
+    if os.getenv("SERPRO_CLIENT_ID"):
+        try:
+            await registry.async_serpro_api_client().authenticate()
+        except Exception:
+            logger.exception("Could not fetch the Serpro access token")
@@ -2,13 +2,13 @@ from dataclasses import dataclass
 from typing import Dict, Text
 
 
-@dataclass
+@dataclass(slots=True)
 class NotSupportedMessage:
     message: Dict
     text: Text = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class InteractiveMessage:
     message: Dict
     text: Text = ""
@@ -24,7 +24,7 @@ class InteractiveMessage:
             self.text = str(interactive.get("list_reply").get("id"))
 
 
-@dataclass
+@dataclass(slots=True)
 class TextMessage:
     message: Dict
     text: Text = ""
@@ -34,3 +34,37 @@ class TextMessage:
 
     def set_message(self):
         self.text = self.message.get("text").get("body")
+
+
+# Message types whose content is a file kept by the provider.
+MEDIA_TYPES = ("image", "video", "audio", "document", "sticker")
+
+
+@dataclass(slots=True)
+class MediaMessage:
+    """
+    Image, video, audio, document or sticker sent by the contact. text is
+    the caption, if any. path is only set once the file is downloaded, see
+    Config.MEDIA_DOWNLOAD_DIR.
+    """
+
+    message: Dict
+    text: Text = ""
+    media_type: Text = ""
+    media_id: Text = ""
+    mime_type: Text = ""
+    sha256: Text = ""
+    filename: Text = ""
+    path: Text = ""
+
+    def __post_init__(self):
+        self.set_message()
+
+    def set_message(self):
+        self.media_type = self.message.get("type", "")
+        media: Dict = self.message.get(self.media_type) or {}
+        self.text = media.get("caption") or ""
+        self.media_id = media.get("id", "")
+        self.mime_type = media.get("mime_type", "")
+        self.sha256 = media.get("sha256", "")
+        self.filename = media.get("filename", "")
@@ -0,0 +1,465 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+import logging
+import os
+import threading
+import time
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Text,
+    Tuple,
+)
+
+from .config import Config
+from .serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cached payload (1 ms) to a send about to time out (10 s).
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@dataclass
+class Counter:
+    """
+    Monotonic counter, safe to increment from several threads.
+    """
+
+    name: Text
+    description: Text = ""
+    value: float = 0
+    kind = "counter"
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, labels: Text = "") -> Iterator[Tuple[Text, Text, float]]:
+        yield "", labels, self.value
+
+
+@dataclass
+class Gauge:
+    """
+    Value that goes up and down. When function is given, the value is read
+    from it on every collection instead of being stored.
+    """
+
+    name: Text
+    description: Text = ""
+    function: Optional[Callable[[], float]] = None
+    _value: float = 0
+    kind = "gauge"
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    @property
+    def value(self) -> float:
+        if self.function:
+            return self.function()
+        return self._value
+
+    def samples(self, labels: Text = "") -> Iterator[Tuple[Text, Text, float]]:
+        yield "", labels, self.value
+
+
+class Timer:
+    """
+    Context manager observing the seconds spent in its block.
+    """
+
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: "Histogram"):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.histogram.observe(perf_counter() - self.started)
+
+
+@dataclass
+class Histogram:
+    """
+    Distribution of observed values, usually durations in seconds, counted
+    in cumulative buckets like a Prometheus histogram.
+    """
+
+    name: Text
+    description: Text = ""
+    buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    kind = "histogram"
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self.bucket_counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> Timer:
+        return Timer(self)
+
+    @property
+    def value(self) -> float:
+        return self.count
+
+    def samples(self, labels: Text = "") -> Iterator[Tuple[Text, Text, float]]:
+        separator = "," if labels else ""
+        with self._lock:
+            bucket_counts = list(self.bucket_counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            yield "_bucket", f'{labels}{separator}le="{bound}"', cumulative
+        yield "_bucket", f'{labels}{separator}le="+Inf"', count
+        yield "_sum", labels, total
+        yield "_count", labels, count
+
+
+def render_exposition(
+    families: Iterable[Tuple[Text, Text, Text, Iterable[Tuple[Text, Text, float]]]],
+) -> bytes:
+    """
+    Renders (name, kind, description, samples) metric families in the
+    Prometheus text format.
+    """
+    lines = []
+    for name, kind, description, samples in families:
+        if description:
+            lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            if labels:
+                lines.append(f"{name}{suffix}{{{labels}}} {value}")
+            else:
+                lines.append(f"{name}{suffix} {value}")
+    lines.append("")
+    return "\n".join(lines).encode()
+
+
+def escape_label_value(value: Any) -> Text:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+@dataclass
+class MetricFamily:
+    """
+    Metrics sharing a name and told apart by label values, such as the
+    responses of each endpoint and status code.
+
+    labels() looks the child metric up by the tuple of values it is given;
+    values are only turned into text when the metrics are rendered, so
+    labeling costs a dict lookup per call.
+    """
+
+    name: Text
+    description: Text
+    label_names: Tuple[Text, ...]
+    create: Callable[[], Counter | Gauge | Histogram]
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self.children: Dict[Tuple, Counter | Gauge | Histogram] = {}
+        self.kind = self.create().kind
+
+    def labels(self, *values) -> Counter | Gauge | Histogram:
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.create()
+                    self.children[values] = child
+        return child
+
+    def _label_text(self, values: Tuple) -> Text:
+        return ",".join(
+            f'{name}="{escape_label_value(value)}"'
+            for name, value in zip(self.label_names, values)
+        )
+
+    @property
+    def value(self) -> Dict[Text, float]:
+        return {
+            self._label_text(values): child.value
+            for values, child in list(self.children.items())
+        }
+
+    def samples(self, labels: Text = "") -> Iterator[Tuple[Text, Text, float]]:
+        for values, child in list(self.children.items()):
+            yield from child.samples(self._label_text(values))
+
+
+@dataclass
+class MetricsRegistry:
+    """
+    Process-wide collection of counters, gauges and histograms.
+    """
+
+    metrics: Dict[Text, Counter | Gauge | Histogram | MetricFamily] = field(
+        default_factory=dict
+    )
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def _get_or_create(
+        self, metric_class, name: Text, label_names: Tuple[Text, ...] = (), **kwargs
+    ):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                if label_names:
+                    metric = MetricFamily(
+                        name,
+                        kwargs.get("description", ""),
+                        tuple(label_names),
+                        lambda: metric_class(name, **kwargs),
+                    )
+                else:
+                    metric = metric_class(name, **kwargs)
+                self.metrics[name] = metric
+            return metric
+
+    def counter(
+        self, name: Text, description: Text = "", label_names: Tuple[Text, ...] = ()
+    ) -> Counter | MetricFamily:
+        return self._get_or_create(Counter, name, label_names, description=description)
+
+    def gauge(
+        self,
+        name: Text,
+        description: Text = "",
+        function: Optional[Callable[[], float]] = None,
+    ) -> Gauge:
+        gauge = self._get_or_create(Gauge, name, description=description)
+        if function:
+            gauge.function = function
+        return gauge
+
+    def histogram(
+        self,
+        name: Text,
+        description: Text = "",
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+        label_names: Tuple[Text, ...] = (),
+    ) -> Histogram | MetricFamily:
+        return self._get_or_create(
+            Histogram, name, label_names, description=description, buckets=buckets
+        )
+
+    def snapshot(self) -> Dict[Text, Any]:
+        """
+        Returns the current value of every registered metric. Histograms
+        report their number of observations and labeled metrics a dict by
+        label.
+        """
+        return {name: metric.value for name, metric in list(self.metrics.items())}
+
+    def exposition(self) -> bytes:
+        """
+        Renders every metric in the Prometheus text format.
+        """
+        return render_exposition(
+            (name, metric.kind, metric.description, metric.samples())
+            for name, metric in list(self.metrics.items())
+        )
+
+
+REGISTRY = MetricsRegistry()
+
+
+def is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@dataclass
+class MultiProcessMetrics:
+    """
+    Sums the metrics of the worker processes of one server through files
+    in directory, so /metrics reports the whole server whichever worker
+    answers it.
+
+    Each worker writes the samples of registry to its own file every
+    interval seconds, when it answers /metrics and when it exits, so the
+    other workers are reported as of their last write. Counters and
+    histograms of the workers that exited stay in the sum, which never goes
+    down; gauges only count the workers still running.
+    """
+
+    registry: MetricsRegistry
+    directory: Text = Config.METRICS_MULTIPROC_DIR
+    interval: float = Config.METRICS_FLUSH_INTERVAL
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._pid: int | None = None
+        self._path: Text | None = None
+
+    def _get_path(self) -> Text:
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # One file per process lifetime, so a worker reusing the
+                    # pid of one that exited does not overwrite its counts.
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._path = os.path.join(
+                        self.directory, f"metrics-{os.getpid()}-{time.time_ns()}.json"
+                    )
+                    self._pid = os.getpid()
+                    threading.Thread(
+                        target=self._run, name="metrics-writer", daemon=True
+                    ).start()
+        return self._path
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError:
+                logger.exception("Could not write the metrics of this worker")
+
+    def write(self, running: bool = True):
+        """
+        Writes the samples of this process, without its gauges when it is
+        about to exit. The first call starts the periodic writes.
+        """
+        path = self._get_path()
+        families = [
+            (name, metric.kind, metric.description, list(metric.samples()))
+            for name, metric in list(self.registry.metrics.items())
+            if running or metric.kind != "gauge"
+        ]
+        with self._lock:
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "wb") as metrics_file:
+                metrics_file.write(dumps(families))
+            os.replace(temporary_path, path)
+
+    def exposition(self) -> bytes:
+        """
+        Renders the sum of the metrics of every worker.
+        """
+        self.write()
+        families: Dict[Text, Tuple[Text, Text, Dict[Tuple[Text, Text], float]]] = {}
+        for file_name in sorted(os.listdir(self.directory)):
+            if not (file_name.startswith("metrics-") and file_name.endswith(".json")):
+                continue
+            running = is_running(int(file_name.split("-")[1]))
+            try:
+                with open(
+                    os.path.join(self.directory, file_name), "rb"
+                ) as metrics_file:
+                    worker_families = loads(metrics_file.read())
+            except (OSError, ValueError):
+                continue
+            for name, kind, description, samples in worker_families:
+                if kind == "gauge" and not running:
+                    continue
+                totals = families.setdefault(name, (kind, description, {}))[2]
+                for suffix, labels, value in samples:
+                    totals[(suffix, labels)] = totals.get((suffix, labels), 0) + value
+        return render_exposition(
+            (
+                name,
+                kind,
+                description,
+                ((suffix, labels, value) for (suffix, labels), value in totals.items()),
+            )
+            for name, (kind, description, totals) in families.items()
+        )
+
+
+_multiprocess_metrics: MultiProcessMetrics | None = None
+
+
+def get_multiprocess_metrics() -> MultiProcessMetrics | None:
+    """
+    Returns the shared metrics of the workers, or None when
+    Config.METRICS_MULTIPROC_DIR is not set.
+    """
+    global _multiprocess_metrics
+    if not Config.METRICS_MULTIPROC_DIR:
+        return None
+    if _multiprocess_metrics is None:
+        _multiprocess_metrics = MultiProcessMetrics(REGISTRY)
+    return _multiprocess_metrics
+
+
+def exposition() -> bytes:
+    """
+    Renders the metrics of /metrics: those of every worker with
+    Config.METRICS_MULTIPROC_DIR, of this process otherwise.
+    """
+    multiprocess_metrics = get_multiprocess_metrics()
+    if multiprocess_metrics:
+        return multiprocess_metrics.exposition()
+    return REGISTRY.exposition()
+
+
+def clear_multiprocess_metrics(directory: Text = Config.METRICS_MULTIPROC_DIR):
+    """
+    Removes the metric files of a previous run of the server. Run it once,
+    before the workers start.
+    """
+    if not directory or not os.path.isdir(directory):
+        return
+    for file_name in os.listdir(directory):
+        if file_name.startswith("metrics-"):
+            os.remove(os.path.join(directory, file_name))
@@ -0,0 +1,8 @@
+"""
+Redis Streams outbound queue, consumed by send workers on any node.
+
+With OUTBOUND_QUEUE_ENABLED=true the webhook only parses the answers and
+adds them to the stream of their recipient partition; the workers send them:
+
+    python -m whatsapp_api_integration.outbound --concurrency 32
+"""
@@ -0,0 +1,30 @@
+import argparse
+import logging
+import signal
+
+from ..config import Config
+from .worker import OutboundWorker, default_consumer_name
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m whatsapp_api_integration.outbound",
+        description="Sends the answers queued in the outbound Redis Streams.",
+    )
+    parser.add_argument("--consumer", default=default_consumer_name())
+    parser.add_argument("--concurrency", type=int, default=Config.DISPATCH_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=Config.OUTBOUND_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    worker = OutboundWorker(
+        consumer=args.consumer,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+    )
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: worker.stop())
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+import os
+from typing import Any, Dict, List, Text
+import zlib
+
+from ..clients.registry import get_client_registry
+from ..config import Config
+from ..dispatch import get_recipient
+from ..metrics import REGISTRY
+from ..serialization import dumps
+
+enqueued_counter = REGISTRY.counter(
+    "outbound_enqueued_total",
+    "Payloads added to the outbound streams.",
+    label_names=("provider",),
+)
+
+
+def partition_of(recipient: Text, partitions: int) -> int:
+    """
+    Returns the partition of a recipient. crc32 is stable across processes
+    and nodes, unlike hash().
+    """
+    return zlib.crc32(recipient.encode()) % partitions
+
+
+@dataclass
+class OutboundQueue:
+    """
+    Adds outgoing payloads to Redis Streams, one stream per partition.
+
+    Every payload of a recipient goes to the same partition, and each
+    partition is read by a single worker at a time, so the payloads of a
+    recipient are sent in the order they were added. Entries are deleted
+    once sent, so the streams are never trimmed.
+    """
+
+    redis_client: Any
+    partitions: int = Config.OUTBOUND_PARTITIONS
+    prefix: Text = Config.OUTBOUND_STREAM_PREFIX
+
+    def stream_key(self, partition: int) -> Text:
+        return f"{self.prefix}:{partition}"
+
+    def dead_letter_key(self) -> Text:
+        return f"{self.prefix}:dead"
+
+    def _pipeline(self, provider: Text, payloads: List[Dict]):
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for payload in payloads:
+            partition = partition_of(get_recipient(payload), self.partitions)
+            data = getattr(payload, "json_bytes", None) or dumps(payload)
+            pipeline.xadd(
+                self.stream_key(partition), {"provider": provider, "payload": data}
+            )
+        enqueued_counter.labels(provider).inc(len(payloads))
+        return pipeline
+
+    def enqueue(self, provider: Text, payloads: List[Dict]) -> List[Text]:
+        """
+        Adds payloads of provider (cloud_api or serpro) in a single round
+        trip and returns their entry ids.
+        """
+        if not payloads:
+            return []
+        return self._pipeline(provider, payloads).execute()
+
+
+@dataclass
+class AsyncOutboundQueue(OutboundQueue):
+    """
+    asyncio version of OutboundQueue, using a redis.asyncio client.
+    """
+
+    async def enqueue(self, provider: Text, payloads: List[Dict]) -> List[Text]:
+        if not payloads:
+            return []
+        return await self._pipeline(provider, payloads).execute()
+
+
+_outbound_queue: OutboundQueue | None = None
+_async_outbound_queue: AsyncOutboundQueue | None = None
+_pid: int | None = None
+
+
+def _reset_after_fork():
+    global _outbound_queue, _async_outbound_queue, _pid
+    if _pid != os.getpid():
+        _outbound_queue = None
+        _async_outbound_queue = None
+        _pid = os.getpid()
+
+
+def get_outbound_queue() -> OutboundQueue:
+    global _outbound_queue
+    _reset_after_fork()
+    if _outbound_queue is None:
+        _outbound_queue = OutboundQueue(get_client_registry().redis_client())
+    return _outbound_queue
+
+
+def get_async_outbound_queue() -> AsyncOutboundQueue:
+    global _async_outbound_queue
+    _reset_after_fork()
+    if _async_outbound_queue is None:
+        _async_outbound_queue = AsyncOutboundQueue(
+            get_client_registry().async_redis_client()
+        )
+    return _async_outbound_queue
@@ -0,0 +1,409 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Set, Text, Tuple
+
+import redis
+
+from ..clients.circuit_breaker import CircuitOpenError
+from ..clients.registry import get_client_registry
+from ..config import Config
+from ..dispatch import check_response, get_recipient
+from ..metrics import REGISTRY
+from ..parsers.cache import EncodedPayload
+from ..serialization import loads
+from .streams import OutboundQueue, partition_of
+
+logger = logging.getLogger(__name__)
+
+sent_counter = REGISTRY.counter(
+    "outbound_sent_total", "Outbound entries sent and acknowledged."
+)
+failed_counter = REGISTRY.counter(
+    "outbound_failed_total", "Outbound sends that raised and will be retried."
+)
+dead_letter_counter = REGISTRY.counter(
+    "outbound_dead_lettered_total",
+    "Outbound entries moved to the dead letter stream after OUTBOUND_MAX_ATTEMPTS.",
+)
+reclaimed_counter = REGISTRY.counter(
+    "outbound_reclaimed_total", "Pending entries claimed from workers that stopped."
+)
+
+# Renews or releases a partition lease only if this worker still holds it.
+RENEW_LEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+PROVIDERS: Dict[Text, Callable[[], Any]] = {
+    "cloud_api": lambda: get_client_registry().cloud_api_client(),
+    "serpro": lambda: get_client_registry().serpro_api_client(),
+}
+
+
+def default_consumer_name() -> Text:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+@dataclass
+class PartitionLeases:
+    """
+    Splits the stream partitions between the live workers.
+
+    Each worker heartbeats into a sorted set and holds a lease (a key with a
+    TTL) on ceil(partitions / workers) partitions. Leases of a worker that
+    stops expire after ttl seconds and are taken by the others; a new worker
+    gets its share as the others release their extra partitions.
+    """
+
+    redis_client: Any
+    consumer: Text
+    partitions: int = Config.OUTBOUND_PARTITIONS
+    prefix: Text = Config.OUTBOUND_STREAM_PREFIX
+    ttl: float = Config.OUTBOUND_LEASE_TTL
+    owned: Set[int] = field(default_factory=set)
+
+    def __post_init__(self):
+        self._renew = self.redis_client.register_script(RENEW_LEASE_SCRIPT)
+        self._release = self.redis_client.register_script(RELEASE_LEASE_SCRIPT)
+
+    def lease_key(self, partition: int) -> Text:
+        return f"{self.prefix}:lease:{partition}"
+
+    def workers_key(self) -> Text:
+        return f"{self.prefix}:workers"
+
+    def _live_workers(self) -> int:
+        now = time.time()
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.zadd(self.workers_key(), {self.consumer: now})
+        pipeline.zremrangebyscore(self.workers_key(), "-inf", now - self.ttl)
+        pipeline.zcard(self.workers_key())
+        return max(pipeline.execute()[-1], 1)
+
+    def rebalance(self) -> Set[int]:
+        """
+        Renews the leases held, releases the extra ones and takes free
+        partitions up to the fair share. Returns the partitions taken.
+        """
+        ttl_ms = int(self.ttl * 1000)
+        target = math.ceil(self.partitions / self._live_workers())
+        for partition in list(self.owned):
+            renewed = self._renew(
+                keys=[self.lease_key(partition)], args=[self.consumer, ttl_ms]
+            )
+            if not renewed:
+                logger.warning("Lost the lease of outbound partition %s", partition)
+                self.owned.discard(partition)
+        while len(self.owned) > target:
+            self.release(max(self.owned))
+        acquired = set()
+        # Workers start looking at different partitions to avoid contention.
+        start = partition_of(self.consumer, self.partitions)
+        for offset in range(self.partitions):
+            if len(self.owned) >= target:
+                break
+            partition = (start + offset) % self.partitions
+            if partition in self.owned:
+                continue
+            if self.redis_client.set(
+                self.lease_key(partition), self.consumer, nx=True, px=ttl_ms
+            ):
+                self.owned.add(partition)
+                acquired.add(partition)
+        return acquired
+
+    def release(self, partition: int):
+        self._release(keys=[self.lease_key(partition)], args=[self.consumer])
+        self.owned.discard(partition)
+
+    def release_all(self):
+        for partition in list(self.owned):
+            self.release(partition)
+        self.redis_client.zrem(self.workers_key(), self.consumer)
+
+
+@dataclass
+class OutboundWorker:
+    """
+    Sends the payloads of the outbound streams, with at-least-once delivery.
+
+    Entries are read in batches with XREADGROUP from the partitions this
+    worker leases, and acknowledged and deleted only after they were sent.
+    Recipients of a batch are sent to concurrently, each one in order. When
+    a send fails, the partition pauses for retry_delay seconds and then
+    reads its pending entries again before any new one, so the recipient
+    order holds; once Redis has delivered an entry max_attempts times it
+    goes to the dead letter stream. A partition taken over from another
+    worker has all its pending entries claimed before any new one is read,
+    and pending entries of a worker that stopped are claimed once they have
+    been idle for claim_idle seconds.
+    """
+
+    redis_client: Any = None
+    consumer: Text = field(default_factory=default_consumer_name)
+    group: Text = Config.OUTBOUND_CONSUMER_GROUP
+    partitions: int = Config.OUTBOUND_PARTITIONS
+    prefix: Text = Config.OUTBOUND_STREAM_PREFIX
+    batch_size: int = Config.OUTBOUND_BATCH_SIZE
+    block: float = Config.OUTBOUND_BLOCK
+    concurrency: int = Config.DISPATCH_CONCURRENCY
+    lease_ttl: float = Config.OUTBOUND_LEASE_TTL
+    claim_idle: float = Config.OUTBOUND_CLAIM_IDLE
+    max_attempts: int = Config.OUTBOUND_MAX_ATTEMPTS
+    retry_delay: float = Config.OUTBOUND_RETRY_DELAY
+
+    def __post_init__(self):
+        if self.redis_client is None:
+            self.redis_client = get_client_registry().redis_client()
+        self.queue = OutboundQueue(self.redis_client, self.partitions, self.prefix)
+        self.leases = PartitionLeases(
+            self.redis_client,
+            self.consumer,
+            self.partitions,
+            self.prefix,
+            self.lease_ttl,
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="outbound-worker"
+        )
+        # Partitions whose pending entries must be read before new ones.
+        self._backlog: Set[int] = set()
+        self._paused_until: Dict[int, float] = {}
+        self._next_rebalance = 0.0
+        self._next_claim = 0.0
+        self._stopped = threading.Event()
+        REGISTRY.gauge(
+            "outbound_partitions_owned",
+            "Outbound stream partitions leased by this worker.",
+            function=lambda: len(self.leases.owned),
+        )
+
+    def _create_group(self, partition: int):
+        try:
+            self.redis_client.xgroup_create(
+                self.queue.stream_key(partition), self.group, id="0", mkstream=True
+            )
+        except redis.ResponseError as error:
+            if "BUSYGROUP" not in str(error):
+                raise
+
+    def _claim(self, partition: int, min_idle: float):
+        """
+        Takes over the entries of the partition left pending by other
+        consumers for more than min_idle seconds, keeping their delivery
+        count.
+        """
+        stream = self.queue.stream_key(partition)
+        min_idle_ms = int(min_idle * 1000)
+        start = "-"
+        while True:
+            pending = self.redis_client.xpending_range(
+                stream,
+                self.group,
+                min=start,
+                max="+",
+                count=self.batch_size,
+                idle=min_idle_ms,
+            )
+            pipeline = self.redis_client.pipeline(transaction=False)
+            for entry in pending:
+                if entry["consumer"] != self.consumer:
+                    pipeline.xclaim(
+                        stream,
+                        self.group,
+                        self.consumer,
+                        min_idle_ms,
+                        [entry["message_id"]],
+                        retrycount=entry["times_delivered"],
+                        justid=True,
+                    )
+            claimed = sum(len(entry_ids) for entry_ids in pipeline.execute())
+            if claimed:
+                reclaimed_counter.inc(claimed)
+                self._backlog.add(partition)
+            if len(pending) < self.batch_size:
+                return
+            start = f"({pending[-1]['message_id']}"
+
+    def _maintain(self):
+        now = time.monotonic()
+        if now >= self._next_rebalance:
+            for partition in self.leases.rebalance():
+                self._create_group(partition)
+                # The previous owner lost or released the lease, maybe paused
+                # after a failure, so all its pending entries are taken, and
+                # read before any new one, whatever their idle time.
+                self._claim(partition, 0)
+                # Entries this consumer left pending before a restart.
+                self._backlog.add(partition)
+                self._paused_until.pop(partition, None)
+            self._next_rebalance = now + self.lease_ttl / 3
+        if now >= self._next_claim:
+            for partition in self.leases.owned:
+                self._claim(partition, self.claim_idle)
+            self._next_claim = now + self.claim_idle / 2
+
+    def _readable_streams(self) -> Dict[Text, Text]:
+        now = time.monotonic()
+        return {
+            self.queue.stream_key(partition): "0" if partition in self._backlog else ">"
+            for partition in sorted(self.leases.owned)
+            if self._paused_until.get(partition, 0) <= now
+        }
+
+    def _send_entry(self, fields: Dict) -> Any:
+        data = fields["payload"]
+        json_bytes = data.encode() if isinstance(data, str) else data
+        payload = EncodedPayload(loads(json_bytes), json_bytes)
+        # A non-2xx response raises, so the entry stays pending.
+        return check_response(PROVIDERS[fields["provider"]]().send_message(payload))
+
+    def _dead_letter(self, entry_id: Text, fields: Dict, error: BaseException):
+        self.redis_client.xadd(
+            self.queue.dead_letter_key(),
+            {**fields, "entry_id": entry_id, "error": repr(error)},
+        )
+        dead_letter_counter.inc()
+        logger.error("Outbound entry %s moved to the dead letter stream", entry_id)
+
+    def _delivery_count(self, stream: Text, entry_id: Text) -> int:
+        pending = self.redis_client.xpending_range(
+            stream, self.group, min=entry_id, max=entry_id, count=1
+        )
+        return pending[0]["times_delivered"] if pending else 1
+
+    def _uncount_delivery(self, stream: Text, entry_id: Text, count: int):
+        self.redis_client.xclaim(
+            stream,
+            self.group,
+            self.consumer,
+            0,
+            [entry_id],
+            retrycount=max(count - 1, 0),
+            justid=True,
+        )
+
+    def _send_recipient_entries(
+        self, stream: Text, entries: List[Tuple[Text, Dict]]
+    ) -> Tuple[List[Text], bool]:
+        """
+        Sends the entries of a recipient in order, stopping at the first
+        failure. Returns the ids to acknowledge and whether one failed.
+        """
+        done = []
+        for entry_id, fields in entries:
+            if not fields:
+                # Deleted while pending, nothing left to send.
+                done.append(entry_id)
+                continue
+            try:
+                self._send_entry(fields)
+                sent_counter.inc()
+            except Exception as exception:
+                # The delivery count of the pending entry, kept by Redis, is
+                # the number of attempts, whichever worker made them.
+                attempts = self._delivery_count(stream, entry_id)
+                if isinstance(exception, CircuitOpenError):
+                    # Nothing was sent, so the read is not an attempt.
+                    self._uncount_delivery(stream, entry_id, attempts)
+                elif attempts >= self.max_attempts:
+                    self._dead_letter(entry_id, fields, exception)
+                    done.append(entry_id)
+                    continue
+                failed_counter.inc()
+                logger.warning(
+                    "Could not send outbound entry %s: %s", entry_id, exception
+                )
+                return done, True
+            done.append(entry_id)
+        return done, False
+
+    def _process(self, stream: Text, entries: List[Tuple[Text, Dict]], backlog: bool):
+        partition = int(stream.rsplit(":", 1)[1])
+        entries_by_recipient: Dict[Text, List[Tuple[Text, Dict]]] = {}
+        for entry_id, fields in entries:
+            recipient = get_recipient(loads(fields["payload"])) if fields else ""
+            entries_by_recipient.setdefault(recipient, []).append((entry_id, fields))
+        results = list(
+            self._executor.map(
+                partial(self._send_recipient_entries, stream),
+                entries_by_recipient.values(),
+            )
+        )
+        acknowledged = [entry_id for done, _ in results for entry_id in done]
+        if acknowledged:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            pipeline.xack(stream, self.group, *acknowledged)
+            pipeline.xdel(stream, *acknowledged)
+            pipeline.execute()
+        if any(failed for _, failed in results):
+            self._backlog.add(partition)
+            self._paused_until[partition] = time.monotonic() + self.retry_delay
+        elif backlog and len(entries) < self.batch_size:
+            self._backlog.discard(partition)
+
+    def run_once(self) -> int:
+        """
+        Reads and sends one batch of every readable partition. Returns the
+        number of entries read.
+        """
+        self._maintain()
+        streams = self._readable_streams()
+        if not streams:
+            self._stopped.wait(min(self.block, self.retry_delay))
+            return 0
+        backlog = {stream for stream, entry_id in streams.items() if entry_id == "0"}
+        response = self.redis_client.xreadgroup(
+            self.group,
+            self.consumer,
+            streams,
+            count=self.batch_size,
+            # Pending entries are returned at once, only wait for new ones.
+            block=None if backlog else int(self.block * 1000),
+        )
+        read = 0
+        for stream, entries in response or []:
+            read += len(entries)
+            self._process(stream, entries, stream in backlog)
+        for stream in backlog - {stream for stream, _ in response or []}:
+            self._backlog.discard(int(stream.rsplit(":", 1)[1]))
+        return read
+
+    def run(self):
+        """
+        Runs until stop() is called, then releases the partitions so other
+        workers take them right away.
+        """
+        logger.info("Outbound worker %s started", self.consumer)
+        try:
+            while not self._stopped.is_set():
+                try:
+                    self.run_once()
+                except redis.RedisError:
+                    logger.exception("Outbound worker could not reach Redis")
+                    self._stopped.wait(self.retry_delay)
+        finally:
+            self._executor.shutdown(wait=True)
+            try:
+                self.leases.release_all()
+            except redis.RedisError:
+                logger.exception("Could not release the outbound partitions")
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+from typing import Any, Callable, Dict, Hashable, Text, Tuple
+
+from ..config import Config
+from ..message import MEDIA_TYPES
+from ..serialization import dumps
+
+RECIPIENT_PLACEHOLDER = "\x00recipient\x00"
+
+
+class EncodedPayload(dict):
+    """
+    Payload dict that carries its own JSON encoding, so clients can send it
+    without serializing it again. Payloads built from the cache share their
+    nested values, so they must be treated as read-only.
+    """
+
+    __slots__ = ("json_bytes",)
+
+    def __init__(self, payload: Dict, json_bytes: bytes):
+        super().__init__(payload)
+        self.json_bytes = json_bytes
+
+
+@dataclass
+class PayloadTemplate:
+    """
+    Recipient-independent part of an outgoing payload, with its JSON
+    encoding split around the recipient field.
+    """
+
+    payload: Dict
+    recipient_key: Text
+
+    def __post_init__(self):
+        encoded = dumps(self.payload)
+        placeholder = dumps(RECIPIENT_PLACEHOLDER)
+        self.prefix, self.suffix = encoded.split(placeholder, 1)
+
+    def render(self, recipient: Text) -> EncodedPayload:
+        payload = {**self.payload, self.recipient_key: recipient}
+        json_bytes = b"".join((self.prefix, dumps(recipient), self.suffix))
+        return EncodedPayload(payload, json_bytes)
+
+
+def get_media(rasa_message: Dict) -> Tuple[Text, Text] | None:
+    """
+    Returns the media type and the file path or link of a Rasa message,
+    given as {"image": ...}, {"video": ...}, {"audio": ...},
+    {"document": ...} or Rasa's {"attachment": ...} for documents.
+    """
+    for media_type in MEDIA_TYPES:
+        if rasa_message.get(media_type):
+            return media_type, rasa_message[media_type]
+    if rasa_message.get("attachment"):
+        return "document", rasa_message["attachment"]
+    return None
+
+
+def rasa_message_key(rasa_message: Dict) -> Hashable:
+    """
+    Returns a hashable key made of the Rasa message fields used by the
+    parsers, leaving out recipient_id.
+    """
+    buttons = rasa_message.get("buttons") or ()
+    return (
+        rasa_message.get("text"),
+        tuple((button.get("title"), button.get("payload")) for button in buttons),
+        get_media(rasa_message),
+        rasa_message.get("media_id"),
+    )
+
+
+@dataclass
+class PayloadCache:
+    """
+    LRU cache of PayloadTemplate by Rasa message. Survey bots send the same
+    texts and buttons over and over, so most answers are built only once.
+    """
+
+    maxsize: int = Config.PAYLOAD_CACHE_SIZE
+
+    def __post_init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._templates: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(
+        self, rasa_message: Dict, build: Callable[[Dict], PayloadTemplate]
+    ) -> PayloadTemplate:
+        try:
+            key = rasa_message_key(rasa_message)
+            hash(key)
+        except TypeError:
+            # Unhashable titles or payloads are built without caching.
+            self.misses += 1
+            return build(rasa_message)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return template
+        self.misses += 1
+        template = build(rasa_message)
+        if self.maxsize > 0:
+            with self._lock:
+                self._templates[key] = template
+                if len(self._templates) > self.maxsize:
+                    self._templates.popitem(last=False)
+        return template
+
+    def stats(self) -> Dict[Text, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._templates),
+            "maxsize": self.maxsize,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
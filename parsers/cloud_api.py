@@ -1,6 +1,22 @@
 from dataclasses import dataclass, field
-from typing import Any, Dict, Text, List
-from ..message import InteractiveMessage, TextMessage, NotSupportedMessage
+import os
+from typing import Any, ClassVar, Dict, Text, List
+from ..clients.media import CAPTIONED_MEDIA_TYPES, resolve_media
+from ..message import (
+    InteractiveMessage,
+    MediaMessage,
+    NotSupportedMessage,
+    TextMessage,
+)
+from .cache import (
+    EncodedPayload,
+    PayloadCache,
+    PayloadTemplate,
+    RECIPIENT_PLACEHOLDER,
+    get_media,
+)
+
+payload_cache = PayloadCache()
 
 
 @dataclass
@@ -8,8 +24,8 @@ class RasaBackend:
     """
     Fake Rasa backend to processing WhatsApp user message.
 
-    This class is for tests only. You should implement or consume some real Rasa instance
-    or any other service that will decide what to do with the WhatsApp message.
+    This class is for tests only. Set ANSWER_BACKEND=rasa to consume a real Rasa
+    instance, or plug in any other service through backends.py.
     """
 
     answers: List[Dict[Text, Text]] = field(
@@ -48,14 +64,29 @@ class RasaBackend:
 
     def get_answers_to_message(
         self,
-        message: InteractiveMessage | TextMessage | NotSupportedMessage,
+        message: InteractiveMessage | TextMessage | MediaMessage | NotSupportedMessage,
+        sender_id: Text = "",
     ) -> list:
         """Returns a list of Rasa messages to send back to WhatsApp."""
-        if not message.text:
+        if not message.text and not isinstance(message, MediaMessage):
             return []
         return self.answers
 
 
+@dataclass
+class AsyncRasaBackend(RasaBackend):
+    """
+    asyncio version of RasaBackend.
+    """
+
+    async def get_answers_to_message(
+        self,
+        message: InteractiveMessage | TextMessage | MediaMessage | NotSupportedMessage,
+        sender_id: Text = "",
+    ) -> list:
+        return super().get_answers_to_message(message, sender_id)
+
+
 @dataclass
 class CloudApiMessagesParser:
     """
@@ -64,12 +95,33 @@ class CloudApiMessagesParser:
 
     rasa_messages: list
     recipent_phone: Text
+    payload_cache: PayloadCache = field(default_factory=lambda: payload_cache)
+    # Media ids are uploaded to, and cached for, this provider.
+    provider: ClassVar[Text] = "cloud_api"
 
     def get_message_type(self, message: Any):
         if message.get("buttons"):
             return "interactive"
+        if get_media(message):
+            return "media"
         return "text"
 
+    def parse_media(self, rasa_message: Dict) -> Dict:
+        """
+        Returns the media object of a Rasa message: its uploaded media id,
+        or the link for the Cloud API to fetch.
+        """
+        media_type, reference = get_media(rasa_message)
+        if rasa_message.get("media_id"):
+            media = {"id": rasa_message["media_id"]}
+        else:
+            media = {"link": reference}
+        if rasa_message.get("text") and media_type in CAPTIONED_MEDIA_TYPES:
+            media["caption"] = rasa_message["text"]
+        if media_type == "document":
+            media["filename"] = os.path.basename(reference)
+        return media
+
     def get_interactive_type(self, message: Any):
         buttons = message.get("buttons")
         buttons: List = message.get("buttons")
@@ -100,65 +152,84 @@ class CloudApiMessagesParser:
                 cloud_rows.append(row)
         return cloud_rows
 
-    def parse_messages(self) -> Dict:
-        parsed_messages = []
-        for rasa_message in self.rasa_messages:
-            message_type = self.get_message_type(rasa_message)
-            payload: Dict = {
-                "messaging_product": "whatsapp",
-                "recipient_type": "individual",
-                "to": f"{self.recipent_phone}",
-                "type": message_type,
-            }
-            if message_type == "interactive":
-                interactive_type = self.get_interactive_type(rasa_message)
-                if interactive_type == "buttons":
-                    payload.update(
-                        {
-                            "interactive": {
-                                "type": "button",
-                                "body": {"text": rasa_message.get("text")},
-                                "action": {
-                                    "buttons": self.parse_buttons(
-                                        rasa_message.get("buttons")
-                                    )
-                                },
-                            },
-                        }
-                    )
-                elif interactive_type == "list":
-                    payload.update(
-                        {
-                            "interactive": {
-                                "type": "list",
-                                "header": {
-                                    "type": "text",
-                                    "text": "",
-                                },
-                                "body": {"text": rasa_message.get("text")},
-                                "footer": {"text": ""},
-                                "action": {
-                                    "button": "opções",
-                                    "sections": [
-                                        {
-                                            "title": "",
-                                            "rows": self.parse_rows(
-                                                rasa_message.get("buttons")
-                                            ),
-                                        }
-                                    ],
-                                },
+    def build_payload(self, rasa_message: Dict) -> PayloadTemplate:
+        """
+        Builds the recipient-independent payload of a Rasa message.
+        """
+        message_type = self.get_message_type(rasa_message)
+        payload: Dict = {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": RECIPIENT_PLACEHOLDER,
+            "type": message_type,
+        }
+        if message_type == "interactive":
+            interactive_type = self.get_interactive_type(rasa_message)
+            if interactive_type == "buttons":
+                payload.update(
+                    {
+                        "interactive": {
+                            "type": "button",
+                            "body": {"text": rasa_message.get("text")},
+                            "action": {
+                                "buttons": self.parse_buttons(
+                                    rasa_message.get("buttons")
+                                )
                             },
-                        }
-                    )
-            else:
+                        },
+                    }
+                )
+            elif interactive_type == "list":
                 payload.update(
                     {
-                        "text": {
-                            "body": rasa_message.get("text"),
-                            "preview_url": False,
+                        "interactive": {
+                            "type": "list",
+                            "header": {
+                                "type": "text",
+                                "text": "",
+                            },
+                            "body": {"text": rasa_message.get("text")},
+                            "footer": {"text": ""},
+                            "action": {
+                                "button": "opções",
+                                "sections": [
+                                    {
+                                        "title": "",
+                                        "rows": self.parse_rows(
+                                            rasa_message.get("buttons")
+                                        ),
+                                    }
+                                ],
+                            },
                         },
                     }
                 )
-            parsed_messages.append(payload)
-        return parsed_messages
+        elif message_type == "media":
+            media_type = get_media(rasa_message)[0]
+            payload.update(
+                {"type": media_type, media_type: self.parse_media(rasa_message)}
+            )
+        else:
+            payload.update(
+                {
+                    "text": {
+                        "body": rasa_message.get("text"),
+                        "preview_url": False,
+                    },
+                }
+            )
+        return PayloadTemplate(payload, "to")
+
+    def parse_messages(self) -> List[EncodedPayload]:
+        """
+        Returns one payload per Rasa message. Payloads come from
+        payload_cache and carry their JSON encoding; treat them as read-only.
+        Local media files are uploaded on their first use.
+        """
+        recipient = f"{self.recipent_phone}"
+        return [
+            self.payload_cache.get_or_build(rasa_message, self.build_payload).render(
+                recipient
+            )
+            for rasa_message in resolve_media(self.rasa_messages, self.provider)
+        ]
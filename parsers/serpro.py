@@ -1,6 +1,17 @@
 from ..config import Config
-from dataclasses import dataclass
-from typing import Any, Dict, Text, List
+from dataclasses import dataclass, field
+import os
+from typing import Any, ClassVar, Dict, Text, List
+from ..clients.media import CAPTIONED_MEDIA_TYPES, resolve_media
+from .cache import (
+    EncodedPayload,
+    PayloadCache,
+    PayloadTemplate,
+    RECIPIENT_PLACEHOLDER,
+    get_media,
+)
+
+payload_cache = PayloadCache()
 
 
 @dataclass
@@ -11,6 +22,9 @@ class SerproApiMessagesParser:
 
     rasa_messages: list
     recipent_phone: Text
+    payload_cache: PayloadCache = field(default_factory=lambda: payload_cache)
+    # Media ids are uploaded to, and cached for, this provider.
+    provider: ClassVar[Text] = "serpro"
 
     def get_message_type(self, message: Any):
         if message.get("buttons"):
@@ -18,6 +32,8 @@ class SerproApiMessagesParser:
             if len(buttons) > 3:
                 return "secoes"
             return "buttons"
+        if get_media(message):
+            return "midia"
         return "text"
 
     def parse_buttons(self, rasa_buttons: List) -> List:
@@ -40,29 +56,54 @@ class SerproApiMessagesParser:
                 serpro_secoes[0]["rows"].append(secao)
         return serpro_secoes
 
-    def parse_messages(self) -> Dict:
-        parsed_messages = []
-        for rasa_message in self.rasa_messages:
-            message_type = self.get_message_type(rasa_message)
-            payload: Dict = {
-                "destinatario": f"{self.recipent_phone}",
-                "textoBody": rasa_message.get("text"),
-                "wabaId": Config.SERPRO_WABA_ID,
-            }
-            if message_type == "buttons":
-                payload.update(
-                    {"buttons": self.parse_buttons(rasa_message.get("buttons"))}
-                )
-            elif message_type == "secoes":
-                payload.update(
-                    {"secoes": self.parse_secoes(rasa_message.get("buttons"))}
-                )
-            else:
-                payload.update(
-                    {
-                        "body": rasa_message.get("text"),
-                        "preview_url": False,
-                    }
-                )
-            parsed_messages.append(payload)
-        return parsed_messages
+    def parse_midia(self, rasa_message: Dict) -> Dict:
+        media_type, reference = get_media(rasa_message)
+        midia = {"tipo": media_type}
+        if rasa_message.get("media_id"):
+            midia["id"] = rasa_message["media_id"]
+        else:
+            midia["link"] = reference
+        if rasa_message.get("text") and media_type in CAPTIONED_MEDIA_TYPES:
+            midia["legenda"] = rasa_message["text"]
+        if media_type == "document":
+            midia["nomeArquivo"] = os.path.basename(reference)
+        return midia
+
+    def build_payload(self, rasa_message: Dict) -> PayloadTemplate:
+        """
+        Builds the recipient-independent payload of a Rasa message.
+        """
+        message_type = self.get_message_type(rasa_message)
+        payload: Dict = {
+            "destinatario": RECIPIENT_PLACEHOLDER,
+            "textoBody": rasa_message.get("text"),
+            "wabaId": Config.SERPRO_WABA_ID,
+        }
+        if message_type == "buttons":
+            payload.update({"buttons": self.parse_buttons(rasa_message.get("buttons"))})
+        elif message_type == "secoes":
+            payload.update({"secoes": self.parse_secoes(rasa_message.get("buttons"))})
+        elif message_type == "midia":
+            payload.update({"midia": self.parse_midia(rasa_message)})
+        else:
+            payload.update(
+                {
+                    "body": rasa_message.get("text"),
+                    "preview_url": False,
+                }
+            )
+        return PayloadTemplate(payload, "destinatario")
+
+    def parse_messages(self) -> List[EncodedPayload]:
+        """
+        Returns one payload per Rasa message. Payloads come from
+        payload_cache and carry their JSON encoding; treat them as read-only.
+        Local media files are uploaded on their first use.
+        """
+        recipient = f"{self.recipent_phone}"
+        return [
+            self.payload_cache.get_or_build(rasa_message, self.build_payload).render(
+                recipient
+            )
+            for rasa_message in resolve_media(self.rasa_messages, self.provider)
+        ]
@@ -0,0 +1,378 @@
+"""
+On-demand profiling of the webhook requests.
+
+While profiling is enabled, a thread samples the stacks of the requests in
+flight every Config.PROFILING_INTERVAL seconds and each request records how
+long its stages took (decode, event build, backend, parse, each send). A
+share of the requests, and every request slower than the threshold, is kept
+in a ring buffer that can be dumped at any time. While disabled, a request
+only checks a flag and each stage a context variable.
+"""
+
+from collections import Counter, deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Set, Text, Tuple
+
+from .config import Config
+from .metrics import REGISTRY
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+kept_profiles_counter = REGISTRY.counter(
+    "request_profiles_total",
+    "Request profiles kept in the ring buffer, by reason.",
+    label_names=("reason",),
+)
+
+NO_TRACE = nullcontext()
+
+
+@dataclass
+class RequestTrace:
+    """
+    Stages and stack samples of one request.
+    """
+
+    name: Text
+    started_at: float = field(default_factory=time.time)
+    duration: float = 0
+    reason: Text = ""
+    stages: List[Tuple[Text, float]] = field(default_factory=list)
+    samples: Dict[Text, int] = field(default_factory=Counter)
+    threads: Set[int] = field(default_factory=set)
+    on_finish: Optional[Callable[["RequestTrace"], None]] = None
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._holds = 0
+
+    def hold(self):
+        """
+        Keeps the trace open until the matching release(). The trace
+        finishes, calling on_finish, when the last hold is released.
+        """
+        with self._lock:
+            self._holds += 1
+
+    def release(self):
+        with self._lock:
+            self._holds -= 1
+            finished = self._holds == 0
+        if finished and self.on_finish:
+            self.on_finish(self)
+
+    def as_dict(self) -> Dict[Text, Any]:
+        """
+        Returns the trace with its samples as collapsed stacks, the input
+        format of flamegraph.pl and speedscope, most frequent first.
+        """
+        # The sampler may still be adding to samples.
+        samples = sorted(dict(self.samples).items(), key=lambda item: -item[1])
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "reason": self.reason,
+            "stages": [
+                {"stage": stage, "seconds": seconds} for stage, seconds in self.stages
+            ],
+            "profile": [f"{stack} {count}" for stack, count in samples],
+        }
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar(
+    "current_trace", default=None
+)
+
+
+class Stage:
+    """
+    Records the duration of a block in the current trace.
+    """
+
+    __slots__ = ("trace", "name", "started")
+
+    def __init__(self, trace: RequestTrace, name: Text):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exception):
+        self.trace.stages.append((self.name, time.perf_counter() - self.started))
+
+
+def stage(name: Text):
+    """
+    Context manager timing a stage of the request being profiled, if any.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        return NO_TRACE
+    return Stage(trace, name)
+
+
+def traced(function: Callable) -> Callable:
+    """
+    Binds function to the current trace, so its stages and stacks are
+    recorded when it runs on another thread. The trace stays open until the
+    returned function has run once, or has been discarded without running.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        return function
+    trace.hold()
+
+    def run(*args, **kwargs):
+        token = current_trace.set(trace)
+        thread = threading.get_ident()
+        trace.threads.add(thread)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            trace.threads.discard(thread)
+            current_trace.reset(token)
+            release()
+
+    # Also releases the trace when run is dropped unused, by a full queue
+    # for example.
+    release = weakref.finalize(run, trace.release)
+    release.atexit = False
+    return run
+
+
+def collapse_stack(frame) -> Text:
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        functions.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}"
+            f":{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(functions))
+
+
+class StackSampler:
+    """
+    Daemon thread sampling the stacks of the threads of the traces in
+    flight. It sleeps while there is none.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._traces: Dict[int, RequestTrace] = {}
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, name="stack-sampler", daemon=True).start()
+
+    def add(self, trace: RequestTrace):
+        with self._condition:
+            self._traces[id(trace)] = trace
+            self._condition.notify()
+
+    def remove(self, trace: RequestTrace):
+        with self._condition:
+            self._traces.pop(id(trace), None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._traces:
+                    self._condition.wait()
+                traces = list(self._traces.values())
+            frames = sys._current_frames()
+            for trace in traces:
+                for thread in tuple(trace.threads):
+                    frame = frames.get(thread)
+                    if frame is not None:
+                        trace.samples[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class TraceScope:
+    """
+    Profiles the block run inside it; see RequestProfiler.trace. The trace
+    finishes, and is kept or not, when the block and the work it handed
+    over with traced() are done.
+    """
+
+    __slots__ = ("profiler", "trace", "sampler", "token", "started")
+
+    def __init__(self, profiler: "RequestProfiler", name: Text):
+        self.profiler = profiler
+        self.trace = RequestTrace(name)
+
+    def __enter__(self) -> RequestTrace:
+        self.trace.threads.add(threading.get_ident())
+        self.sampler = self.profiler._get_sampler()
+        self.trace.on_finish = self._finish
+        self.trace.hold()
+        self.sampler.add(self.trace)
+        self.token = current_trace.set(self.trace)
+        self.started = time.perf_counter()
+        return self.trace
+
+    def __exit__(self, *exception):
+        current_trace.reset(self.token)
+        self.trace.threads.discard(threading.get_ident())
+        self.trace.release()
+
+    def _finish(self, trace: RequestTrace):
+        trace.duration = time.perf_counter() - self.started
+        self.sampler.remove(trace)
+        self.profiler._keep(trace)
+
+
+@dataclass
+class RequestProfiler:
+    """
+    Profiles the requests while enabled and keeps the sampled and the slow
+    ones in a ring buffer of buffer_size traces.
+    """
+
+    enabled: bool = Config.PROFILING_ENABLED
+    sample_rate: float = Config.PROFILING_SAMPLE_RATE
+    slow_threshold: float = Config.PROFILING_SLOW_THRESHOLD
+    buffer_size: int = Config.PROFILING_BUFFER_SIZE
+    interval: float = Config.PROFILING_INTERVAL
+
+    def __post_init__(self):
+        self._traces: deque = deque(maxlen=self.buffer_size)
+        self._lock = threading.Lock()
+        self._sampler: StackSampler | None = None
+        self._pid: int | None = None
+
+    def _get_sampler(self) -> StackSampler:
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # The sampler thread of a parent process does not survive
+                    # a fork.
+                    self._sampler = StackSampler(self.interval)
+                    self._pid = os.getpid()
+        return self._sampler
+
+    def trace(self, name: Text):
+        """
+        Context manager profiling the request run inside the block, or doing
+        nothing when profiling is disabled.
+        """
+        if not self.enabled:
+            return NO_TRACE
+        return TraceScope(self, name)
+
+    def _keep(self, trace: RequestTrace):
+        if self.slow_threshold > 0 and trace.duration >= self.slow_threshold:
+            trace.reason = "slow"
+        elif random.random() < self.sample_rate:
+            trace.reason = "sampled"
+        else:
+            return
+        trace.threads = set()
+        self._traces.append(trace)
+        kept_profiles_counter.labels(trace.reason).inc()
+
+    def configure(
+        self,
+        enabled: bool | None = None,
+        sample_rate: float | None = None,
+        slow_threshold: float | None = None,
+    ):
+        """
+        Changes the given settings. Raises TypeError or ValueError, changing
+        none of them, when one is invalid.
+        """
+        if enabled is not None and not isinstance(enabled, bool):
+            raise TypeError(f"enabled must be true or false, not {enabled!r}")
+        if sample_rate is not None:
+            sample_rate = float(sample_rate)
+        if slow_threshold is not None:
+            slow_threshold = float(slow_threshold)
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+        if enabled is not None:
+            self.enabled = enabled
+
+    def toggle(self) -> bool:
+        self.enabled = not self.enabled
+        return self.enabled
+
+    def clear(self):
+        self._traces.clear()
+
+    def dump(self) -> Dict[Text, Any]:
+        return {
+            "pid": os.getpid(),
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_threshold": self.slow_threshold,
+            "traces": [trace.as_dict() for trace in list(self._traces)],
+        }
+
+    def dump_to_file(self, directory: Text = Config.PROFILING_DUMP_DIR) -> Text:
+        """
+        Writes dump() to directory and returns the file path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory, f"profiles-{os.getpid()}-{time.strftime('%Y%m%d%H%M%S')}.json"
+        )
+        with open(path, "wb") as dump_file:
+            dump_file.write(dumps(self.dump()))
+        return path
+
+
+_request_profiler: RequestProfiler | None = None
+
+
+def get_request_profiler() -> RequestProfiler:
+    """
+    Returns the request profiler of the process.
+    """
+    global _request_profiler
+    if _request_profiler is None:
+        _request_profiler = RequestProfiler()
+    return _request_profiler
+
+
+def toggle_profiling():
+    profiler = get_request_profiler()
+    if profiler.toggle():
+        logger.warning("Request profiling enabled")
+        return
+    try:
+        path = profiler.dump_to_file()
+    except OSError:
+        logger.exception("Could not write the request profiles")
+        return
+    logger.warning("Request profiling disabled, profiles written to %s", path)
+
+
+def install_signal_handler(signal_name: Text = Config.PROFILING_SIGNAL):
+    """
+    Makes signal_name toggle profiling. Must be called from the main thread,
+    after the server has set its own handlers.
+    """
+    if not signal_name:
+        return
+    # The handler runs on the main thread, possibly inside the profiler, so
+    # the work is done on another thread.
+    signal.signal(
+        getattr(signal, signal_name),
+        lambda *_: threading.Thread(target=toggle_profiling, daemon=True).start(),
+    )
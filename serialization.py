@@ -0,0 +1,58 @@
+"""
+Single entry point to encode and decode JSON.
+
+Webhook bodies are decoded once and outgoing payloads encoded once, with the
+fastest backend available: orjson or msgspec when installed, the standard
+library json module otherwise. Set JSON_BACKEND to force one of them.
+"""
+
+import json
+from typing import Any, Callable, Dict
+
+from .config import Config
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj).encode()
+
+
+def _load_orjson():
+    import orjson
+
+    return orjson.loads, orjson.dumps
+
+
+def _load_msgspec():
+    import msgspec
+
+    return msgspec.json.decode, msgspec.json.encode
+
+
+def _load_json():
+    return json.loads, _json_dumps
+
+
+BACKENDS: Dict[str, Callable] = {
+    "orjson": _load_orjson,
+    "msgspec": _load_msgspec,
+    "json": _load_json,
+}
+
+
+def _select_backend():
+    if Config.JSON_BACKEND != "auto":
+        if Config.JSON_BACKEND not in BACKENDS:
+            raise ValueError(
+                f"Unknown JSON_BACKEND {Config.JSON_BACKEND!r}, expected auto, "
+                + ", ".join(BACKENDS)
+            )
+        return (Config.JSON_BACKEND, *BACKENDS[Config.JSON_BACKEND]())
+    for name, load_backend in BACKENDS.items():
+        try:
+            return (name, *load_backend())
+        except ImportError:
+            continue
+
+
+BACKEND, loads, dumps = _select_backend()
+# loads(bytes | str) -> Any and dumps(Any) -> bytes, whatever the backend.
@@ -1,26 +1,62 @@
-import json
+from functools import partial
+import hmac
 import logging
 import os
+from typing import Dict, List
 
-from flask import Flask, request
+from flask import Flask, Response, request
 
-from .message import WhatsAppEvent
-from .rasa import RasaBackend, CloudApiMessagesParser
-from .wpp_api_client import CloudApiClient
+from .backends import get_answer_backend
+from .classifier import MESSAGE, classify_webhook
+from .clients.circuit_breaker import CircuitOpenError
+from .clients.registry import get_client_registry
+from .coalescing import MessageCoalescer
+from .config import Config
+from .deadline import DeadlineExceeded, deadline_scope
+from .dispatch import KeyedExecutor
+from .idempotency import get_idempotency_guard
+from .lifecycle import preload
+from .message import MediaMessage
+from .metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, exposition
+from .outbound.streams import get_outbound_queue
+from .profiling import get_request_profiler, stage, traced
+from .serialization import dumps, loads
+from .worker_pool import WebhookWorkerPool
+from .wpp_event import WhatsAppEvent, WhatsAppEventBatch, coalesce_events
 
+logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-app.logger.setLevel(logging.INFO)
+worker_pool: WebhookWorkerPool | None = None
+event_executor: KeyedExecutor | None = None
+message_coalescer: MessageCoalescer | None = None
+skipped_sends_counter = REGISTRY.counter(
+    "whatsapp_send_skipped_total",
+    "Answers not sent because the event deadline was spent or the provider circuit was open.",
+)
+decode_histogram = REGISTRY.histogram(
+    "webhook_decode_seconds", "Time to classify and decode a webhook body."
+)
+event_build_histogram = REGISTRY.histogram(
+    "whatsapp_event_build_seconds",
+    "Time to split a webhook delivery into WhatsApp events.",
+)
+backend_histogram = REGISTRY.histogram(
+    "answer_backend_seconds", "Time the answer backend took to answer a message."
+)
+parser_histogram = REGISTRY.histogram(
+    "answer_parser_seconds", "Time to convert the answers to provider payloads."
+)
 
 
-def logging_whatsapp_event():
-    # https://stackoverflow.com/questions/11093236/use-logging-print-the-output-of-pprint
-    app.logger.info(f"NEW WHATSAPP EVENT: \n {json.dumps(request.json, indent=4)}")
+def logging_whatsapp_event(body: bytes):
+    # The raw body is only decoded when INFO is enabled.
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("NEW WHATSAPP EVENT: \n %s", body.decode(errors="replace"))
 
 
-def logging_whatsapp_post_request(response_text):
-    # https://stackoverflow.com/questions/11093236/use-logging-print-the-output-of-pprint
-    app.logger.info(f"NEW REQUEST TO WHATSAPP: \n {response_text}")
+def logging_whatsapp_post_request(response):
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("NEW REQUEST TO WHATSAPP: \n %s", response.text)
 
 
 def verify_webhook(request):
@@ -29,24 +65,272 @@ def verify_webhook(request):
     return request.args.get("hub.challenge")
 
 
+def get_worker_pool() -> WebhookWorkerPool:
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = WebhookWorkerPool(handler=lambda process: process())
+    return worker_pool
+
+
+def get_event_executor() -> KeyedExecutor:
+    global event_executor
+    if event_executor is None:
+        event_executor = KeyedExecutor(thread_name_prefix="event-fanout")
+    return event_executor
+
+
+def get_message_coalescer() -> MessageCoalescer:
+    global message_coalescer
+    if message_coalescer is None:
+        message_coalescer = MessageCoalescer(
+            handler=lambda whatsapp_events: get_event_executor().submit(
+                whatsapp_events[0].contact.phone,
+                traced(answer_coalesced_events),
+                whatsapp_events,
+            )
+        )
+    return message_coalescer
+
+
+def drain():
+    """
+    Answers the events this process still holds, queued for the webhook
+    workers or held by the coalescer, and waits for their answers. Run when
+    a worker exits; see gunicorn_conf.py.
+    """
+    if worker_pool is not None:
+        worker_pool.stop()
+    if message_coalescer is not None:
+        message_coalescer.flush()
+    if event_executor is not None:
+        event_executor.shutdown(wait=True)
+
+
+def answer_coalesced_events(whatsapp_events: List[WhatsAppEvent]):
+    """
+    Answers the messages a contact sent within Config.COALESCE_WINDOW,
+    merging consecutive texts into one backend call. If any answer fails,
+    every message id is released so redeliveries are answered again.
+    """
+    answered = [
+        try_answer_whatsapp_event(whatsapp_event, forget_on_failure=False)
+        for whatsapp_event in coalesce_events(whatsapp_events)
+    ]
+    idempotency_guard = get_idempotency_guard()
+    if idempotency_guard and not all(answered):
+        for whatsapp_event in whatsapp_events:
+            idempotency_guard.forget(whatsapp_event.get_event_message_id())
+
+
+def process_whatsapp_event(event: Dict, body: bytes = b"") -> bool:
+    """
+    Answers every message of a webhook delivery. Messages of different
+    contacts are answered concurrently, messages of the same contact in order.
+    body is the raw request body, used for logging. Returns False when an
+    answer failed.
+
+    With Config.COALESCE_WINDOW set, messages are handed to the coalescer
+    and answered after the window, once the webhook has been acknowledged.
+    """
+    logging_whatsapp_event(body)
+    idempotency_guard = get_idempotency_guard()
+    with event_build_histogram.time(), stage("event_build"):
+        batch = WhatsAppEventBatch(
+            event, accept_message=idempotency_guard and idempotency_guard.first_seen
+        )
+    if Config.COALESCE_WINDOW > 0:
+        coalescer = get_message_coalescer()
+        for whatsapp_event in batch.events:
+            coalescer.submit(whatsapp_event.contact.phone, whatsapp_event)
+        return True
+    if len(batch.events) == 1:
+        return try_answer_whatsapp_event(batch.events[0])
+    futures = [
+        get_event_executor().submit(
+            whatsapp_event.contact.phone,
+            traced(try_answer_whatsapp_event),
+            whatsapp_event,
+        )
+        for whatsapp_event in batch.events
+    ]
+    return all([future.result() for future in futures])
+
+
+def try_answer_whatsapp_event(
+    whatsapp_event: WhatsAppEvent, forget_on_failure: bool = True
+) -> bool:
+    """
+    Answers whatsapp_event, logging failures. The message id of a failed
+    answer is released, so a redelivery of the message is answered again.
+    Returns False when the answer failed.
+    """
+    try:
+        answer_whatsapp_event(whatsapp_event)
+        return True
+    except Exception:
+        logger.exception("Could not answer WhatsApp message")
+        idempotency_guard = get_idempotency_guard()
+        if idempotency_guard and forget_on_failure:
+            idempotency_guard.forget(whatsapp_event.get_event_message_id())
+        return False
+
+
+def answer_whatsapp_event(whatsapp_event: WhatsAppEvent):
+    """
+    Sends the WhatsApp event message to the answer backend and
+    delivers the answers back to the contact.
+
+    The answers are sent by the OutboundDispatcher of the provider, so the
+    answers of concurrent events of one contact are never interleaved. The
+    backend call and the sends share Config.EVENT_DEADLINE; once it is
+    spent, or the provider circuit is open, the remaining answers are skipped
+    and the event fails, like any failed send.
+    With Config.OUTBOUND_QUEUE_ENABLED the answers are queued for the
+    outbound workers instead.
+    """
+    with deadline_scope():
+        message = whatsapp_event.get_event_message()
+        if Config.MEDIA_DOWNLOAD_DIR and isinstance(message, MediaMessage):
+            with stage("media_download"):
+                message.path = whatsapp_event.wpp_client.download_media(
+                    message.media_id, Config.MEDIA_DOWNLOAD_DIR, message.sha256
+                )
+        with backend_histogram.time(), stage("backend"):
+            answers = get_answer_backend().get_answers_to_message(
+                message, whatsapp_event.contact.phone
+            )
+        with parser_histogram.time(), stage("parse"):
+            wpp_messages = whatsapp_event.parser_class(
+                answers, whatsapp_event.contact.phone
+            ).parse_messages()
+        if Config.OUTBOUND_QUEUE_ENABLED:
+            with stage("enqueue"):
+                get_outbound_queue().enqueue(whatsapp_event.provider, wpp_messages)
+            return
+        dispatcher = get_client_registry().outbound_dispatcher(whatsapp_event.provider)
+        for result in dispatcher.dispatch(wpp_messages).values():
+            for response in result.responses:
+                logging_whatsapp_post_request(response)
+            if isinstance(result.error, (DeadlineExceeded, CircuitOpenError)):
+                skipped_sends_counter.inc(result.total - result.sent)
+                logger.warning(
+                    "Skipping %s answers to WhatsApp: %s",
+                    result.total - result.sent,
+                    result.error,
+                )
+            if result.error:
+                # The event fails and its message id is released, so a
+                # redelivery is answered again.
+                raise result.error
+
+
 def respond_to_whatsapp_event(request):
-    logging_whatsapp_event()
-    whatsapp_event = WhatsAppEvent(event=request.json)
-    message = whatsapp_event.get_event_message()
-    answers = RasaBackend().get_answers_to_message(message)
-    wpp_messages = CloudApiMessagesParser(
-        answers, whatsapp_event.recipient_phone
-    ).parse_messages()
-    wpp_client = CloudApiClient()
-    for message in wpp_messages:
-        response_text, _ = wpp_client.send_message(message)
-        logging_whatsapp_post_request(response_text)
+    body = request.get_data()
+    with decode_histogram.time(), stage("decode"):
+        event_class = classify_webhook(body)
+        event = None
+        if event_class == MESSAGE:
+            try:
+                event = loads(body)
+            except ValueError:
+                pass
+    if event_class != MESSAGE:
+        # Statuses updates, unsupported message types and empty deliveries
+        # have nothing to answer.
+        logger.debug("Ignoring %s WhatsApp event", event_class)
+        return "ok", 200
+    if not isinstance(event, dict):
+        return "Invalid WhatsApp event", 400
+    if Config.WEBHOOK_ASYNC_MODE:
+        # The trace of the request keeps the stages run by the worker.
+        process = partial(traced(process_whatsapp_event), event, body)
+        if not get_worker_pool().submit(process):
+            return "Webhook queue is full", 503
+        return "ok", 200
+    if not process_whatsapp_event(event, body):
+        # The ids of the failed messages were released, so WhatsApp
+        # redelivers the webhook and only those are answered again.
+        return "Could not answer WhatsApp message", 500
     return "ok", 200
 
 
-@app.route("/webhooks/whatsapp/webhook", methods=["GET", "POST"])
 def webhook():
     if request.method == "GET":
         return verify_webhook(request)
     if request.method == "POST":
-        return respond_to_whatsapp_event(request)
+        with get_request_profiler().trace("webhook"):
+            return respond_to_whatsapp_event(request)
+
+
+def metrics():
+    return Response(exposition(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def is_admin(request) -> bool:
+    authorization = request.headers.get("Authorization", "")
+    return bool(Config.ADMIN_TOKEN) and hmac.compare_digest(
+        authorization.encode(), f"Bearer {Config.ADMIN_TOKEN}".encode()
+    )
+
+
+def profiling():
+    """
+    Returns the request profiles kept by this process. POST changes the
+    enabled, sample_rate and slow_threshold settings given as JSON, and
+    DELETE empties the buffer.
+    """
+    if not is_admin(request):
+        return "Not found", 404
+    profiler = get_request_profiler()
+    if request.method == "POST":
+        settings = request.get_json(silent=True)
+        if not isinstance(settings, dict):
+            return "Invalid profiling settings", 400
+        try:
+            profiler.configure(
+                **{
+                    name: settings[name]
+                    for name in ("enabled", "sample_rate", "slow_threshold")
+                    if name in settings
+                }
+            )
+        except (TypeError, ValueError):
+            return "Invalid profiling settings", 400
+    elif request.method == "DELETE":
+        profiler.clear()
+    return Response(dumps(profiler.dump()), content_type="application/json")
+
+
+def create_app() -> Flask:
+    """
+    Builds the Flask app. It opens no connection, so it can run in the
+    gunicorn master with --preload: the modules are loaded once and shared
+    by the workers, which create their connections after the fork (see
+    lifecycle.init_worker and gunicorn_conf.py).
+    """
+    preload()
+    app = Flask(__name__)
+    # app.logger is this module logger, with Flask's default handler.
+    app.logger.setLevel(logging.INFO)
+    app.add_url_rule(
+        "/webhooks/whatsapp/webhook", view_func=webhook, methods=["GET", "POST"]
+    )
+    app.add_url_rule("/metrics", view_func=metrics, methods=["GET"])
+    app.add_url_rule(
+        "/admin/profiling", view_func=profiling, methods=["GET", "POST", "DELETE"]
+    )
+    return app
+
+
+_app: Flask | None = None
+
+
+def __getattr__(name):
+    # server:app, used by flask run and the benchmarks, builds the app on
+    # first access instead of on import.
+    global _app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _app is None:
+        _app = create_app()
+    return _app
@@ -0,0 +1,139 @@
+"""
+Fake Cloud API, Serpro and Rasa servers and a webhook load generator.
+
+Serve the fakes and point the integration at them:
+
+    python -m whatsapp_api_integration.simulator serve --port 9000 \\
+        --cloud-api-latency lognormal:80,0.6 --cloud-api-throttle-rate 0.02
+    CLOUD_API_BASE_URL=http://127.0.0.1:9000/v19.0 \\
+    SERPRO_API_BASE_URL=http://127.0.0.1:9000 flask run
+
+Or serve them and replay traffic against a running webhook in one go,
+measuring the time from each message delivery to its first answer:
+
+    python -m whatsapp_api_integration.simulator run --port 9000 \\
+        --target http://127.0.0.1:5000/webhooks/whatsapp/webhook --rate 200
+"""
+
+import argparse
+import json
+import sys
+
+from .faults import FaultProfile, LatencyDistribution
+from .load import LoadGenerator
+from .servers import SERVICES, SimulatorServer, SimulatorState, start_simulator
+from .traffic import TrafficMix
+
+
+def add_simulator_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    for service in SERVICES:
+        option = service.replace("_", "-")
+        parser.add_argument(
+            f"--{option}-latency",
+            type=LatencyDistribution.parse,
+            default=LatencyDistribution(),
+            help="constant:MS, uniform:MIN,MAX, exponential:MEAN or lognormal:MEDIAN,SIGMA",
+        )
+        parser.add_argument(f"--{option}-throttle-rate", type=float, default=0.0)
+        parser.add_argument(f"--{option}-error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--token-lifetime",
+        type=float,
+        default=3600.0,
+        help="seconds a Serpro token is accepted, whatever expires_in says",
+    )
+    parser.add_argument("--token-expires-in", type=int, default=3600)
+
+
+def build_state(args) -> SimulatorState:
+    profiles = {
+        service: FaultProfile(
+            latency=getattr(args, f"{service}_latency"),
+            throttle_rate=getattr(args, f"{service}_throttle_rate"),
+            error_rate=getattr(args, f"{service}_error_rate"),
+        )
+        for service in SERVICES
+    }
+    return SimulatorState(
+        profiles=profiles,
+        token_lifetime=args.token_lifetime,
+        token_expires_in=args.token_expires_in,
+    )
+
+
+def serve(args) -> int:
+    server = SimulatorServer((args.host, args.port), build_state(args))
+    print(f"Simulator listening on {server.base_url}")
+    print(f"  CLOUD_API_BASE_URL={server.base_url}/v19.0")
+    print(f"  SERPRO_API_BASE_URL={server.base_url}")
+    print(f"  Rasa REST channel: {server.base_url}/webhooks/rest/webhook", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+
+def run(args) -> int:
+    state = build_state(args)
+    server = start_simulator(state, args.host, args.port)
+    generator = LoadGenerator(
+        target_url=args.target,
+        traffic=TrafficMix(
+            provider=args.provider,
+            message_ratio=args.message_ratio,
+            max_status_burst=args.max_status_burst,
+        ),
+        state=state,
+        duration=args.duration,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        answer_timeout=args.answer_timeout,
+    )
+    report = generator.run()
+    report["simulator"] = state.stats()
+    server.shutdown()
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m whatsapp_api_integration.simulator"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="serve the fake providers")
+    add_simulator_arguments(serve_parser)
+    serve_parser.set_defaults(handler=serve)
+
+    run_parser = commands.add_parser(
+        "run", help="serve the fake providers and load a webhook"
+    )
+    add_simulator_arguments(run_parser)
+    run_parser.add_argument("--target", required=True, help="webhook URL")
+    run_parser.add_argument(
+        "--provider", choices=("cloud_api", "serpro"), default="cloud_api"
+    )
+    run_parser.add_argument("--duration", type=float, default=30.0)
+    run_parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.0,
+        help="deliveries per second, 0 for as fast as possible",
+    )
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--message-ratio", type=float, default=0.3)
+    run_parser.add_argument("--max-status-burst", type=int, default=5)
+    run_parser.add_argument("--answer-timeout", type=float, default=30.0)
+    run_parser.set_defaults(handler=run)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+from dataclasses import dataclass, field
+import math
+import random
+import time
+from typing import Text
+
+
+@dataclass
+class LatencyDistribution:
+    """
+    Response delay of a simulated endpoint, built from a spec string with
+    times in milliseconds:
+
+        constant:20         always 20 ms
+        uniform:10,50       between 10 and 50 ms
+        exponential:20      20 ms on average
+        lognormal:20,0.5    median of 20 ms, sigma of 0.5 (long tail)
+    """
+
+    kind: Text = "constant"
+    first: float = 0.0
+    second: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: Text) -> "LatencyDistribution":
+        kind, _, arguments = spec.partition(":")
+        values = [float(value) for value in arguments.split(",") if value]
+        if kind not in ("constant", "uniform", "exponential", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        if len(values) != (2 if kind in ("uniform", "lognormal") else 1):
+            raise ValueError(f"Wrong number of arguments for latency: {spec}")
+        return cls(kind, *values)
+
+    def sample(self) -> float:
+        """
+        Returns a delay in seconds.
+        """
+        if self.kind == "uniform":
+            milliseconds = random.uniform(self.first, self.second)
+        elif self.kind == "exponential":
+            milliseconds = random.expovariate(1 / self.first) if self.first else 0.0
+        elif self.kind == "lognormal":
+            milliseconds = random.lognormvariate(math.log(self.first), self.second)
+        else:
+            milliseconds = self.first
+        return milliseconds / 1000
+
+
+@dataclass
+class FaultProfile:
+    """
+    Behaviour of a simulated provider: its latency and the fraction of
+    requests answered with 429 (throttled) or 5xx (failed).
+    """
+
+    latency: LatencyDistribution = field(default_factory=LatencyDistribution)
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+
+    def delay(self):
+        seconds = self.latency.sample()
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def pick_fault(self) -> Text:
+        """
+        Returns "throttle", "error" or "" for a request.
+        """
+        draw = random.random()
+        if draw < self.throttle_rate:
+            return "throttle"
+        if draw < self.throttle_rate + self.error_rate:
+            return "error"
+        return ""
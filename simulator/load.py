@@ -0,0 +1,122 @@
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Dict, List, Text, Tuple
+
+import requests
+
+from ..benchmarks.measure import latency_summary
+from .servers import SimulatorState
+from .traffic import MESSAGE, TrafficMix
+
+
+@dataclass
+class LoadGenerator:
+    """
+    Replays traffic against a webhook URL for duration seconds.
+
+    With rate set, deliveries are scheduled at that many per second and
+    latencies are measured from the scheduled time, so a slow webhook is not
+    hidden by the generator waiting on it. concurrency bounds the deliveries
+    in flight. When the answers are sent to the simulator state, the time
+    from a message delivery to its first answer is measured too.
+    """
+
+    target_url: Text
+    traffic: TrafficMix = field(default_factory=TrafficMix)
+    state: SimulatorState | None = None
+    duration: float = 30.0
+    rate: float = 0.0
+    concurrency: int = 16
+    answer_timeout: float = 30.0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._deliveries = iter(self.traffic)
+        self._scheduled = 0
+        self.webhook_latencies: List[float] = []
+        self.message_latencies: List[float] = []
+        self.pending_answers: List[Tuple[Text, float]] = []
+        self.responses: Dict[Text, int] = {}
+        self.completed = 0
+
+    def run(self) -> Dict:
+        self._started = time.perf_counter()
+        self._ends = self._started + self.duration
+        workers = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(self.concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - self._started
+        end_to_end = self._collect_answers()
+        return {
+            "elapsed": elapsed,
+            "deliveries": self.completed,
+            "responses": dict(self.responses),
+            "webhook": latency_summary(self.webhook_latencies, elapsed),
+            "end_to_end": latency_summary(end_to_end, elapsed),
+            "unanswered": len(self.pending_answers),
+        }
+
+    def _next_delivery(self):
+        with self._lock:
+            kind, recipient, body = next(self._deliveries)
+            if self.rate:
+                scheduled = self._started + self._scheduled / self.rate
+            else:
+                scheduled = time.perf_counter()
+            self._scheduled += 1
+        return kind, recipient, body, scheduled
+
+    def _worker(self):
+        session = requests.Session()
+        headers = {"Content-Type": "application/json"}
+        while True:
+            kind, recipient, body, scheduled = self._next_delivery()
+            if scheduled >= self._ends:
+                return
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                status = str(
+                    session.post(
+                        self.target_url, data=body, headers=headers
+                    ).status_code
+                )
+            except requests.RequestException as exception:
+                status = type(exception).__name__
+            finished = time.perf_counter()
+            with self._lock:
+                self.completed += 1
+                self.responses[status] = self.responses.get(status, 0) + 1
+                self.webhook_latencies.append(finished - scheduled)
+                if kind == MESSAGE and status == "200":
+                    self.pending_answers.append((recipient, scheduled))
+
+    def _collect_answers(self) -> List[float]:
+        """
+        Returns the delivery-to-first-answer times of the messages answered
+        within answer_timeout, leaving the others in pending_answers.
+        """
+        if self.state is None:
+            self.pending_answers = []
+            return []
+        latencies = []
+        deadline = time.perf_counter() + self.answer_timeout
+        while self.pending_answers and time.perf_counter() < deadline:
+            pending = []
+            for recipient, scheduled in self.pending_answers:
+                answered_at = self.state.pop_answered_at(recipient)
+                if answered_at is None:
+                    pending.append((recipient, scheduled))
+                else:
+                    latencies.append(answered_at - scheduled)
+            self.pending_answers = pending
+            if pending:
+                time.sleep(0.05)
+        return latencies
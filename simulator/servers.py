@@ -0,0 +1,239 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import re
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Text, Tuple
+
+from ..parsers.cloud_api import RasaBackend
+from ..serialization import dumps, loads
+from .faults import FaultProfile
+
+CLOUD_API_MESSAGES_PATH = re.compile(r"^/[^/]+/[^/]*/messages$")
+SERPRO_MESSAGES_PATH = re.compile(
+    r"^/client/[^/]*/v2/requisicao/mensagem/(texto|interativa-botoes|interativa-lista)$"
+)
+SERPRO_WEBHOOK_PATH = re.compile(r"^/client/[^/]*/v2/webhook$")
+SERPRO_OAUTH2_PATH = "/oauth2/token"
+RASA_REST_PATH = "/webhooks/rest/webhook"
+STATS_PATH = "/_simulator/stats"
+
+SERVICES = ("cloud_api", "serpro", "rasa")
+
+
+@dataclass
+class SimulatorState:
+    """
+    Shared by every request of a simulator: the fault profile of each
+    service, the Serpro tokens issued and what was received.
+
+    Serpro tokens stop being accepted token_lifetime seconds after they are
+    issued, even when the OAuth response promised more, so clients see the
+    401 of an expired token.
+    """
+
+    profiles: Dict[Text, FaultProfile] = field(
+        default_factory=lambda: {service: FaultProfile() for service in SERVICES}
+    )
+    token_lifetime: float = 3600.0
+    token_expires_in: int = 3600
+    # Retry-After header of throttled responses, in seconds.
+    retry_after: int = 1
+    answers: List[Dict] = field(default_factory=lambda: RasaBackend().answers)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.tokens: Dict[Text, float] = {}
+        self.answered_at: Dict[Text, float] = {}
+
+    def count(self, service: Text, status: int):
+        with self._lock:
+            self.requests[f"{service} {status}"] += 1
+
+    def issue_token(self) -> Text:
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens[token] = time.monotonic() + self.token_lifetime
+        return token
+
+    def token_is_valid(self, authorization: Text | None) -> bool:
+        if not authorization or not authorization.startswith("Bearer "):
+            return False
+        expires_at = self.tokens.get(authorization[len("Bearer ") :])
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def record_answer(self, recipient: Text):
+        """
+        Keeps the time the first answer to recipient arrived.
+        """
+        with self._lock:
+            self.answered_at.setdefault(recipient, time.perf_counter())
+
+    def pop_answered_at(self, recipient: Text) -> float | None:
+        with self._lock:
+            return self.answered_at.pop(recipient, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "tokens_issued": len(self.tokens),
+            }
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """
+    Serves the Cloud API messages endpoint, the Serpro OAuth, messages and
+    webhook registration endpoints and the Rasa REST channel.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    @property
+    def state(self) -> SimulatorState:
+        return self.server.state
+
+    def do_GET(self):
+        if self.path == STATS_PATH:
+            return self._reply(200, self.state.stats())
+        return self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?", 1)[0]
+        if CLOUD_API_MESSAGES_PATH.match(path):
+            return self._cloud_api_message(body)
+        if SERPRO_MESSAGES_PATH.match(path):
+            return self._serpro_message(body)
+        if path == SERPRO_OAUTH2_PATH:
+            return self._serpro_oauth2()
+        if SERPRO_WEBHOOK_PATH.match(path):
+            return self._serpro_webhook()
+        if path == RASA_REST_PATH:
+            return self._rasa_message(body)
+        return self._reply(404, {"error": "not found"})
+
+    def _fault(self, service: Text) -> Tuple[int, Dict] | None:
+        """
+        Waits the service latency and returns the throttled or failed
+        response drawn for this request, if any.
+        """
+        profile = self.state.profiles[service]
+        profile.delay()
+        fault = profile.pick_fault()
+        if fault == "throttle":
+            if service == "cloud_api":
+                return 429, {
+                    "error": {
+                        "message": "(#130429) Rate limit hit",
+                        "type": "OAuthException",
+                        "code": 130429,
+                    }
+                }
+            return 429, {"mensagem": "Limite de requisições excedido"}
+        if fault == "error":
+            return 503, {"error": "simulated failure"}
+        return None
+
+    def _cloud_api_message(self, body: bytes):
+        fault = self._fault("cloud_api")
+        if fault:
+            return self._reply(*fault, service="cloud_api")
+        message = loads(body)
+        self.state.record_answer(message.get("to", ""))
+        return self._reply(
+            200,
+            {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": message.get("to"), "wa_id": message.get("to")}],
+                "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}],
+            },
+            service="cloud_api",
+        )
+
+    def _serpro_message(self, body: bytes):
+        if not self.state.token_is_valid(self.headers.get("Authorization")):
+            return self._reply(401, {"mensagem": "Token inválido"}, service="serpro")
+        fault = self._fault("serpro")
+        if fault:
+            return self._reply(*fault, service="serpro")
+        message = loads(body)
+        self.state.record_answer(message.get("destinatario", ""))
+        return self._reply(200, {"id": uuid.uuid4().hex}, service="serpro")
+
+    def _serpro_oauth2(self):
+        fault = self._fault("serpro")
+        if fault:
+            return self._reply(*fault, service="serpro_oauth")
+        return self._reply(
+            200,
+            {
+                "access_token": self.state.issue_token(),
+                "token_type": "Bearer",
+                "expires_in": self.state.token_expires_in,
+            },
+            service="serpro_oauth",
+        )
+
+    def _serpro_webhook(self):
+        if not self.state.token_is_valid(self.headers.get("Authorization")):
+            return self._reply(401, {"mensagem": "Token inválido"}, service="serpro")
+        return self._reply(200, {}, service="serpro")
+
+    def _rasa_message(self, body: bytes):
+        fault = self._fault("rasa")
+        if fault:
+            return self._reply(*fault, service="rasa")
+        sender = loads(body).get("sender")
+        answers = [{**answer, "recipient_id": sender} for answer in self.state.answers]
+        return self._reply(200, answers, service="rasa")
+
+    def _reply(self, status: int, payload, service: Text = ""):
+        if service:
+            self.state.count(service, status)
+        body = dumps(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", str(self.state.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[Text, int], state: SimulatorState):
+        super().__init__(address, SimulatorHandler)
+        self.state = state
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a slow response are part of a load test.
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> Text:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_simulator(
+    state: SimulatorState, host: Text = "127.0.0.1", port: int = 0
+) -> SimulatorServer:
+    """
+    Serves the simulator on a daemon thread and returns the server.
+    """
+    server = SimulatorServer((host, port), state)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+import itertools
+import random
+import time
+from typing import Dict, Iterator, List, Text, Tuple
+
+from ..serialization import dumps
+
+MESSAGE = "message"
+STATUS = "status"
+
+STATUS_SEQUENCE = ("sent", "delivered", "read")
+
+
+def cloud_api_delivery(value: Dict) -> Dict:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "110115228401530",
+                "changes": [{"field": "messages", "value": value}],
+            }
+        ],
+    }
+
+
+def user_message(wa_id: Text, message_id: Text, interactive: bool) -> Dict:
+    message = {
+        "from": wa_id,
+        "id": message_id,
+        "timestamp": str(int(time.time())),
+    }
+    if interactive:
+        message["type"] = "interactive"
+        message["interactive"] = {
+            "type": "button_reply",
+            "button_reply": {"id": "Concordar", "title": "Concordar"},
+        }
+    else:
+        message["type"] = "text"
+        message["text"] = {"body": "Olá"}
+    return message
+
+
+def message_event(
+    provider: Text, wa_id: Text, message_id: Text, interactive: bool
+) -> Dict:
+    contacts = [{"profile": {"name": "Participante"}, "wa_id": wa_id}]
+    messages = [user_message(wa_id, message_id, interactive)]
+    if provider == "serpro":
+        return {"contacts": contacts, "messages": messages}
+    return cloud_api_delivery(
+        {
+            "messaging_product": "whatsapp",
+            "metadata": {
+                "display_phone_number": "15550000000",
+                "phone_number_id": "138808512639290",
+            },
+            "contacts": contacts,
+            "messages": messages,
+        }
+    )
+
+
+def status_event(provider: Text, wa_ids: List[Text]) -> Dict:
+    statuses = [
+        {
+            "id": f"wamid.status.{wa_id}",
+            "status": random.choice(STATUS_SEQUENCE),
+            "timestamp": str(int(time.time())),
+            "recipient_id": wa_id,
+        }
+        for wa_id in wa_ids
+    ]
+    if provider == "serpro":
+        return {"statuses": statuses}
+    return cloud_api_delivery(
+        {
+            "messaging_product": "whatsapp",
+            "metadata": {
+                "display_phone_number": "15550000000",
+                "phone_number_id": "138808512639290",
+            },
+            "statuses": statuses,
+        }
+    )
+
+
+@dataclass
+class TrafficMix:
+    """
+    Generates webhook deliveries shaped like production traffic: most are
+    status updates, sent in bursts, and the rest are user messages, each
+    from a new contact so its answers can be told apart.
+
+    Yields (kind, recipient phone, encoded body); the recipient phone is the
+    number the answers are sent to, empty for status deliveries.
+    """
+
+    provider: Text = "cloud_api"
+    message_ratio: float = 0.3
+    interactive_ratio: float = 0.5
+    max_status_burst: int = 5
+
+    def __iter__(self) -> Iterator[Tuple[Text, Text, bytes]]:
+        run_id = int(time.time())
+        for index in itertools.count():
+            # Numbers already carry the ninth digit, so EventContact keeps them.
+            wa_id = f"55619{index % 10**8:08d}"
+            if random.random() < self.message_ratio:
+                message_id = f"wamid.load.{run_id}.{index}"
+                interactive = random.random() < self.interactive_ratio
+                body = dumps(
+                    message_event(self.provider, wa_id, message_id, interactive)
+                )
+                yield MESSAGE, f"+{wa_id}", body
+            else:
+                burst = random.randint(1, self.max_status_burst)
+                body = dumps(status_event(self.provider, [wa_id] * burst))
+                yield STATUS, "", body
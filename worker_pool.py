@@ -0,0 +1,151 @@
+from dataclasses import dataclass
+import logging
+import os
+import queue
+import threading
+from typing import Any, Callable, List, Text
+
+from .config import Config
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FULL_POLICIES = ("reject", "drop_oldest", "drop_newest", "block")
+
+
+@dataclass
+class WebhookWorkerPool:
+    """
+    Bounded in-process queue consumed by a fixed number of worker threads.
+
+    The webhook view calls submit() and returns right away; the workers run
+    handler for every queued event. When the queue is full, queue_full_policy
+    decides what happens:
+
+    - reject: submit() returns False, so the caller can answer with an error
+      and let the provider redeliver the event later.
+    - drop_oldest: the oldest queued event is discarded to make room.
+    - drop_newest: the new event is discarded, submit() still returns True.
+    - block: waits up to block_timeout seconds for room, then rejects.
+    """
+
+    handler: Callable[[Any], None]
+    workers: int = Config.WEBHOOK_WORKERS
+    queue_size: int = Config.WEBHOOK_QUEUE_SIZE
+    queue_full_policy: Text = Config.WEBHOOK_QUEUE_FULL_POLICY
+    block_timeout: float = Config.WEBHOOK_QUEUE_BLOCK_TIMEOUT
+
+    def __post_init__(self):
+        if self.queue_full_policy not in QUEUE_FULL_POLICIES:
+            raise ValueError(
+                f"Invalid queue full policy {self.queue_full_policy!r}, "
+                f"expected one of {QUEUE_FULL_POLICIES}"
+            )
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._pid = None
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        REGISTRY.gauge(
+            "webhook_queue_depth",
+            "Events waiting for a webhook worker.",
+            function=lambda: self.queue.qsize(),
+        )
+        self.enqueued_counter = REGISTRY.counter(
+            "webhook_queue_enqueued_total", "Events accepted by the worker pool."
+        )
+        self.rejected_counter = REGISTRY.counter(
+            "webhook_queue_rejected_total", "Events refused because the queue was full."
+        )
+        self.dropped_counter = REGISTRY.counter(
+            "webhook_queue_dropped_total",
+            "Events discarded because the queue was full.",
+        )
+        self.failed_counter = REGISTRY.counter(
+            "webhook_queue_failed_total", "Events whose handler raised an exception."
+        )
+
+    def start(self):
+        """
+        Starts the worker threads. Threads do not survive a fork, so a pool
+        created before forking is started again in the child process.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self.queue = queue.Queue(maxsize=self.queue_size)
+            self._pid = os.getpid()
+            self._threads = []
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run, name=f"webhook-worker-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, item: Any) -> bool:
+        """
+        Enqueues item to be handled by a worker.
+        Returns False when the event was refused and should be redelivered.
+        """
+        self.start()
+        try:
+            self.queue.put_nowait(item)
+            self.enqueued_counter.inc()
+            return True
+        except queue.Full:
+            return self._on_queue_full(item)
+
+    def _on_queue_full(self, item: Any) -> bool:
+        if self.queue_full_policy == "drop_newest":
+            self.dropped_counter.inc()
+            return True
+        if self.queue_full_policy == "drop_oldest":
+            while True:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped_counter.inc()
+                except queue.Empty:
+                    pass
+                try:
+                    self.queue.put_nowait(item)
+                    self.enqueued_counter.inc()
+                    return True
+                except queue.Full:
+                    continue
+        if self.queue_full_policy == "block":
+            try:
+                self.queue.put(item, timeout=self.block_timeout)
+                self.enqueued_counter.inc()
+                return True
+            except queue.Full:
+                pass
+        self.rejected_counter.inc()
+        return False
+
+    def stop(self, timeout: float | None = None):
+        """
+        Waits for the queued events to be handled and stops the workers.
+        """
+        threads = self._threads
+        for _ in threads:
+            self.queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+        with self._lock:
+            self._threads = []
+            self._pid = None
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.handler(item)
+            except Exception:
+                self.failed_counter.inc()
+                logger.exception("Webhook worker failed to handle event")
+            finally:
+                self.queue.task_done()
@@ -1,75 +1,137 @@
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Text
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Text
 import re
 
-from .clients.serpro_api_client import SerproApiClient
-from .clients.cloud_api_client import CloudApiClient
+from .clients.registry import get_client_registry
 from .parsers.cloud_api import CloudApiMessagesParser
 from .parsers.serpro import SerproApiMessagesParser
-from .message import InteractiveMessage, TextMessage, NotSupportedMessage
+from .message import (
+    MEDIA_TYPES,
+    InteractiveMessage,
+    MediaMessage,
+    NotSupportedMessage,
+    TextMessage,
+)
 
+# Shared by every event, never copied.
+MESSAGE_TYPES: Mapping[Text, Any] = MappingProxyType(
+    {
+        "interactive": InteractiveMessage,
+        "text": TextMessage,
+        **{media_type: MediaMessage for media_type in MEDIA_TYPES},
+    }
+)
 
-@dataclass
+PHONE_WITH_NINTH_DIGIT = re.compile(r"\d{4}9")
+
+
+@dataclass(slots=True)
 class CloudApiEvent:
     """
     Implements the logic to deal with Cloud API webhook events.
+
+    value is the change value read by get_event_key. It is looked up once,
+    from the first change of the first entry, unless it is given.
     """
 
     event: Dict
+    value: Dict | None = None
+
+    def __post_init__(self):
+        if self.value is None:
+            self.value = self.event["entry"][0]["changes"][0].get("value")
 
     def get_event_key(self, key: Text):
         """
-        Retrieves a key from self.event dictionary.
+        Retrieves a key from the event change value.
+        """
+        return self.value.get(key)
+
+    def iter_values(self) -> Iterator[Dict]:
+        """
+        Yields the value of every change of every entry.
         """
-        event_changes = self.event["entry"][0]["changes"][0]
-        event_value = event_changes.get("value")
-        return event_value.get(key)
+        for entry in self.event.get("entry") or []:
+            for change in entry.get("changes") or []:
+                yield change.get("value") or {}
+
+    def for_message(
+        self, value: Dict, contacts: List, message: Dict
+    ) -> "CloudApiEvent":
+        """
+        Returns an event source holding only one message of value.
+        """
+        return CloudApiEvent(
+            self.event,
+            {
+                "metadata": value.get("metadata"),
+                "contacts": contacts,
+                "messages": [message],
+            },
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class SerproEvent:
     """
     Implements the logic to deal with Serpro webhook events.
     """
 
     event: Dict
+    value: Dict | None = None
+
+    def __post_init__(self):
+        if self.value is None:
+            self.value = self.event
 
     def get_event_key(self, key: Text):
         """
         Retrieves a key from self.event dictionary.
         """
-        return self.event.get(key)
+        return self.value.get(key)
+
+    def iter_values(self) -> Iterator[Dict]:
+        yield self.event
 
+    def for_message(self, value: Dict, contacts: List, message: Dict) -> "SerproEvent":
+        return SerproEvent(self.event, {"contacts": contacts, "messages": [message]})
 
-@dataclass
+
+@dataclass(slots=True)
 class EventContact:
     contacts: List
     name: Text = "Participante"
     phone: Text = ""
 
     def __post_init__(self):
-        if self.contacts and len(self.contacts) > 0:
-            self._set_name(self.contacts[0])
+        if self.contacts:
             self._set_phone(self.contacts[0])
+            self._set_name(self.contacts[0])
 
-    def _set_name(self, contact):
+    def _set_phone(self, contact):
         if contact:
             phone_number = contact["wa_id"]
-            if not re.search(r"^(\d{4}9)", phone_number):
+            if not PHONE_WITH_NINTH_DIGIT.match(phone_number):
                 phone_number = phone_number[:4] + "9" + phone_number[4:]
             self.phone = f"+{phone_number}"
 
-    def _set_phone(self, contact):
+    def _set_name(self, contact):
         if contact:
             profile = contact.get("profile")
             if profile:
                 self.name = profile.get("name")
 
 
-@dataclass
+@dataclass(slots=True)
 class WhatsAppEvent:
     """
     Generic implementation to manage WhatsApp API events.
+
+    Building an event does no network I/O: wpp_client is borrowed from the
+    process client registry when it is first accessed. The event dict is
+    walked once; the message is built on the first get_event_message call
+    and reused afterwards.
     """
 
     event: Dict
@@ -77,35 +139,61 @@ class WhatsAppEvent:
     parser_class: SerproApiMessagesParser | CloudApiMessagesParser | None = None
     recipient_phone: Text = ""
     profile_name: Text = "Participante"
-    message_types: Dict[str, Any] = field(
-        default_factory=lambda: {
-            "interactive": InteractiveMessage,
-            "text": TextMessage,
-        }
-    )
+    message_types: Mapping[Text, Any] = field(default_factory=lambda: MESSAGE_TYPES)
     sender_id: Text = ""
-    contact: EventContact = field(default_factory=lambda: EventContact([]))
+    contact: EventContact | None = None
+    _message: (
+        InteractiveMessage | TextMessage | MediaMessage | NotSupportedMessage | None
+    ) = field(default=None, init=False, repr=False)
 
     def __post_init__(self):
+        if self.event_source is None:
+            self.event_source = get_event_source(self.event)
         if self._event_is_from_cloud_api():
-            self.event_source = CloudApiEvent(self.event)
             self.parser_class = CloudApiMessagesParser
-            self.wpp_client = CloudApiClient()
         else:
-            self.event_source = SerproEvent(self.event)
             self.parser_class = SerproApiMessagesParser
-            self.wpp_client = SerproApiClient()
         self._set_contact()
 
+    @property
+    def wpp_client(self):
+        if self._event_is_from_cloud_api():
+            return get_client_registry().cloud_api_client()
+        return get_client_registry().serpro_api_client()
+
+    @property
+    def async_wpp_client(self):
+        if self._event_is_from_cloud_api():
+            return get_client_registry().async_cloud_api_client()
+        return get_client_registry().async_serpro_api_client()
+
+    @property
+    def provider(self) -> Text:
+        """
+        Name of the API the event came from: cloud_api or serpro.
+        """
+        return "cloud_api" if self._event_is_from_cloud_api() else "serpro"
+
     def get_event_message(
         self,
-    ) -> InteractiveMessage | TextMessage | NotSupportedMessage:
+    ) -> InteractiveMessage | TextMessage | MediaMessage | NotSupportedMessage:
+        if self._message is None:
+            event_messages: List = self.get_event_key("messages")
+            if event_messages:
+                message: Dict = event_messages[0]
+                message_class = self.message_types.get(
+                    message.get("type"), NotSupportedMessage
+                )
+                self._message = message_class(message)
+            else:
+                self._message = NotSupportedMessage({})
+        return self._message
+
+    def get_event_message_id(self) -> Text:
         event_messages: List = self.get_event_key("messages")
         if event_messages:
-            message: Dict = event_messages[0]
-            message_class = self.message_types[message.get("type")]
-            return message_class(message)
-        return NotSupportedMessage({})
+            return event_messages[0].get("id", "")
+        return ""
 
     # TODO: check if self.event is a WhatsApp event
     def get_event_key(self, key: Text):
@@ -115,11 +203,112 @@ class WhatsAppEvent:
         """
         Returns true if self.event is a Cloud API webhook event.
         """
-        return (
-            self.event.get("object")
-            and self.event.get("object") == "whatsapp_business_account"
-        )
+        return isinstance(self.event_source, CloudApiEvent)
 
     def _set_contact(self):
         contacts: List = self.get_event_key("contacts")
         self.contact = EventContact(contacts)
+
+
+def get_event_source(event: Dict) -> SerproEvent | CloudApiEvent:
+    if event.get("object") == "whatsapp_business_account":
+        return CloudApiEvent(event)
+    return SerproEvent(event)
+
+
+def iter_message_ids(event: Dict) -> Iterator[Text]:
+    """
+    Yields the id of every message of a webhook delivery.
+    """
+    for value in get_event_source(event).iter_values():
+        for message in value.get("messages") or []:
+            yield message.get("id")
+
+
+@dataclass(slots=True)
+class WhatsAppEventBatch:
+    """
+    Splits a webhook delivery into one WhatsAppEvent per message.
+
+    Under high volume the providers batch several entries, changes, messages
+    and statuses into a single delivery. The batch walks all of them once,
+    pairing each message with the contact that sent it. Messages whose id is
+    refused by accept_message (see idempotency.IdempotencyGuard) are skipped
+    before any WhatsAppEvent is built.
+    """
+
+    event: Dict
+    accept_message: Callable[[Text], bool] | None = None
+    events: List[WhatsAppEvent] = field(default_factory=list)
+    statuses: List[Dict] = field(default_factory=list)
+    duplicates: int = 0
+
+    def __post_init__(self):
+        event_source = get_event_source(self.event)
+        for value in event_source.iter_values():
+            statuses = value.get("statuses")
+            if statuses:
+                self.statuses.extend(statuses)
+            messages: List = value.get("messages")
+            if not messages:
+                continue
+            contacts: List = value.get("contacts") or []
+            contacts_by_id = {contact.get("wa_id"): contact for contact in contacts}
+            for message in messages:
+                if self.accept_message and not self.accept_message(message.get("id")):
+                    self.duplicates += 1
+                    continue
+                contact = contacts_by_id.get(message.get("from"))
+                if contact is None and len(contacts) == 1:
+                    contact = contacts[0]
+                if contact is None and message.get("from"):
+                    contact = {"wa_id": message.get("from")}
+                self.events.append(
+                    WhatsAppEvent(
+                        event=self.event,
+                        event_source=event_source.for_message(
+                            value, [contact] if contact else [], message
+                        ),
+                    )
+                )
+
+
+def coalesce_events(whatsapp_events: List[WhatsAppEvent]) -> List[WhatsAppEvent]:
+    """
+    Merges consecutive text messages of a contact into a single event whose
+    text is their texts joined by line breaks. Other messages, such as
+    button replies, are kept as they are and in order.
+
+    A merged event carries the last message, so its id is the id of the
+    last message merged.
+    """
+    coalesced: List[WhatsAppEvent] = []
+    texts: List[WhatsAppEvent] = []
+
+    def flush():
+        if len(texts) == 1:
+            coalesced.append(texts[0])
+        elif texts:
+            last = texts[-1]
+            text = "\n".join(event.get_event_message().text for event in texts)
+            message = {**last.get_event_key("messages")[0], "text": {"body": text}}
+            coalesced.append(
+                WhatsAppEvent(
+                    event=last.event,
+                    event_source=last.event_source.for_message(
+                        last.event_source.value,
+                        last.get_event_key("contacts") or [],
+                        message,
+                    ),
+                )
+            )
+        texts.clear()
+
+    for whatsapp_event in whatsapp_events:
+        if isinstance(whatsapp_event.get_event_message(), TextMessage):
+            texts.append(whatsapp_event)
+        else:
+            flush()
+            coalesced.append(whatsapp_event)
+    flush()
+    return coalesced